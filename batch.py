@@ -0,0 +1,488 @@
+#Lockstep batched execution
+#Runs one program over many independent inputs at once. Every lane of a batch
+#executed the same instructions so far, so frames, defined variables, their
+#types, the call stack and the number of lines read are the same in all lanes,
+#only the values differ. Values are held as NumPy arrays with one element per
+#lane: int64 for ints, bool for "true"/"false" and object arrays for strings.
+#
+#A conditional jump going both ways splits the batch into two batches which
+#continue separately. Lanes which would fail on their own (division by zero, end
+#of input) or whose ints could leave the int64 range are ejected, anything the
+#batch does not handle (other instructions, type errors, missing variables)
+#ejects the whole batch. Ejected lanes are run again from the start by the
+#regular interpreter, so every lane gets exactly the output of a separate run.
+
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+import instruct
+import scheduler
+
+#Lanes whose int results get this big are run by the regular interpreter,
+#whose ints never overflow
+INT_LIMIT = 2.0 ** 62
+
+DEFAULTS = {"int": 0, "string": "", "bool": "false"} #MOVE of a literal without value
+
+class Fallback(Exception):
+    """The batch reached something only the regular interpreter handles"""
+
+class BatchVariable:
+    """Variable of a batch, values holds one element per lane"""
+
+    def __init__(self, var_type=None, values=None):
+        self.var_type = var_type
+        self.values = values
+
+    def take(self, mask):
+        return BatchVariable(self.var_type, None if self.values is None else self.values[mask])
+
+class Batch:
+    """Lanes executing in lockstep and their common state"""
+
+    def __init__(self, lanes):
+        self.lanes = lanes #Indices of the inputs
+        self.counter = 1
+        self.globalFrame = dict()
+        self.frameStack = list()
+        self.tempFrame = None
+        self.callStack = list()
+        self.inputPosition = 0
+
+    def select(self, mask):
+        """Returns batch of the lanes selected by boolean mask"""
+        def copyFrame(frame):
+            return None if frame is None else {name: var.take(mask) for name, var in frame.items()}
+
+        other = Batch(self.lanes[mask])
+        other.counter = self.counter
+        other.globalFrame = copyFrame(self.globalFrame)
+        other.frameStack = [copyFrame(frame) for frame in self.frameStack]
+        other.tempFrame = copyFrame(self.tempFrame)
+        other.callStack = list(self.callStack)
+        other.inputPosition = self.inputPosition
+        return other
+
+def kind(values):
+    """Storage of values, "i" int, "b" bool or "O" string"""
+    if isinstance(values, np.ndarray):
+        return values.dtype.kind
+    return {int: "i", bool: "b", str: "O"}[type(values)]
+
+def broadcast(values, n):
+    if isinstance(values, np.ndarray):
+        return values
+    return np.full(n, values, dtype=object if type(values) is str else type(values))
+
+def formatValue(value):
+    if type(value) is bool:
+        return "true" if value else "false"
+    return str(value)
+
+class BatchInterpreter:
+    """Runs program source over a list of inputs, see the module comment"""
+
+    def __init__(self, source, inputs, options=None):
+        self.source = source
+        self.inputs = [text.split("\n") for text in inputs]
+        for lines in self.inputs:
+            if lines[-1] == "":
+                lines.pop() #Text ends with a newline, no empty line behind it
+        self.options = options or dict() #Interpreter attributes of the fallback runs
+        self.outputs = [list() for text in inputs]
+        self.results = [None] * len(inputs) #(stdout, stderr, exit code) of every input
+        self.ejected = list()
+        self.pending = list() #Batches split off by conditional jumps
+        self.decoded = dict() #Decoded operands by instruction order
+        self.batch = None
+        self.stats = {"lanes": len(inputs), "batches": 0, "ejected": 0}
+
+        self.handlers = {"DEFVAR": self.insDEFVAR, "MOVE": self.insMOVE,
+                         "CREATEFRAME": self.insCREATEFRAME, "PUSHFRAME": self.insPUSHFRAME, "POPFRAME": self.insPOPFRAME,
+                         "JUMP": self.insJUMP, "JUMPIFEQ": self.insJUMPIF, "JUMPIFNEQ": self.insJUMPIF,
+                         "CALL": self.insCALL, "RETURN": self.insRETURN,
+                         "ADD": self.insArithmetic, "SUB": self.insArithmetic, "MUL": self.insArithmetic,
+                         "IDIV": self.insIDIV, "LT": self.insCompare, "GT": self.insCompare, "EQ": self.insCompare,
+                         "AND": self.insLogic, "OR": self.insLogic, "NOT": self.insNOT,
+                         "CONCAT": self.insCONCAT, "STRLEN": self.insSTRLEN,
+                         "WRITE": self.insWRITE, "READ": self.insREAD}
+
+    def run(self):
+        """Returns list of (stdout, stderr, exit code), one for every input"""
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = io.StringIO()
+        try:
+            #Load errors are reported by the fallback runs
+            self.interpreter = instruct.Interpreter(self.source)
+            self.interpreter.buildLabels()
+            self.interpreter.internConstants()
+            self.program = self.interpreter.buildProgram()
+            self.totalInstructions = self.interpreter.programLength() + 1
+            self.pending.append(Batch(np.arange(len(self.inputs))))
+        except SystemExit:
+            self.ejected.extend(range(len(self.inputs)))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+        while self.pending:
+            self.runBatch(self.pending.pop())
+
+        for lane in self.ejected:
+            self.results[lane] = self.runAlone(lane)
+        self.stats["ejected"] = len(self.ejected)
+        return self.results
+
+    def runAlone(self, lane):
+        """Runs single input by the regular interpreter"""
+        job = scheduler.Job(self.source, "".join(line + "\n" for line in self.inputs[lane]), options=self.options)
+        while job.step(None):
+            pass
+        return (job.stdout.getvalue(), job.stderr.getvalue(), job.returncode)
+
+    def runBatch(self, batch):
+        self.batch = batch
+        self.stats["batches"] += 1
+        program = self.program
+        handlers = self.handlers
+
+        while self.batch.counter != self.totalInstructions and len(self.batch.lanes):
+            instruction = program.get(self.batch.counter)
+            try:
+                if instruction is None:
+                    raise Fallback()
+                if instruction.opcode != "LABEL":
+                    handler = handlers.get(instruction.opcode)
+                    if handler is None:
+                        raise Fallback()
+                    handler(instruction)
+            except Fallback:
+                self.ejected.extend(self.batch.lanes.tolist())
+                return
+            self.batch.counter += 1
+
+        for lane in self.batch.lanes.tolist():
+            self.results[lane] = ("".join(line + "\n" for line in self.outputs[lane]), "", 0)
+
+    def eject(self, mask):
+        """Ejects lanes selected by mask from the current batch"""
+        if mask.any():
+            self.ejected.extend(self.batch.lanes[mask].tolist())
+            self.batch = self.batch.select(~mask)
+
+    #Operands
+
+    def operands(self, instruction):
+        """Decoded operands, ("var", frame, name) or ("literal", type, value)"""
+        decoded = self.decoded.get(instruction.order)
+        if decoded is None:
+            decoded = list()
+            try:
+                for op in instruction.ops_list:
+                    op.check()
+                    if op.v_type == "var":
+                        frame, name = op.value.split("@")
+                        decoded.append(("var", frame, name))
+                    else:
+                        decoded.append(("literal", op.v_type, op.value))
+            except SystemExit:
+                decoded = None #Invalid operand, the regular interpreter reports it
+            self.decoded[instruction.order] = decoded
+        if decoded is None:
+            raise Fallback()
+        return decoded
+
+    def frame(self, name):
+        batch = self.batch
+        if name == "GF":
+            frame = batch.globalFrame
+        elif name == "LF":
+            frame = batch.frameStack[-1] if batch.frameStack else None
+        else:
+            frame = batch.tempFrame
+        if frame is None:
+            raise Fallback()
+        return frame
+
+    def variable(self, operand):
+        if operand[0] != "var":
+            raise Fallback()
+        var = self.frame(operand[1]).get(operand[2])
+        if var is None:
+            raise Fallback()
+        return var
+
+    def read(self, operand):
+        """Returns (type, values) of operand, values of a literal are a scalar"""
+        if operand[0] == "var":
+            var = self.variable(operand)
+            if var.var_type is None:
+                raise Fallback() #Uninitialized
+            return var.var_type, var.values
+
+        v_type, value = operand[1], operand[2]
+        if value is None:
+            raise Fallback()
+        if v_type == "int":
+            if not -INT_LIMIT < value < INT_LIMIT:
+                raise Fallback()
+            return v_type, value
+        elif v_type == "bool":
+            return v_type, value == "true"
+        elif v_type == "string":
+            return v_type, value
+        raise Fallback()
+
+    def write(self, operand, var_type, values):
+        var = self.variable(operand)
+        var.var_type = var_type
+        var.values = broadcast(values, len(self.batch.lanes))
+
+    def label(self, operand):
+        if operand[0] != "literal":
+            raise Fallback()
+        label_dict = self.interpreter.findLabel(operand[2])
+        if label_dict == -1:
+            raise Fallback()
+        return label_dict[operand[2]]
+
+    #Instructions
+
+    def insDEFVAR(self, instruction):
+        ops = self.operands(instruction)
+        frame = self.frame(ops[0][1])
+        if ops[0][2] in frame:
+            raise Fallback()
+        frame[ops[0][2]] = BatchVariable()
+
+    def insMOVE(self, instruction):
+        ops = self.operands(instruction)
+        if ops[1][0] == "literal" and ops[1][2] is None and ops[1][1] in DEFAULTS:
+            self.write(ops[0], ops[1][1], self.read(("literal", ops[1][1], DEFAULTS[ops[1][1]]))[1])
+        else:
+            self.write(ops[0], *self.read(ops[1]))
+
+    def insCREATEFRAME(self, instruction):
+        self.batch.tempFrame = dict()
+
+    def insPUSHFRAME(self, instruction):
+        if self.batch.tempFrame is None:
+            raise Fallback()
+        self.batch.frameStack.append(self.batch.tempFrame)
+        self.batch.tempFrame = None
+
+    def insPOPFRAME(self, instruction):
+        if not self.batch.frameStack:
+            raise Fallback()
+        self.batch.tempFrame = self.batch.frameStack.pop()
+
+    def insJUMP(self, instruction):
+        self.batch.counter = self.label(self.operands(instruction)[0])
+
+    def insJUMPIF(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        b_type, b = self.read(ops[2])
+        if a_type != b_type or kind(a) != kind(b):
+            raise Fallback()
+
+        taken = np.asarray(a == b if instruction.opcode == "JUMPIFEQ" else a != b, dtype=bool)
+        if taken.ndim == 0:
+            taken = np.full(len(self.batch.lanes), bool(taken))
+
+        if taken.all():
+            self.batch.counter = self.label(ops[0])
+        elif taken.any():
+            #Lanes go both ways, the ones not jumping continue as a new batch
+            target = self.label(ops[0])
+            rest = self.batch.select(~taken)
+            rest.counter += 1
+            self.pending.append(rest)
+            self.batch = self.batch.select(taken)
+            self.batch.counter = target
+
+    def insCALL(self, instruction):
+        ops = self.operands(instruction)
+        if ops[0][1] != "label":
+            raise Fallback()
+        target = self.label(ops[0])
+        self.batch.callStack.append(instruction.order)
+        self.batch.counter = target
+
+    def insRETURN(self, instruction):
+        if not self.batch.callStack:
+            raise Fallback()
+        self.batch.counter = self.batch.callStack.pop()
+
+    def intOperands(self, ops):
+        a_type, a = self.read(ops[1])
+        b_type, b = self.read(ops[2])
+        if a_type != "int" or b_type != "int" or kind(a) != "i" or kind(b) != "i":
+            raise Fallback()
+        return a, b
+
+    def insArithmetic(self, instruction):
+        ops = self.operands(instruction)
+        a, b = self.intOperands(ops)
+        opcode = instruction.opcode
+
+        #Lanes whose result could overflow int64 are left to the regular interpreter
+        af = np.asarray(a, dtype=np.float64)
+        bf = np.asarray(b, dtype=np.float64)
+        exact = af + bf if opcode == "ADD" else af - bf if opcode == "SUB" else af * bf
+        overflow = np.abs(exact) >= INT_LIMIT
+        if overflow.ndim == 0:
+            if overflow:
+                raise Fallback()
+        elif overflow.any():
+            self.eject(overflow)
+            a, b = self.intOperands(ops)
+
+        if opcode == "ADD":
+            result = np.add(a, b, dtype=np.int64)
+        elif opcode == "SUB":
+            result = np.subtract(a, b, dtype=np.int64)
+        else:
+            result = np.multiply(a, b, dtype=np.int64)
+        self.write(ops[0], "int", result)
+
+    def insIDIV(self, instruction):
+        ops = self.operands(instruction)
+        a, b = self.intOperands(ops)
+        zero = np.asarray(b) == 0
+        if zero.ndim == 0:
+            if zero:
+                raise Fallback()
+        elif zero.any():
+            self.eject(zero)
+            a, b = self.intOperands(ops)
+        self.write(ops[0], "int", np.floor_divide(a, b, dtype=np.int64))
+
+    def insCompare(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        b_type, b = self.read(ops[2])
+        if a_type != b_type or kind(a) != kind(b):
+            raise Fallback()
+
+        opcode = instruction.opcode
+        if opcode == "LT":
+            result = a < b
+        elif opcode == "GT":
+            result = a > b
+        else:
+            result = a == b
+        #The result keeps the type of the operands, the same as Ins_LT, Ins_GT and Ins_EQ
+        self.write(ops[0], a_type, np.asarray(result, dtype=bool) if isinstance(result, np.ndarray) else bool(result))
+
+    def insLogic(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        b_type, b = self.read(ops[2])
+        if a_type != "bool" or b_type != "bool" or kind(a) != "b" or kind(b) != "b":
+            raise Fallback()
+        self.write(ops[0], "bool", np.logical_and(a, b) if instruction.opcode == "AND" else np.logical_or(a, b))
+
+    def insNOT(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        if a_type != "bool" or kind(a) != "b":
+            raise Fallback()
+        self.write(ops[0], "bool", np.logical_not(a))
+
+    def insCONCAT(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        b_type, b = self.read(ops[2])
+        if a_type != "string" or b_type != "string" or kind(a) != "O" or kind(b) != "O":
+            raise Fallback()
+        self.write(ops[0], "string", a + b)
+
+    def insSTRLEN(self, instruction):
+        ops = self.operands(instruction)
+        a_type, a = self.read(ops[1])
+        if a_type != "string" or kind(a) != "O":
+            raise Fallback()
+        if isinstance(a, np.ndarray):
+            self.write(ops[0], "int", np.fromiter((len(s) for s in a), dtype=np.int64, count=len(a)))
+        else:
+            self.write(ops[0], "int", len(a))
+
+    def insWRITE(self, instruction):
+        ops = self.operands(instruction)
+        v_type, values = self.read(ops[0])
+        outputs = self.outputs
+        lanes = self.batch.lanes.tolist()
+        if isinstance(values, np.ndarray):
+            for lane, value in zip(lanes, values.tolist()):
+                outputs[lane].append(formatValue(value))
+        else:
+            text = formatValue(values)
+            for lane in lanes:
+                outputs[lane].append(text)
+
+    def insREAD(self, instruction):
+        ops = self.operands(instruction)
+        if ops[1][0] != "literal" or ops[1][1] != "type":
+            raise Fallback()
+        self.variable(ops[0])
+        var_type = ops[1][2]
+
+        #Lanes at the end of their input fail on their own
+        position = self.batch.inputPosition
+        inputs = self.inputs
+        eof = np.array([position >= len(inputs[lane]) for lane in self.batch.lanes.tolist()], dtype=bool)
+        self.eject(eof)
+
+        values = [instruct.convertInput(inputs[lane][position], var_type) for lane in self.batch.lanes.tolist()]
+        if var_type == "int":
+            big = np.array([not -INT_LIMIT < value < INT_LIMIT for value in values], dtype=bool)
+            if big.any():
+                self.eject(big)
+                values = [value for value, drop in zip(values, big.tolist()) if not drop]
+            values = np.array(values, dtype=np.int64)
+        elif var_type == "bool":
+            values = np.array([value == "true" for value in values], dtype=bool)
+        else:
+            values = np.array(values, dtype=object)
+        self.batch.inputPosition = position + 1
+        self.write(ops[0], var_type, values)
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs one IPPcode18 program over many inputs in lockstep')
+    parser.add_argument('--source', help='Program to run', required=True)
+    parser.add_argument('inputs', help='Input files, one run for every file', nargs='+')
+    parser.add_argument('--out', help='Directory for outputs of the runs, N.out, N.err and N.code for the N-th input')
+    args = parser.parse_args()
+
+    if os.path.isfile(args.source) is False:
+        print("Specified file does not exist, exiting...")
+        exit(11)
+
+    inputs = list()
+    for path in args.inputs:
+        with open(path, encoding="utf-8") as f:
+            inputs.append(f.read())
+
+    start = time.perf_counter()
+    batch = BatchInterpreter(args.source, inputs)
+    results = batch.run()
+    elapsed = time.perf_counter() - start
+
+    if args.out is not None:
+        for i, (stdout, stderr, returncode) in enumerate(results):
+            base = os.path.join(args.out, str(i))
+            with open(base + ".out", "w", encoding="utf-8") as f:
+                f.write(stdout)
+            with open(base + ".err", "w", encoding="utf-8") as f:
+                f.write(stderr)
+            with open(base + ".code", "w") as f:
+                f.write("{0}\n".format(returncode))
+
+    print("{0} runs in {1:.3f} s, {2} batches, {3} runs ejected to the regular interpreter".format(
+        len(results), elapsed, batch.stats["batches"], batch.stats["ejected"]), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
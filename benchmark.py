@@ -0,0 +1,640 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INTERPRET = os.path.join(HERE, "interpret.py")
+
+def writeXML(path, instructions):
+    """Writes program given as list of (opcode, [(type, text), ...]) in the XML format"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode18">']
+    for order, (opcode, args) in enumerate(instructions, 1):
+        lines.append('\t<instruction order="{0}" opcode="{1}">'.format(order, opcode))
+        for i, (v_type, text) in enumerate(args, 1):
+            lines.append('\t\t<arg{0} type="{1}">{2}</arg{0}>'.format(i, v_type, escape(text)))
+        lines.append('\t</instruction>')
+    lines.append('</program>')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def writeText(path, instructions):
+    """Writes program given as list of (opcode, [(type, text), ...]) in the IPPcode18 text format"""
+    lines = [".IPPcode18"]
+    for opcode, args in instructions:
+        operands = list()
+        for v_type, text in args:
+            operands.append(text if v_type in {"var", "label", "type"} else "{0}@{1}".format(v_type, text))
+        lines.append(" ".join([opcode] + operands))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def straightProgram(size):
+    """Long program without loops, used to measure loading"""
+    instructions = [("DEFVAR", [("var", "GF@a")]), ("DEFVAR", [("var", "GF@s")])]
+    for i in range(size // 4):
+        instructions.append(("MOVE", [("var", "GF@a"), ("int", str(i))]))
+        instructions.append(("ADD", [("var", "GF@a"), ("var", "GF@a"), ("int", "1")]))
+        instructions.append(("CONCAT", [("var", "GF@s"), ("string", "abc"), ("string", "x\\032y")]))
+        instructions.append(("LABEL", [("label", "l{0}".format(i))]))
+    return instructions
+
+def sparseProgram(size):
+    """Long program of small functions of which a run executes one, i.e. sparse coverage"""
+    functions = max(1, size // 6)
+    instructions = [("DEFVAR", [("var", "GF@a")]),
+                    ("DEFVAR", [("var", "GF@s")]),
+                    ("JUMP", [("label", "f{0}".format(functions // 2))])]
+    for i in range(functions):
+        instructions += [("LABEL", [("label", "f{0}".format(i))]),
+                         ("MOVE", [("var", "GF@a"), ("int", str(i))]),
+                         ("ADD", [("var", "GF@a"), ("var", "GF@a"), ("int", "1")]),
+                         ("CONCAT", [("var", "GF@s"), ("string", "abc"), ("string", "x\\032y")]),
+                         ("WRITE", [("var", "GF@a")]),
+                         ("JUMP", [("label", "end")])]
+    instructions += [("LABEL", [("label", "end")]),
+                     ("WRITE", [("var", "GF@s")])]
+    return instructions
+
+def loopProgram(iterations):
+    """Arithmetic loop with a compare and a conditional jump, the typical hot loop"""
+    return [("DEFVAR", [("var", "GF@i")]),
+            ("DEFVAR", [("var", "GF@s")]),
+            ("DEFVAR", [("var", "GF@c")]),
+            ("MOVE", [("var", "GF@i"), ("int", "0")]),
+            ("MOVE", [("var", "GF@s"), ("int", "0")]),
+            ("LABEL", [("label", "loop")]),
+            ("ADD", [("var", "GF@i"), ("var", "GF@i"), ("int", "1")]),
+            ("MUL", [("var", "GF@c"), ("var", "GF@i"), ("int", "3")]),
+            ("ADD", [("var", "GF@s"), ("var", "GF@s"), ("var", "GF@c")]),
+            ("LT", [("var", "GF@c"), ("var", "GF@i"), ("int", "7")]),
+            ("JUMPIFNEQ", [("label", "loop"), ("var", "GF@i"), ("int", str(iterations))]),
+            ("WRITE", [("var", "GF@s")])]
+
+def escapeProgram(iterations, escaped):
+    """Loop of string instructions with literals full of \\ddd escape sequences, or without escapes"""
+    if escaped:
+        first, second = "a\\032b\\092c\\035d\\010e", "\\032\\032x\\035\\092"
+    else:
+        first, second = "a_b_c_d_e", "__x__"
+    return [("DEFVAR", [("var", "GF@i")]),
+            ("DEFVAR", [("var", "GF@s")]),
+            ("DEFVAR", [("var", "GF@n")]),
+            ("MOVE", [("var", "GF@i"), ("int", "0")]),
+            ("LABEL", [("label", "loop")]),
+            ("ADD", [("var", "GF@i"), ("var", "GF@i"), ("int", "1")]),
+            ("MOVE", [("var", "GF@s"), ("string", first)]),
+            ("CONCAT", [("var", "GF@s"), ("var", "GF@s"), ("string", second)]),
+            ("CONCAT", [("var", "GF@s"), ("string", second), ("var", "GF@s")]),
+            ("STRLEN", [("var", "GF@n"), ("var", "GF@s")]),
+            ("JUMPIFEQ", [("label", "skip"), ("var", "GF@s"), ("string", first)]),
+            ("LABEL", [("label", "skip")]),
+            ("JUMPIFNEQ", [("label", "loop"), ("var", "GF@i"), ("int", str(iterations))]),
+            ("WRITE", [("var", "GF@s")])]
+
+def runInterpreter(source, options=(), stdin=None, repeat=3):
+    """Runs interpret.py, returns (best wall time, completed process of the last run)"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, INTERPRET, "--source", source] + list(options),
+                              input=stdin, capture_output=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, proc
+
+def compare(name, baseline, measured):
+    print("{0:<40} {1:8.3f} s  {2:8.3f} s  {3:6.2f}x".format(name, baseline, measured, measured / baseline))
+
+def benchTraceOverhead(args, tmp):
+    """Overhead of recording the execution trace against a default run and the base tier
+
+    A traced run keeps compiled traces and basic blocks, it records whole blocks
+    and trace iterations and encodes them when the buffer is flushed."""
+    source = os.path.join(tmp, "loop.xml")
+    writeXML(source, loopProgram(args.iterations))
+    trace = os.path.join(tmp, "loop.trace")
+
+    default, _ = runInterpreter(source, repeat=args.repeat)
+    base, _ = runInterpreter(source, ["--tier", "base"], repeat=args.repeat)
+    tracedBase, _ = runInterpreter(source, ["--tier", "base", "--exec-trace", trace], repeat=args.repeat)
+    traced, _ = runInterpreter(source, ["--exec-trace", trace], repeat=args.repeat)
+    executed = args.iterations * 5 + 6
+
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "baseline", "measured", "ratio"))
+    compare("exec trace vs default, {0} instr.".format(executed), default, traced)
+    compare("exec trace vs base tier, both base tier", base, tracedBase)
+    print("trace size: {0} bytes, {1:.2f} bytes per instruction".format(
+        os.path.getsize(trace), os.path.getsize(trace) / executed))
+
+def measureLoad(source, repeat, decompress=None):
+    """Best time of constructing the Interpreter, i.e. parsing the program
+
+    With decompress (gzip, bz2 or lzma) the compressed source is first decompressed
+    to a temporary file, which is included in the time."""
+    load = "instruct.Interpreter({0!r})".format(source)
+    if decompress is not None:
+        load = ("import {0}, shutil, tempfile\n"
+                "with {0}.open({1!r}) as f, tempfile.NamedTemporaryFile(suffix='.xml') as out:\n"
+                "    shutil.copyfileobj(f, out); out.flush(); instruct.Interpreter(out.name)").format(decompress, source)
+    code = ("import sys, time; sys.path.insert(0, {0!r}); import instruct\n"
+            "start = time.perf_counter()\n{1}\n"
+            "print(time.perf_counter() - start)").format(HERE, load)
+    best = None
+    for i in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        elapsed = float(proc.stdout)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measureStart(source, lazy, repeat):
+    """Best (time to the first instruction, whole run time, peak RSS in bytes) of a run in a new process"""
+    code = ("import io, resource, sys, time; sys.path.insert(0, {0!r}); import instruct\n"
+            "start = time.perf_counter()\n"
+            "interpreter = instruct.Interpreter({1!r}, lazy={2!r})\n"
+            "interpreter.prepare()\n"
+            "ready = time.perf_counter() - start\n"
+            "stdout, sys.stdout = sys.stdout, io.StringIO()\n"
+            "interpreter.run()\n"
+            "interpreter.finish()\n"
+            "sys.stdout = stdout\n"
+            "print(ready, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)").format(HERE, source, lazy)
+    best = None
+    for i in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        measured = [float(value) for value in proc.stdout.split()]
+        best = measured if best is None else [min(a, b) for a, b in zip(best, measured)]
+    return best
+
+def benchLazy(args, tmp):
+    """Lazy decoding against loading every instruction, on a large program with sparse coverage"""
+    source = os.path.join(tmp, "sparse.xml")
+    instructions = sparseProgram(args.size)
+    writeXML(source, instructions)
+
+    print("{0} instructions, about 10 of them executed".format(len(instructions)))
+    print("{0:<8} {1:>22} {2:>12} {3:>12}".format("mode", "time to 1st instruction", "run time", "peak RSS"))
+    for lazy in (False, True):
+        ready, total, rss = measureStart(source, lazy, args.repeat)
+        print("{0:<8} {1:>20.3f} s {2:>10.3f} s {3:>9.1f} MB".format("lazy" if lazy else "eager", ready, total, rss / 2**20))
+
+def benchLoad(args, tmp):
+    """Load throughput of the XML and the IPPcode18 text format"""
+    instructions = straightProgram(args.size)
+    xml = os.path.join(tmp, "straight.xml")
+    text = os.path.join(tmp, "straight.IPPcode18")
+    writeXML(xml, instructions)
+    writeText(text, instructions)
+
+    xml_time = measureLoad(xml, args.repeat)
+    text_time = measureLoad(text, args.repeat)
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "xml", "text", "ratio"))
+    compare("load, {0} instructions".format(len(instructions)), xml_time, text_time)
+    print("xml: {0:.0f} instructions/s, text: {1:.0f} instructions/s".format(
+        len(instructions) / xml_time, len(instructions) / text_time))
+
+def benchBlocks(args, tmp):
+    """Basic block dispatch against dispatching every instruction, base tier without traces"""
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "instr", "blocks", "ratio"))
+    for name, instructions in (("arithmetic loop", loopProgram(args.iterations)),
+                               ("string loop", escapeProgram(args.iterations, False))):
+        source = os.path.join(tmp, "blocks.xml")
+        writeXML(source, instructions)
+        single, single_proc = runInterpreter(source, ["--tier", "base", "--no-block-dispatch"], repeat=args.repeat)
+        blocks, blocks_proc = runInterpreter(source, ["--tier", "base"], repeat=args.repeat)
+        if single_proc.stdout != blocks_proc.stdout:
+            print("{0}: outputs differ".format(name))
+            continue
+        compare("{0}, {1} iterations".format(name, args.iterations), single, blocks)
+
+def benchHooks(args, tmp):
+    """Runs with debugger hooks, which get their own dispatch loop, against runs without them"""
+    source = os.path.join(tmp, "hooks.xml")
+    writeXML(source, loopProgram(args.iterations))
+    plain, plain_proc = runInterpreter(source, ["--tier", "base"], repeat=args.repeat)
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "no hooks", "hooks", "ratio"))
+    for name, options in (("breakpoint not reached", ["--break", str(10 ** 9)]),
+                          ("watchpoint, undefined variable", ["--watch", "GF@unused"])):
+        hooked, hooked_proc = runInterpreter(source, ["--tier", "base"] + options, repeat=args.repeat)
+        if hooked_proc.stdout != plain_proc.stdout:
+            print("{0}: outputs differ".format(name))
+            continue
+        compare("{0}, {1} iterations".format(name, args.iterations), plain, hooked)
+
+def benchMetrics(args, tmp):
+    """Runs exporting metrics against runs without them, the exporter is meant to stay on"""
+    source = os.path.join(tmp, "metrics.xml")
+    writeXML(source, loopProgram(args.iterations))
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "plain", "metrics", "ratio"))
+    for name, options in (("base tier", ["--tier", "base"]), ("trace tier", [])):
+        plain, plain_proc = runInterpreter(source, options, repeat=args.repeat)
+        exported, exported_proc = runInterpreter(source, options + ["--metrics", os.path.join(tmp, "metrics.prom"),
+                                                                    "--metrics-format", "prometheus", "--metrics-interval", "0.1"], repeat=args.repeat)
+        if plain_proc.stdout != exported_proc.stdout:
+            print("{0}: outputs differ".format(name))
+            continue
+        compare("{0}, {1} iterations".format(name, args.iterations), plain, exported)
+
+STARTUP_TARGET = 0.040 #Seconds a trivial program may take on top of the startup of Python itself
+
+def trivialProgram():
+    return [("DEFVAR", [("var", "GF@a")]),
+            ("MOVE", [("var", "GF@a"), ("string", "hello")]),
+            ("WRITE", [("var", "GF@a")])]
+
+def importTimes(command):
+    """Returns [(cumulative seconds, module)] of the top level imports of command, see python -X importtime"""
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + command, capture_output=True, text=True)
+    imports = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "): #Nested imports are indented by two spaces per level
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return imports
+
+def benchStartup(args, tmp):
+    """End-to-end time of trivial programs against the startup of Python, and what interpret.py imports"""
+    xml = os.path.join(tmp, "trivial.xml")
+    text = os.path.join(tmp, "trivial.IPPcode18")
+    writeXML(xml, trivialProgram())
+    writeText(text, trivialProgram())
+    repeat = max(args.repeat, 10)
+
+    def best(command):
+        times = list()
+        for i in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, capture_output=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    python = best(["-c", "pass"])
+    print("{0:<40} {1:>10}  {2:>10}".format("benchmark", "time", "overhead"))
+    print("{0:<40} {1:8.3f} s  {2:>10}".format("python -c pass", python, "-"))
+    for name, source in (("trivial XML program", xml), ("trivial text program", text)):
+        elapsed = best([INTERPRET, "--source", source])
+        overhead = elapsed - python
+        print("{0:<40} {1:8.3f} s  {2:8.3f} s  {3}".format(name, elapsed, overhead,
+              "ok" if overhead <= STARTUP_TARGET else "over the target of {0:.3f} s".format(STARTUP_TARGET)))
+
+    print()
+    print("{0:<40} {1:>10}".format("top level import", "cumulative"))
+    imports = sorted(importTimes([INTERPRET, "--source", xml]), reverse=True)
+    for seconds, module in imports[:12]:
+        print("{0:<40} {1:8.3f} s".format(module, seconds))
+    print("{0:<40} {1:8.3f} s".format("all imports", sum(seconds for seconds, module in imports)))
+
+def benchCompressed(args, tmp):
+    """Load time of compressed sources, streamed into the parser or decompressed to a file first"""
+    import bz2
+    import gzip
+    import lzma
+
+    xml = os.path.join(tmp, "straight.xml")
+    writeXML(xml, straightProgram(args.size))
+    with open(xml, "rb") as f:
+        data = f.read()
+    plain = measureLoad(xml, args.repeat)
+
+    print("{0:<10} {1:>12} {2:>12} {3:>16} {4:>8}".format("format", "bytes", "streamed", "temporary file", "vs xml"))
+    print("{0:<10} {1:>12} {2:>10.3f} s {3:>16} {4:>7.2f}x".format("xml", len(data), plain, "-", 1.0))
+    for module, suffix in ((gzip, ".gz"), (bz2, ".bz2"), (lzma, ".xz")):
+        compressed = xml + suffix
+        with module.open(compressed, "wb") as f:
+            f.write(data)
+        streamed = measureLoad(compressed, args.repeat)
+        temporary = measureLoad(compressed, args.repeat, module.__name__)
+        print("{0:<10} {1:>12} {2:>10.3f} s {3:>14.3f} s {4:>7.2f}x".format(
+            "xml" + suffix, os.path.getsize(compressed), streamed, temporary, streamed / plain))
+
+def benchStrings(args, tmp):
+    """Escape-heavy string literals against the same program without escapes, decoding is done at load"""
+    plain = os.path.join(tmp, "plain.xml")
+    escaped = os.path.join(tmp, "escaped.xml")
+    writeXML(plain, escapeProgram(args.iterations, False))
+    writeXML(escaped, escapeProgram(args.iterations, True))
+
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "plain", "escaped", "ratio"))
+    for name, options in (("base tier", ["--tier", "base"]),
+                          ("base, no inline cache", ["--tier", "base", "--no-inline-cache"]),
+                          ("trace tier", [])):
+        plain_time, plain_proc = runInterpreter(plain, options, repeat=args.repeat)
+        escaped_time, escaped_proc = runInterpreter(escaped, options, repeat=args.repeat)
+        if plain_proc.returncode or escaped_proc.returncode:
+            print("{0}: run failed".format(name))
+            continue
+        compare("{0}, {1} iterations".format(name, args.iterations), plain_time, escaped_time)
+
+def fibProgram(n):
+    """Writes fib(i) for i up to n, fib is a recursive function taking and returning its value on the data stack"""
+    return [("DEFVAR", [("var", "GF@i")]),
+            ("DEFVAR", [("var", "GF@r")]),
+            ("MOVE", [("var", "GF@i"), ("int", "0")]),
+            ("LABEL", [("label", "loop")]),
+            ("PUSHS", [("var", "GF@i")]),
+            ("CALL", [("label", "fib")]),
+            ("POPS", [("var", "GF@r")]),
+            ("WRITE", [("var", "GF@r")]),
+            ("ADD", [("var", "GF@i"), ("var", "GF@i"), ("int", "1")]),
+            ("JUMPIFNEQ", [("label", "loop"), ("var", "GF@i"), ("int", str(n + 1))]),
+            ("JUMP", [("label", "end")]),
+            ("LABEL", [("label", "fib")]),
+            ("CREATEFRAME", []),
+            ("PUSHFRAME", []),
+            ("DEFVAR", [("var", "LF@n")]),
+            ("POPS", [("var", "LF@n")]),
+            ("JUMPIFEQ", [("label", "base"), ("var", "LF@n"), ("int", "0")]),
+            ("JUMPIFEQ", [("label", "base"), ("var", "LF@n"), ("int", "1")]),
+            ("DEFVAR", [("var", "LF@a")]),
+            ("SUB", [("var", "LF@a"), ("var", "LF@n"), ("int", "1")]),
+            ("PUSHS", [("var", "LF@a")]),
+            ("CALL", [("label", "fib")]),
+            ("SUB", [("var", "LF@a"), ("var", "LF@n"), ("int", "2")]),
+            ("PUSHS", [("var", "LF@a")]),
+            ("CALL", [("label", "fib")]),
+            ("POPS", [("var", "LF@a")]),
+            ("POPS", [("var", "LF@n")]),
+            ("ADD", [("var", "LF@n"), ("var", "LF@n"), ("var", "LF@a")]),
+            ("LABEL", [("label", "base")]),
+            ("PUSHS", [("var", "LF@n")]),
+            ("POPFRAME", []),
+            ("RETURN", []),
+            ("LABEL", [("label", "end")])]
+
+def benchMemo(args, tmp):
+    """Memoized calls of a pure recursive function against executing every call"""
+    source = os.path.join(tmp, "fib.xml")
+    writeXML(source, fibProgram(20))
+    plain, plain_proc = runInterpreter(source, [], repeat=args.repeat)
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "plain", "memoized", "ratio"))
+    for name, options in (("fib(0..20), cache of 10000", ["--memoize"]),
+                          ("fib(0..20), cache of 4", ["--memoize", "4"])):
+        memoized, memoized_proc = runInterpreter(source, options, repeat=args.repeat)
+        if memoized_proc.stdout != plain_proc.stdout:
+            print("{0}: outputs differ".format(name))
+            continue
+        compare(name, plain, memoized)
+
+def jobProgram(iterations):
+    """Small job reading one line, running a short loop and writing both results"""
+    return [("DEFVAR", [("var", "GF@line")]),
+            ("READ", [("var", "GF@line"), ("type", "string")])] + loopProgram(iterations) + [
+            ("WRITE", [("var", "GF@line")])]
+
+def benchScheduler(args, tmp):
+    """Jobs per second of process-per-job runs against one scheduler process running all jobs"""
+    source = os.path.join(tmp, "job.xml")
+    writeXML(source, jobProgram(100))
+    with open(os.path.join(tmp, "job.in"), "w") as f:
+        f.write("input line\n")
+
+    start = time.perf_counter()
+    for i in range(args.jobs):
+        proc = subprocess.run([sys.executable, INTERPRET, "--source", source],
+                              input=b"input line\n", capture_output=True)
+    processes = time.perf_counter() - start
+    expected = proc.stdout.decode()
+
+    out = os.path.join(tmp, "jobs")
+    os.makedirs(out, exist_ok=True)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(HERE, "scheduler.py"), "--out", out] + [source] * args.jobs,
+                   capture_output=True, check=True)
+    scheduled = time.perf_counter() - start
+
+    for i in range(args.jobs):
+        with open(os.path.join(out, "{0}.out".format(i))) as f:
+            if f.read() != expected:
+                print("job {0}: output differs from the separate process".format(i))
+
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "processes", "scheduler", "ratio"))
+    compare("{0} jobs".format(args.jobs), processes, scheduled)
+    print("processes: {0:.1f} jobs/s, scheduler: {1:.1f} jobs/s".format(args.jobs / processes, args.jobs / scheduled))
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted values"""
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+class Collector:
+    """Async output stream keeping what was written"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+def benchAsync(args, tmp):
+    """Latency of many concurrent runs sharing one asyncio event loop
+
+    Runs arrive at --rate runs per second and get their input line only after a
+    delay, as from a slow client, so runs are parked in READ while the others
+    execute. A ticker measures the longest time the event loop did not respond."""
+    import asyncio
+    import random
+    sys.path.insert(0, HERE)
+    import scheduler
+
+    source = os.path.join(tmp, "job.xml")
+    writeXML(source, jobProgram(args.iterations // 100))
+    rand = random.Random(1)
+    arrivals = sorted(rand.uniform(0, args.jobs / args.rate) for i in range(args.jobs))
+    delays = [rand.uniform(0, 0.05) for i in range(args.jobs)]
+
+    async def client(i, stats):
+        await asyncio.sleep(arrivals[i])
+        reader = asyncio.StreamReader()
+        writer = Collector()
+        start = time.perf_counter()
+        stats["running"] += 1
+        stats["peak"] = max(stats["peak"], stats["running"])
+
+        async def send():
+            await asyncio.sleep(delays[i])
+            reader.feed_data("line {0}\n".format(i).encode())
+            reader.feed_eof()
+
+        sender = asyncio.ensure_future(send())
+        code = await scheduler.Job(source, name=str(i)).runAsync(reader, writer, instructions=args.slice)
+        await sender
+        stats["running"] -= 1
+        stats["latencies"].append(time.perf_counter() - start)
+        stats["failed"] += code != 0 or not writer.data.endswith("line {0}\n".format(i).encode())
+
+    async def ticker(stats, done):
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stats["stall"] = max(stats["stall"], now - last)
+            last = now
+
+    async def main():
+        stats = {"latencies": list(), "running": 0, "peak": 0, "failed": 0, "stall": 0.0}
+        done = asyncio.Event()
+        tick = asyncio.ensure_future(ticker(stats, done))
+        start = time.perf_counter()
+        await asyncio.gather(*[client(i, stats) for i in range(args.jobs)])
+        stats["elapsed"] = time.perf_counter() - start
+        done.set()
+        await tick
+        return stats
+
+    stats = asyncio.run(main())
+    latencies = sorted(stats["latencies"])
+
+    print("{0} runs arriving at {1:.0f} runs/s, {2} instruction slices: {3:.3f} s, at most {4} concurrent, {5} failed".format(
+        args.jobs, args.rate, args.slice, stats["elapsed"], stats["peak"], stats["failed"]))
+    print("latency p50 {0:.1f} ms, p90 {1:.1f} ms, p99 {2:.1f} ms, max {3:.1f} ms".format(
+        *[1000 * percentile(latencies, p) for p in (50, 90, 99, 100)]))
+    print("longest event loop stall {0:.1f} ms".format(1000 * stats["stall"]))
+
+def batchProgram(iterations):
+    """Reads an int and runs the hot loop with it, the same trip count for every input"""
+    return [("DEFVAR", [("var", "GF@n")]),
+            ("READ", [("var", "GF@n"), ("type", "int")])] + loopProgram(iterations)[:7] + [
+            ("MUL", [("var", "GF@c"), ("var", "GF@i"), ("var", "GF@n")])] + loopProgram(iterations)[8:]
+
+def benchBatch(args, tmp):
+    """Lockstep batch over --jobs inputs against running them one after another in one process"""
+    sys.path.insert(0, HERE)
+    import batch
+    import scheduler
+
+    source = os.path.join(tmp, "batch.xml")
+    writeXML(source, batchProgram(args.iterations // 1000))
+    inputs = ["{0}\n".format(i - args.jobs // 2) for i in range(args.jobs)]
+
+    start = time.perf_counter()
+    expected = list()
+    for text in inputs:
+        job = scheduler.Job(source, text)
+        while job.step(None):
+            pass
+        expected.append((job.stdout.getvalue(), job.stderr.getvalue(), job.returncode))
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = batch.BatchInterpreter(source, inputs)
+    results = engine.run()
+    batched = time.perf_counter() - start
+
+    if results != expected:
+        print("outputs of the batch differ from the separate runs")
+    print("{0:<40} {1:>10}  {2:>10}  {3:>7}".format("benchmark", "sequential", "batch", "ratio"))
+    compare("{0} inputs, {1} iterations".format(args.jobs, args.iterations // 1000), sequential, batched)
+    print("sequential: {0:.1f} runs/s, batch: {1:.1f} runs/s, {2} batches, {3} runs ejected".format(
+        args.jobs / sequential, args.jobs / batched, engine.stats["batches"], engine.stats["ejected"]))
+
+def processMemory():
+    """Returns (PSS, RSS) of this process in bytes, PSS divides shared pages between their users"""
+    pss = rss = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1]) * 1024
+                elif line.startswith("Rss:"):
+                    rss = int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return pss, rss
+
+def imageWorker(source, name, barrier, results):
+    """Pool worker running the program from its own XML copy or from the shared image name"""
+    sys.path.insert(0, HERE)
+    import instruct
+    import image
+
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    if name is None:
+        interpreter = instruct.Interpreter(source)
+    else:
+        interpreter = instruct.Interpreter(None)
+        interpreter.loadImage(image.ProgramImage.fromSharedMemory(name))
+    interpreter.interpret()
+    elapsed = time.perf_counter() - start
+
+    barrier.wait() #Every worker holds its program while the memory is measured
+    results.put(processMemory() + (elapsed,))
+    barrier.wait()
+
+def benchImage(args, tmp):
+    """Memory of pool workers each parsing the program against workers sharing one image"""
+    import multiprocessing
+    sys.path.insert(0, HERE)
+    import instruct
+    import image
+
+    source = os.path.join(tmp, "straight.xml")
+    writeXML(source, straightProgram(args.size))
+    interpreter = instruct.Interpreter(source)
+    interpreter.buildLabels()
+    shm = image.publish(image.buildImage(interpreter))
+    print("{0} instructions, XML {1} bytes, image {2} bytes".format(
+        args.size, os.path.getsize(source), shm.size))
+
+    context = multiprocessing.get_context("spawn")
+    print("{0:<8} {1:>8} {2:>16} {3:>16} {4:>10}".format("source", "workers", "PSS per worker", "RSS per worker", "run time"))
+    try:
+        for name in (None, shm.name):
+            for workers in (1, 2, 4, 8):
+                barrier = context.Barrier(workers)
+                results = context.Queue()
+                processes = [context.Process(target=imageWorker, args=(source, name, barrier, results)) for i in range(workers)]
+                for process in processes:
+                    process.start()
+                measured = [results.get() for process in processes]
+                for process in processes:
+                    process.join()
+                pss = sum(m[0] or 0 for m in measured) / workers
+                rss = sum(m[1] for m in measured) / workers
+                elapsed = max(m[2] for m in measured)
+                print("{0:<8} {1:>8} {2:>13.1f} MB {3:>13.1f} MB {4:>8.3f} s".format(
+                    "xml" if name is None else "image", workers, pss / 2**20, rss / 2**20, elapsed))
+    finally:
+        shm.close()
+        shm.unlink()
+
+BENCHMARKS = {"trace-overhead": benchTraceOverhead,
+              "load": benchLoad,
+              "blocks": benchBlocks,
+              "hooks": benchHooks,
+              "lazy": benchLazy,
+              "memo": benchMemo,
+              "metrics": benchMetrics,
+              "compressed": benchCompressed,
+              "strings": benchStrings,
+              "scheduler": benchScheduler,
+              "startup": benchStartup,
+              "async": benchAsync,
+              "batch": benchBatch,
+              "image": benchImage}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the IPPcode18 interpreter')
+    parser.add_argument('benchmark', help='Benchmark to run', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--iterations', help='Iterations of generated loops', type=int, default=200000)
+    parser.add_argument('--size', help='Instructions of generated straight-line programs', type=int, default=100000)
+    parser.add_argument('--jobs', help='Jobs of the scheduler and async benchmarks', type=int, default=200)
+    parser.add_argument('--slice', help='Instructions per time slice of the async benchmark', type=int, default=1000)
+    parser.add_argument('--rate', help='Arriving runs per second of the async benchmark', type=float, default=100)
+    parser.add_argument('--repeat', help='Runs of every measurement, the best one is reported', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]:
+            BENCHMARKS[name](args, tmp)
+
+if __name__ == "__main__":
+    main()
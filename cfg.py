@@ -0,0 +1,121 @@
+#Control flow graph
+#Splits the program into basic blocks, runs of instructions which are entered
+#only at their first instruction and left only after their last one. Blocks start
+#at labels and behind every instruction which transfers control, edges lead to
+#the blocks control can continue in. Used by the type inference (typeinfer.py),
+#the profile guided compilation (pgo.py) and the block dispatch loop of the
+#interpreter (Interpreter.dispatchBlocks).
+
+import bisect
+
+JUMP_OPCODES = {"JUMP", "JUMPIFEQ", "JUMPIFNEQ"}
+
+#Instructions ending a block: control transfers and BREAK, which prints the instruction counter
+BLOCK_END_OPCODES = JUMP_OPCODES | {"CALL", "RETURN", "BREAK"}
+
+def labelTarget(interpreter, instruction):
+    """Order of the label the first operand of instruction names, None if it is undefined"""
+    label = instruction.ops_list[0].value
+    label_dict = interpreter.findLabel(label)
+    if label_dict == -1:
+        return None #Jump to an undefined label fails at runtime, no edge
+    return label_dict[label]
+
+class BasicBlock:
+    """Instructions executed one after another, LABELs included"""
+
+    def __init__(self, start):
+        self.start = start #Order of the first instruction
+        self.instructions = list()
+        self.successors = list() #Starts of the blocks control can continue in
+        self.predecessors = list()
+
+    @property
+    def end(self):
+        """Order of the last instruction"""
+        return self.instructions[-1].order
+
+    @property
+    def terminator(self):
+        """Last instruction, control leaves the block only after it"""
+        return self.instructions[-1]
+
+    def body(self):
+        """Instructions which are executed, i.e. without the LABELs"""
+        return [instruction for instruction in self.instructions if instruction.opcode != "LABEL"]
+
+class ControlFlowGraph:
+    """Basic blocks of the program of an interpreter, labels have to be built"""
+
+    def __init__(self, interpreter, program=None, ends=BLOCK_END_OPCODES):
+        self.interpreter = interpreter
+        self.ends = ends #Opcodes ending a block
+        if program is None:
+            #Same indexing as Interpreter.buildProgram, the first instruction of every order wins
+            program = dict()
+            for instruction in interpreter.instruction_list:
+                program.setdefault(instruction.order, instruction)
+        self.program = program
+        self.blocks = dict() #Start order -> BasicBlock, in program order
+        self.starts = list() #Sorted block starts, for blockOf
+        self.entry = None #Block of the first instruction
+        self.build()
+
+    def build(self):
+        orders = sorted(self.program)
+        block = None
+        previous = None
+        for order in orders:
+            instruction = self.program[order]
+            if (block is None or instruction.opcode == "LABEL" or order != previous + 1
+                    or block.terminator.opcode in self.ends):
+                block = BasicBlock(order)
+                self.blocks[order] = block
+                self.starts.append(order)
+            block.instructions.append(instruction)
+            previous = order
+
+        if self.starts and self.starts[0] == 1:
+            self.entry = self.blocks[1]
+
+        #Any block behind a CALL may be resumed by RETURN, the caller is not known
+        return_sites = [block.end + 1 for block in self.blocks.values()
+                        if block.terminator.opcode == "CALL" and block.end + 1 in self.blocks]
+
+        for block in self.blocks.values():
+            opcode = block.terminator.opcode
+            successors = list()
+            if opcode in JUMP_OPCODES or opcode == "CALL":
+                target = labelTarget(self.interpreter, block.terminator)
+                if target is not None:
+                    successors.append(target)
+            if opcode == "RETURN":
+                successors.extend(return_sites)
+            elif opcode not in {"JUMP", "CALL"}:
+                successors.append(block.end + 1)
+
+            for successor in successors:
+                if successor in self.blocks and successor not in block.successors:
+                    block.successors.append(successor)
+                    self.blocks[successor].predecessors.append(block.start)
+
+    def blockOf(self, order):
+        """Block containing the instruction of order, None if there is none"""
+        i = bisect.bisect_right(self.starts, order) - 1
+        if i < 0:
+            return None
+        block = self.blocks[self.starts[i]]
+        return block if order <= block.end else None
+
+    def reachable(self):
+        """Starts of the blocks reachable from the entry"""
+        if self.entry is None:
+            return set()
+        seen = {self.entry.start}
+        worklist = [self.entry.start]
+        while worklist:
+            for successor in self.blocks[worklist.pop()].successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    worklist.append(successor)
+        return seen
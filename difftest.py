@@ -0,0 +1,424 @@
+import argparse
+import glob
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from benchmark import writeXML, writeText
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INTERPRET = os.path.join(HERE, "interpret.py")
+
+#Reference semantics, every instruction runs its generic Ins_*.execute
+REFERENCE = ["--tier", "base", "--no-specialize", "--no-inline-cache", "--no-block-dispatch"]
+
+#Instruction limit most runs reach, the limit engines have to stop at the same instruction
+LIMITS = ["--max-instructions", "997"]
+
+#Alternative engines and optimization levels compared against the reference
+#{profile} is replaced by a profile recorded by a reference run with --profile-out
+#Engines with format "text" get the program converted to IPPcode18 source text,
+#format "image" gets a program image built by image.py. Engines with "reference" are
+#compared against a reference run with these options instead
+ENGINES = {"blocks": {"options": ["--tier", "base", "--no-specialize", "--no-inline-cache"]},
+           "specialize": {"options": ["--tier", "base", "--no-inline-cache", "--no-block-dispatch"]},
+           "inline-cache": {"options": ["--tier", "base", "--no-specialize", "--no-block-dispatch"]},
+           "trace": {"options": ["--trace-threshold", "2"]},
+           "pgo": {"options": ["--profile-in", "{profile}", "--trace-threshold", "2"]},
+           "text-source": {"options": REFERENCE, "format": "text"},
+           "image": {"options": [], "format": "image"},
+           "image-trace": {"options": ["--trace-threshold", "2"], "format": "image"},
+           "lazy": {"options": ["--lazy"]},
+           "lazy-trace": {"options": ["--lazy", "--trace-threshold", "2"]},
+           "memoize": {"options": ["--memoize", "4"]},
+           "debug-loop": {"options": ["--break", "1000000000"]}, #Breakpoint never reached, runs dispatchDebug
+           "batch": {"options": [], "lanes": "batch.py"},
+           "scheduler": {"options": ["--slice", "97"], "lanes": "scheduler.py"},
+           "async": {"options": ["--async", "--slice", "97"], "lanes": "scheduler.py"},
+           "limit-trace": {"options": ["--trace-threshold", "2"] + LIMITS, "reference": REFERENCE + LIMITS},
+           "limit-blocks": {"options": ["--tier", "base"] + LIMITS, "reference": REFERENCE + LIMITS},
+           "limit-pgo": {"options": ["--profile-in", "{profile}", "--trace-threshold", "2"] + LIMITS, "reference": REFERENCE + LIMITS},
+           "limit-image": {"options": ["--trace-threshold", "2"] + LIMITS, "format": "image", "reference": REFERENCE + LIMITS},
+           "limit-lazy": {"options": ["--lazy", "--trace-threshold", "2"] + LIMITS, "reference": REFERENCE + LIMITS},
+           "limit-debug-loop": {"options": ["--break", "1000000000"] + LIMITS, "reference": REFERENCE + LIMITS}}
+
+#Engines with "lanes" run the program over LANES inputs in one process of the given
+#tool, every lane has to agree with a separate reference run of its input
+LANES = 4
+
+TIMEOUT = 30 #Seconds, a run taking longer is reported as a timeout
+
+class Result:
+    """Outcome of a single run"""
+
+    def __init__(self, returncode, stdout, stderr, elapsed):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+
+    def key(self):
+        """What has to be the same for two runs to agree"""
+        stderr = self.stderr
+        #Tracebacks point to different lines in different engines, compare the exception only
+        if "Traceback (most recent call last)" in stderr:
+            stderr = stderr.strip().split("\n")[-1]
+        #The report of an exceeded limit is the same but for the time
+        stderr = "".join(line for line in stderr.splitlines(True) if not line.startswith("elapsed time: "))
+        return (self.returncode, self.stdout, stderr)
+
+def readRecords(path):
+    """Returns program as list of (opcode, [(type, text), ...]) sorted by order"""
+    root = ET.parse(path).getroot()
+    instructions = sorted(root, key=lambda instruct: int(instruct.attrib["order"]))
+    return [(instruct.attrib["opcode"], [(arg.attrib["type"], arg.text or "") for arg in instruct])
+            for instruct in instructions]
+
+def run(source, options, stdin):
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([sys.executable, INTERPRET, "--source", source] + options,
+                              input=stdin, capture_output=True, timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return Result("timeout", b"", "", time.perf_counter() - start)
+    return Result(proc.returncode, proc.stdout, proc.stderr.decode("utf-8", "replace"), time.perf_counter() - start)
+
+def runEngine(name, records, stdin, tmp, options=None):
+    """Runs program given by records with engine name, "reference" for the reference path
+
+    options replace the options of the engine"""
+    engine = ENGINES.get(name, {"options": REFERENCE})
+    source = os.path.join(tmp, "program.xml")
+    writeXML(source, records)
+
+    options = list(engine["options"] if options is None else options)
+    if "{profile}" in options:
+        profile = os.path.join(tmp, "program.profile")
+        run(source, REFERENCE + ["--profile-out", profile], stdin)
+        if not os.path.exists(profile):
+            return Result("no profile", b"", "", 0.0)
+        options = [profile if option == "{profile}" else option for option in options]
+
+    if engine.get("format") == "text":
+        source = os.path.join(tmp, "program.IPPcode18")
+        writeText(source, records)
+    elif engine.get("format") == "image":
+        image = os.path.join(tmp, "program.img")
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.join(HERE, "image.py"), source, image],
+                              capture_output=True, timeout=TIMEOUT)
+        if proc.returncode != 0:
+            #Load errors are reported by the build, the same way as by the run
+            return Result(proc.returncode, proc.stdout, proc.stderr.decode("utf-8", "replace"), time.perf_counter() - start)
+        source = image
+
+    return run(source, options, stdin)
+
+def laneInputs(stdin):
+    """Inputs of the lanes: the input of the program, no input, its lines reversed and its first third"""
+    lines = stdin.split(b"\n")[:-1] if stdin.endswith(b"\n") else stdin.split(b"\n")
+    inputs = [stdin, b"", b"".join(line + b"\n" for line in reversed(lines)),
+              b"".join(line + b"\n" for line in lines[:len(lines) // 3])]
+    return inputs[:LANES]
+
+def runLanes(name, records, inputs, tmp):
+    """Runs program given by records over inputs with lane engine name
+
+    Returns (list of Results, one for every input, time of the whole run)"""
+    engine = ENGINES[name]
+    lanes = os.path.join(tmp, "lanes")
+    os.makedirs(lanes, exist_ok=True)
+    source = os.path.join(lanes, "program.xml")
+    writeXML(source, records)
+    paths = list()
+    for i, stdin in enumerate(inputs):
+        path = os.path.join(lanes, "{0}.in".format(i))
+        with open(path, "wb") as f:
+            f.write(stdin)
+        paths.append(path)
+
+    if engine["lanes"] == "batch.py":
+        command = ["--source", source] + paths
+    else:
+        #scheduler.py runs PROGRAM.xml with input PROGRAM.in, every lane gets its copy of the program
+        command = list()
+        for path in paths:
+            command.append(os.path.splitext(path)[0] + ".xml")
+            writeXML(command[-1], records)
+    command = [sys.executable, os.path.join(HERE, engine["lanes"])] + command + engine["options"] + ["--out", lanes]
+
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(command, capture_output=True, timeout=TIMEOUT * len(inputs))
+    except subprocess.TimeoutExpired:
+        return [Result("timeout", b"", "", 0.0) for stdin in inputs], time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    results = list()
+    for i in range(len(inputs)):
+        base = os.path.join(lanes, str(i))
+        if proc.returncode != 0 or not os.path.exists(base + ".code"):
+            #The tool itself failed, every lane gets its error
+            results.append(Result(proc.returncode, proc.stdout, proc.stderr.decode("utf-8", "replace"), elapsed))
+            continue
+        with open(base + ".out", encoding="utf-8") as f:
+            stdout = f.read().encode("utf-8")
+        with open(base + ".err", encoding="utf-8") as f:
+            stderr = f.read()
+        with open(base + ".code") as f:
+            returncode = int(f.read())
+        results.append(Result(returncode, stdout, stderr, elapsed))
+        for suffix in (".out", ".err", ".code"):
+            os.remove(base + suffix)
+    return results, elapsed
+
+def disagreement(name, records, stdin, tmp, references):
+    """Returns (reference Results, engine Results, reference time, engine time) of the engine run
+
+    Reference runs of the program are kept in dictionary references by input and options"""
+    inputs = laneInputs(stdin) if "lanes" in ENGINES[name] else [stdin]
+    options = ENGINES[name].get("reference", REFERENCE)
+    for text in inputs:
+        if (text, tuple(options)) not in references:
+            references[text, tuple(options)] = runEngine("reference", records, text, tmp, options)
+    expected = [references[text, tuple(options)] for text in inputs]
+
+    if "lanes" in ENGINES[name]:
+        results, elapsed = runLanes(name, records, inputs, tmp)
+    else:
+        results = [runEngine(name, records, stdin, tmp)]
+        elapsed = results[0].elapsed
+    return expected, results, sum(reference.elapsed for reference in expected), elapsed
+
+def minimize(name, records, stdin, tmp):
+    """Removes instructions while the engine keeps disagreeing with the reference"""
+    def fails(candidate):
+        references, results, referenceTime, engineTime = disagreement(name, candidate, stdin, tmp, dict())
+        return [result.key() for result in references] != [result.key() for result in results]
+
+    chunk = max(1, len(records) // 2)
+    while chunk >= 1:
+        i = 0
+        while i < len(records):
+            candidate = records[:i] + records[i + chunk:]
+            if candidate and fails(candidate):
+                records = candidate #Keep the removal, try the same position again
+            else:
+                i += chunk
+        chunk //= 2
+    return records
+
+class ProgramGenerator:
+    """Random terminating programs exercising arithmetic, strings, branches and loops"""
+
+    INT_VARS = ["GF@a", "GF@b", "GF@c"]
+    STRING_VARS = ["GF@s", "GF@t"]
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.labels = 0
+        self.instructions = list()
+
+    def emit(self, opcode, *args):
+        self.instructions.append((opcode, list(args)))
+
+    def label(self):
+        self.labels += 1
+        return "l{0}".format(self.labels)
+
+    def intOperand(self):
+        if self.random.random() < 0.5:
+            return ("var", self.random.choice(self.INT_VARS))
+        return ("int", str(self.random.randint(-20, 20)))
+
+    def stringOperand(self):
+        if self.random.random() < 0.6:
+            return ("var", self.random.choice(self.STRING_VARS))
+        return ("string", self.random.choice(["x", "ab", "zz", "q", "a\\032b"]))
+
+    def statement(self, depth):
+        r = self.random
+        kind = r.random()
+        dest = ("var", r.choice(self.INT_VARS))
+        if kind < 0.25:
+            self.emit(r.choice(["ADD", "SUB"]), dest, self.intOperand(), self.intOperand())
+        elif kind < 0.35:
+            #Scaled back right away, repeated multiplication in nested loops would grow without bound
+            self.emit("MUL", dest, self.intOperand(), ("int", str(r.randint(-20, 20))))
+            self.emit("IDIV", dest, dest, ("int", "21"))
+        elif kind < 0.45:
+            self.emit("IDIV", dest, self.intOperand(), ("int", str(r.choice([1, 2, 3, 7, -2]))))
+        elif kind < 0.55:
+            s = ("var", r.choice(self.STRING_VARS))
+            if len(self.instructions) % 3 == 0:
+                self.emit("CONCAT", s, self.stringOperand(), ("string", r.choice(["a", "b"])))
+            else:
+                self.emit("STRLEN", dest, self.stringOperand())
+        elif kind < 0.65:
+            self.emit(r.choice(["LT", "GT", "EQ"]), ("var", "GF@r"), self.intOperand(), self.intOperand())
+            self.emit("WRITE", ("var", "GF@r"))
+        elif kind < 0.75:
+            skip = self.label()
+            self.emit(r.choice(["JUMPIFEQ", "JUMPIFNEQ"]), ("label", skip), self.intOperand(), self.intOperand())
+            self.emit("ADD", dest, self.intOperand(), ("int", "1"))
+            self.emit("LABEL", ("label", skip))
+        elif kind < 0.85:
+            self.emit("WRITE", ("var", r.choice(self.INT_VARS + self.STRING_VARS)))
+        elif kind < 0.9:
+            self.emit("READ", ("var", r.choice(self.STRING_VARS)), ("type", "string"))
+        elif kind < 0.93:
+            #Call of the pure function emitted by generate, memoized by the memoize engine
+            self.emit("PUSHS", self.intOperand())
+            self.emit("CALL", ("label", "scale"))
+            self.emit("POPS", dest)
+        elif depth > 0 or kind < 0.98:
+            self.emit("MOVE", dest, self.intOperand())
+        else:
+            #Type error now and then outside of loops, engines have to fail the same way
+            self.emit("ADD", dest, self.intOperand(), self.stringOperand())
+
+    def loop(self, depth):
+        counter = "GF@n{0}".format(depth)
+        start = self.label()
+        self.emit("MOVE", ("var", counter), ("int", str(self.random.randint(1, 120))))
+        self.emit("LABEL", ("label", start))
+        self.body(depth + 1)
+        self.emit("SUB", ("var", counter), ("var", counter), ("int", "1"))
+        self.emit("JUMPIFNEQ", ("label", start), ("var", counter), ("int", "0"))
+
+    def body(self, depth):
+        for i in range(self.random.randint(2, 8)):
+            if depth < 2 and self.random.random() < 0.15:
+                self.loop(depth)
+            else:
+                self.statement(depth)
+
+    def function(self):
+        """Pure function scale, takes an int from the data stack and pushes the result"""
+        end = self.label()
+        self.emit("JUMP", ("label", end))
+        self.emit("LABEL", ("label", "scale"))
+        self.emit("CREATEFRAME")
+        self.emit("PUSHFRAME")
+        self.emit("DEFVAR", ("var", "LF@x"))
+        self.emit("POPS", ("var", "LF@x"))
+        self.emit("JUMPIFEQ", ("label", "scaled"), ("var", "LF@x"), ("int", "0"))
+        self.emit("MUL", ("var", "LF@x"), ("var", "LF@x"), ("int", str(self.random.randint(2, 5))))
+        self.emit("IDIV", ("var", "LF@x"), ("var", "LF@x"), ("int", "3"))
+        self.emit("LABEL", ("label", "scaled"))
+        self.emit("PUSHS", ("var", "LF@x"))
+        self.emit("POPFRAME")
+        self.emit("RETURN")
+        self.emit("LABEL", ("label", end))
+
+    def lastLoop(self):
+        """Loop ending the program, its last iteration is the one recorded by the trace tier
+        with a trace threshold of 2 or the default 50, it runs into the end while recording
+
+        Code jumped over before it is never decoded by a program decoded on access"""
+        counter = "GF@n0"
+        start = self.label()
+        skip = self.label()
+        self.emit("JUMP", ("label", skip))
+        for i in range(8):
+            self.emit("WRITE", ("string", "unreachable"))
+        self.emit("LABEL", ("label", skip))
+        self.emit("MOVE", ("var", counter), ("int", str(self.random.choice([3, 51]))))
+        self.emit("LABEL", ("label", start))
+        self.emit("ADD", ("var", "GF@a"), ("var", "GF@a"), self.intOperand())
+        self.emit("WRITE", ("var", "GF@a"))
+        self.emit("SUB", ("var", counter), ("var", counter), ("int", "1"))
+        self.emit("JUMPIFNEQ", ("label", start), ("var", counter), ("int", "0"))
+
+    def generate(self):
+        for var in self.INT_VARS + self.STRING_VARS + ["GF@r", "GF@n0", "GF@n1", "GF@n2"]:
+            self.emit("DEFVAR", ("var", var))
+        for var in self.INT_VARS:
+            self.emit("MOVE", ("var", var), ("int", str(self.random.randint(0, 9))))
+        for var in self.STRING_VARS:
+            self.emit("MOVE", ("var", var), ("string", "s"))
+        for i in range(self.random.randint(1, 4)):
+            self.loop(0)
+        self.body(0)
+        self.function()
+        if self.random.random() < 0.5:
+            self.lastLoop()
+        #READ can run in loops, the input runs out only now and then
+        inputs = [self.random.choice(["in", "put", "zzz"]) for i in range(self.random.randint(1000, 50000))]
+        return self.instructions, "".join(line + "\n" for line in inputs).encode()
+
+def corpus(args):
+    """Yields (name, records, stdin) of all programs to test"""
+    paths = list()
+    for path in args.programs or [os.path.join(HERE, "basic*.xml")]:
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, "*.xml"))))
+        else:
+            paths.extend(sorted(glob.glob(path)))
+
+    for path in paths:
+        stdin = b""
+        if os.path.exists(os.path.splitext(path)[0] + ".in"):
+            with open(os.path.splitext(path)[0] + ".in", "rb") as f:
+                stdin = f.read()
+        yield os.path.basename(path), readRecords(path), stdin
+
+    for seed in range(args.seed, args.seed + args.generated):
+        records, stdin = ProgramGenerator(seed).generate()
+        yield "generated-{0}".format(seed), records, stdin
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs programs through the reference path and every engine and compares the results')
+    parser.add_argument('programs', help='XML programs or directories, basic*.xml by default; PROGRAM.in is used as input', nargs='*')
+    parser.add_argument('--generated', help='Number of generated programs', type=int, default=20)
+    parser.add_argument('--seed', help='Seed of the first generated program', type=int, default=1)
+    parser.add_argument('--engines', help='Comma separated engines to compare, all by default: ' + ", ".join(sorted(ENGINES)))
+    parser.add_argument('--out', help='Directory for minimized reproducers', default='difftest-failures')
+    args = parser.parse_args()
+
+    engines = args.engines.split(",") if args.engines else sorted(ENGINES)
+    for name in engines:
+        if name not in ENGINES:
+            parser.error("unknown engine {0}".format(name))
+
+    print("{0:<24} {1:<14} {2:>9} {3:>9} {4:>8}  {5}".format("program", "engine", "reference", "engine", "speedup", "result"))
+    failures = 0
+    totals = {name: [0.0, 0.0] for name in engines}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for program, records, stdin in corpus(args):
+            runs = dict() #Reference runs of the program by input
+            for name in engines:
+                references, results, referenceTime, engineTime = disagreement(name, records, stdin, tmp, runs)
+                totals[name][0] += referenceTime
+                totals[name][1] += engineTime
+                status = "ok"
+                for lane, (reference, result) in enumerate(zip(references, results)):
+                    if result.key() == reference.key():
+                        continue
+                    failures += 1
+                    os.makedirs(args.out, exist_ok=True)
+                    reproducer = os.path.join(args.out, "{0}.{1}.xml".format(os.path.splitext(program)[0], name))
+                    writeXML(reproducer, minimize(name, records, stdin, tmp))
+                    if stdin:
+                        with open(os.path.splitext(reproducer)[0] + ".in", "wb") as f:
+                            f.write(stdin)
+                    status = "MISMATCH (exit {0} vs {1}), reproducer {2}".format(reference.returncode, result.returncode, reproducer)
+                    if len(results) > 1:
+                        status += ", lane {0}".format(lane)
+                    break
+                print("{0:<24} {1:<14} {2:8.3f}s {3:8.3f}s {4:7.2f}x  {5}".format(
+                    program, name, referenceTime, engineTime, referenceTime / engineTime if engineTime else 0.0, status))
+
+    print()
+    for name in engines:
+        reference, measured = totals[name]
+        print("{0:<14} total {1:8.3f}s vs reference {2:8.3f}s, speedup {3:.2f}x".format(name, measured, reference, reference / measured if measured else 0.0))
+    print("{0} mismatches".format(failures))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
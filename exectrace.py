@@ -0,0 +1,215 @@
+#Binary execution trace
+#Recording runs with the trace tier and basic blocks, so instead of one record per
+#executed instruction the recorder collects events and written values in lists
+#and encodes them only when they are flushed. An event is the id of a path, a
+#sequence of (order, tag, type) items describing instructions executed one after
+#another: a basic block, a compiled trace iteration or a single instruction. tag
+#is TAG_NONE, TAG_NOT_TAKEN or TAG_TAKEN, or None for an instruction writing a
+#value, which takes its value (preceded by its type if type is None) from the
+#values list.
+#
+#The file starts with MAGIC followed by chunks, a chunk is a varint length and
+#the marshal of (paths defined since the previous chunk, events, values).
+#readTrace expands them back to one TraceRecord per executed instruction.
+
+import marshal
+
+MAGIC = b"IPPTRACE2\n"
+
+TAG_NONE = 0
+TAG_NOT_TAKEN = 1
+TAG_TAKEN = 2
+TAG_INT = 3
+TAG_STRING = 4
+TAG_TRUE = 5
+TAG_FALSE = 6
+TAG_OTHER = 7
+
+TAG_NAMES = {TAG_NONE: "none", TAG_NOT_TAKEN: "not taken", TAG_TAKEN: "taken", TAG_INT: "int",
+             TAG_STRING: "string", TAG_TRUE: "bool", TAG_FALSE: "bool", TAG_OTHER: "other"}
+
+#Instructions storing a value into their first operand
+WRITING_OPCODES = {"MOVE", "ADD", "SUB", "MUL", "IDIV", "LT", "GT", "EQ", "AND", "OR", "NOT",
+                   "INT2CHAR", "STRI2INT", "READ", "CONCAT", "STRLEN", "GETCHAR", "SETCHAR",
+                   "TYPE", "POPS"}
+
+BRANCH_OPCODES = {"JUMPIFEQ", "JUMPIFNEQ"}
+
+FLUSH_EVENTS = 1 << 14 #Buffered events before they are written to the file, checked by Interpreter.periodicCheck
+
+def encodeVarint(buf, n):
+    """Appends unsigned varint to bytearray buf"""
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def decodeVarint(data, pos):
+    """Returns (value, position behind the varint)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def item(instruction, taken=None, var_type=None):
+    """Path item of an executed instruction, taken is the direction of a conditional jump
+    and var_type the type of the written value if it is known when the path is built"""
+    if instruction.opcode in WRITING_OPCODES:
+        return (instruction.order, None, var_type)
+    if instruction.opcode in BRANCH_OPCODES and taken is not None:
+        return (instruction.order, TAG_TAKEN if taken else TAG_NOT_TAKEN, None)
+    return (instruction.order, TAG_NONE, None)
+
+class TraceRecorder:
+    """Collects the execution trace of the run, see Interpreter.recordTrace
+
+    Interpreter.dispatchRecorded appends a path id to events for every executed
+    basic block, compiled traces (see tracing.TraceCompiler) for every iteration,
+    written values are appended to values right after they are written."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.paths = list() #Path id -> tuple of items
+        self.ids = dict() #Items -> path id
+        self.written = 0 #Paths already written to the file
+        self.events = list()
+        self.values = list()
+        self.singles = dict() #Order -> (taken path id, not taken path id, writes a value), see step
+        self.blocks = dict() #Order -> recorded basic block, see block
+
+    def path(self, items):
+        """Returns id of the path of items"""
+        items = tuple(items)
+        pid = self.ids.get(items)
+        if pid is None:
+            pid = self.ids[items] = len(self.paths)
+            self.paths.append(items)
+        return pid
+
+    def prefix(self, pid, length):
+        """Returns id of the path of the first length items of path pid"""
+        return self.path(self.paths[pid][:length])
+
+    def capture(self, instruction):
+        """Returns execute of instruction appending the written type and value"""
+        execute = instruction.execute
+        dest = instruction.ops_list[0]
+        append = self.values.append
+
+        def run():
+            execute()
+            var = dest.toVar()
+            append(var.var_type)
+            append(var.value)
+        return run
+
+    def block(self, program, entry):
+        """Returns (length, last, executes, orders, taken path id, not taken path id) of a
+        basic block entry of Interpreter.blocks, executes append the written values"""
+        length, last, executes, orders = entry
+        instructions = [program[order] for order in orders]
+        executes = tuple(self.capture(instruction) if instruction.opcode in WRITING_OPCODES else instruction.execute
+                         for instruction in instructions)
+        items = [item(instruction) for instruction in instructions]
+        taken = notTaken = self.path(items)
+        if instructions and instructions[-1].opcode in BRANCH_OPCODES:
+            taken = self.path(items[:-1] + [item(instructions[-1], True)])
+            notTaken = self.path(items[:-1] + [item(instructions[-1], False)])
+        return (length, last, executes, orders, taken, notTaken)
+
+    def step(self, instruction, counter):
+        """Records a single executed instruction, counter is the order of the next one"""
+        order = instruction.order
+        single = self.singles.get(order)
+        if single is None:
+            single = self.singles[order] = (self.path([item(instruction, True)]), self.path([item(instruction, False)]),
+                                            instruction.opcode in WRITING_OPCODES)
+        self.events.append(single[0] if counter != order + 1 else single[1])
+        if single[2]:
+            var = instruction.ops_list[0].toVar()
+            self.values.append(var.var_type)
+            self.values.append(var.value)
+
+    def checkFlush(self):
+        if len(self.events) >= FLUSH_EVENTS:
+            self.flush()
+
+    def flush(self):
+        paths = self.paths[self.written:]
+        try:
+            data = marshal.dumps((paths, self.events, self.values))
+        except ValueError:
+            #A value marshal does not know, it is written as its str()
+            values = [value if value is None or type(value) in (int, str) else str(value) for value in self.values]
+            data = marshal.dumps((paths, self.events, values))
+        header = bytearray()
+        encodeVarint(header, len(data))
+        self.file.write(header)
+        self.file.write(data)
+        self.written = len(self.paths)
+        #The lists are cleared, not replaced, compiled traces and blocks hold their append methods
+        self.events.clear()
+        self.values.clear()
+
+    def finish(self):
+        self.flush()
+        self.file.close()
+
+class TraceRecord:
+    """Single decoded record"""
+
+    def __init__(self, order, tag, value=None, var_type=None):
+        self.order = order
+        self.tag = tag
+        self.value = value
+        self.var_type = var_type
+
+    def key(self):
+        return (self.order, self.tag, self.var_type, self.value)
+
+    def describe(self):
+        if self.tag == TAG_NONE:
+            return ""
+        elif self.tag in (TAG_TAKEN, TAG_NOT_TAKEN):
+            return TAG_NAMES[self.tag]
+        return "= {0}@{1!r}".format(self.var_type, self.value)
+
+def valueRecord(order, var_type, value):
+    """Returns TraceRecord of a written value"""
+    if var_type == "int" and type(value) is int:
+        return TraceRecord(order, TAG_INT, value, var_type)
+    if var_type == "string" and type(value) is str:
+        return TraceRecord(order, TAG_STRING, value, var_type)
+    if var_type == "bool" and value in ("true", "false"):
+        return TraceRecord(order, TAG_TRUE if value == "true" else TAG_FALSE, value, var_type)
+    return TraceRecord(order, TAG_OTHER, str(value), str(var_type))
+
+def readTrace(path):
+    """Generator of TraceRecords of every executed instruction stored in the file"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("{0} is not an execution trace".format(path))
+
+    paths = list()
+    pos = len(MAGIC)
+    while pos < len(data):
+        length, pos = decodeVarint(data, pos)
+        defined, events, values = marshal.loads(data[pos:pos + length])
+        pos += length
+        paths.extend(defined)
+        values = iter(values)
+        for pid in events:
+            for order, tag, var_type in paths[pid]:
+                if tag is not None:
+                    yield TraceRecord(order, tag)
+                    continue
+                if var_type is None:
+                    var_type = next(values)
+                yield valueRecord(order, var_type, next(values))
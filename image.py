@@ -0,0 +1,229 @@
+#Program image
+#Flat, position-independent form of a loaded program which many worker processes
+#can map at once, through multiprocessing.shared_memory or an mmapped file.
+#All references are indices, the image can be mapped at any address.
+#
+#Layout, all integers are native int32 (images are built and used on one host):
+#  MAGIC, header (HEADER struct)
+#  orders       count int32, orders of the instructions, sorted
+#  instructions count * INSTRUCTION_FIELDS int32:
+#               class constant, operand_type constant or -1, first operand, operand count
+#  operands     operand count * 2 int32: type constant, value constant or -1 for no value
+#  labels       label count * 2 int32: label constant, order of the label
+#  constants    constant count + 1 int32 offsets into the blob
+#  blob         UTF-8 text of all constants, every distinct constant is stored once
+#
+#Instructions are already specialized (see typeinfer.py) and string literals decoded
+#when the image is built.
+#A worker decodes instructions from the image when they are first executed and
+#keeps them in a cache of at most Interpreter.decodeCacheSize instructions, so
+#its private memory does not grow with the size of the program.
+#
+#Only the loading is zero-copy, the dispatch loops do not execute the int32
+#sections in place. Every instruction is still run as an Ins_* object (see
+#LazyProgram), so an instruction evicted from the decode cache is decoded again
+#the next time it runs. Executing the records directly would need a second
+#implementation of every instruction next to the Ins_* classes.
+
+import bisect
+import struct
+import sys
+import instruct
+
+MAGIC = b"IPPIMG1\n"
+HEADER = struct.Struct("=20s6i") #Source digest, flags, instructions, records, operands, labels, constants
+FLAG_SPECIALIZED = 1
+INSTRUCTION_FIELDS = 4
+
+class ImageBuilder:
+    """Serializes loaded (and specialized) program of an interpreter"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.constants = dict() #Text -> index, constants are interned
+        self.texts = list()
+
+    def constant(self, text):
+        index = self.constants.get(text)
+        if index is None:
+            index = self.constants[text] = len(self.texts)
+            self.texts.append(text)
+        return index
+
+    def build(self):
+        interpreter = self.interpreter
+        program = interpreter.buildProgram() #First instruction of every order wins, as in the dispatch loop
+        orders = sorted(program)
+
+        records = list()
+        operands = list()
+        for order in orders:
+            instruction = program[order]
+            operand_type = getattr(instruction, "operand_type", None)
+            records += [self.constant(type(instruction).__name__),
+                        -1 if operand_type is None else self.constant(operand_type),
+                        len(operands) // 2, len(instruction.ops_list)]
+            for op in instruction.ops_list:
+                operands += [self.constant(op.v_type), -1 if op.value is None else self.constant(str(op.value))]
+
+        labels = list()
+        for label_dict in interpreter.label_list:
+            for label, order in label_dict.items():
+                labels += [self.constant(label), order]
+
+        offsets = [0]
+        blob = bytearray()
+        for text in self.texts:
+            blob += text.encode("utf-8", "surrogatepass")
+            offsets.append(len(blob))
+
+        flags = FLAG_SPECIALIZED if interpreter.specializeTypes else 0
+        header = HEADER.pack(bytes.fromhex(interpreter.sourceDigest()), flags, interpreter.programLength(),
+                             len(orders), len(operands) // 2, len(labels) // 2, len(self.texts))
+        parts = [MAGIC, header]
+        for values in (orders, records, operands, labels, offsets):
+            parts.append(struct.pack("={0}i".format(len(values)), *values))
+        parts.append(bytes(blob))
+        return b"".join(parts)
+
+def buildImage(interpreter):
+    """Returns image of the program loaded by interpreter, labels have to be built"""
+    interpreter.internConstants()
+    if interpreter.specializeTypes:
+        interpreter.specialize()
+    return ImageBuilder(interpreter).build()
+
+class ProgramImage:
+    """Read-only view of an image in a buffer, nothing is copied out of it up front"""
+
+    def __init__(self, buf, owner=None):
+        self.owner = owner #Keeps the mapping or the shared memory alive
+        self.buf = memoryview(buf)
+        if bytes(self.buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a program image")
+
+        pos = len(MAGIC)
+        digest, self.flags, self.count, records, operands, labels, constants = HEADER.unpack_from(self.buf, pos)
+        self.digest = digest.hex()
+        pos += HEADER.size
+
+        def section(length):
+            nonlocal pos
+            view = self.buf[pos:pos + 4 * length].cast("i")
+            pos += 4 * length
+            return view
+
+        self.orders = section(records)
+        self.records = section(records * INSTRUCTION_FIELDS)
+        self.operands = section(operands * 2)
+        self.labels = section(labels * 2)
+        self.offsets = section(constants + 1)
+        self.blob = self.buf[pos:]
+
+        self.classes = dict() #Instruction classes by constant index, filled on first use
+
+    @staticmethod
+    def fromFile(path):
+        """Maps image file, the pages are shared by all processes mapping it"""
+        import mmap
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return ProgramImage(mapping, mapping)
+
+    @staticmethod
+    def fromSharedMemory(name):
+        """Attaches image published by publish"""
+        import atexit
+        from multiprocessing import shared_memory
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            #Before Python 3.13 attaching registers the memory with the resource tracker,
+            #which unlinks it when the worker exits, so the registration is skipped
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = shared_memory.SharedMemory(name)
+            finally:
+                resource_tracker.register = register
+        image = ProgramImage(shm.buf, shm)
+        atexit.register(image.close) #SharedMemory refuses to close while the views exist
+        return image
+
+    def close(self):
+        """Releases the views and the mapping, the image can not be used afterwards"""
+        if self.buf is None:
+            return
+        for view in (self.orders, self.records, self.operands, self.labels, self.offsets, self.blob, self.buf):
+            view.release()
+        self.buf = None
+        if self.owner is not None:
+            self.owner.close()
+
+    def constant(self, index):
+        if index < 0:
+            return None
+        offsets = self.offsets
+        return str(self.blob[offsets[index]:offsets[index + 1]], "utf-8", "surrogatepass")
+
+    def instructionClass(self, index):
+        cls = self.classes.get(index)
+        if cls is None:
+            cls = self.classes[index] = getattr(instruct, self.constant(index))
+        return cls
+
+    def labelList(self):
+        """Labels in the form of Interpreter.label_list"""
+        labels = self.labels
+        return [{self.constant(labels[i]): labels[i + 1]} for i in range(0, len(labels), 2)]
+
+    def decode(self, order, interpreter):
+        """Returns new instruction object of order, KeyError if there is none"""
+        i = bisect.bisect_left(self.orders, order)
+        if i == len(self.orders) or self.orders[i] != order:
+            raise KeyError(order)
+
+        base = i * INSTRUCTION_FIELDS
+        records = self.records
+        cls = self.instructionClass(records[base])
+        operand_type = records[base + 1]
+        if operand_type < 0:
+            instruction = cls(order)
+        else:
+            instruction = cls(order, self.constant(operand_type))
+
+        operands = self.operands
+        for k in range(records[base + 2], records[base + 2] + records[base + 3]):
+            op = instruct.Operand(self.constant(operands[2 * k]), self.constant(operands[2 * k + 1]))
+            op.loadLiteral(interpreter.constants, shared=k > records[base + 2], raw=False)
+            if not interpreter.inlineCaches:
+                op.toVar = op.resolveVar
+            instruction.addOperand(op)
+        return instruction
+
+def publish(data, name=None):
+    """Copies image into new shared memory, the caller has to close and unlink it"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name, create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return shm
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Builds program image of an IPPcode18 program, see image.py')
+    parser.add_argument('source', help='XML or IPPcode18 source text')
+    parser.add_argument('image', help='Image file to write')
+    parser.add_argument('--no-specialize', help='Do not specialize instructions with proven operand types', action='store_true')
+    args = parser.parse_args()
+
+    interpreter = instruct.Interpreter(args.source)
+    interpreter.specializeTypes = not args.no_specialize
+    interpreter.buildLabels()
+    data = buildImage(interpreter)
+    with open(args.image, "wb") as f:
+        f.write(data)
+    print("{0} instructions, {1} bytes".format(interpreter.programLength(), len(data)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import xml.etree.ElementTree as ET
+import io
 import sys
 import re
+import time
 
 class Instruction:
     """Class representing an instruction"""
@@ -31,10 +32,6 @@ class Instruction:
         print("Instruction {0} order {1}:".format(self.opcode, self.order))
         self.printOperands()
 
-    def printExecuting(self):
-        return
-        print("Instruction {0} executing, order is {1}, counter is {2}".format(self.opcode, self.order, self.interpreter.instructionCounter) )
-
 class Ins_POPFRAME(Instruction):
     """POPFRAME instruction"""
 
@@ -43,7 +40,6 @@ class Ins_POPFRAME(Instruction):
         self.opcode = "POPFRAME"
 
     def execute(self):
-        self.printExecuting()
         self.interpreter.popFrame()
 
 class Ins_PUSHFRAME(Instruction):
@@ -54,7 +50,6 @@ class Ins_PUSHFRAME(Instruction):
         self.opcode = "PUSHFRAME"
 
     def execute(self):
-        self.printExecuting()
         self.interpreter.pushFrame()
 
 class Ins_CREATEFRAME(Instruction):
@@ -65,7 +60,6 @@ class Ins_CREATEFRAME(Instruction):
         self.opcode = "CREATEFRAME"
 
     def execute(self):
-        self.printExecuting()
         self.interpreter.createTempFrame()
 
 class Ins_DEFVAR(Instruction):
@@ -76,7 +70,6 @@ class Ins_DEFVAR(Instruction):
         self.opcode = "DEFVAR"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         operand = self.ops_list[0].getValue()
         #Check if variable exists in given frame
@@ -99,7 +92,6 @@ class Ins_MOVE(Instruction):
         self.opcode = "MOVE"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         #Get var1 and var2
@@ -126,7 +118,6 @@ class Ins_LABEL(Instruction):
         self.opcode = "LABEL"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var = self.ops_list[0].toVar()
         label = var.getValue()
@@ -140,7 +131,6 @@ class Ins_JUMP(Instruction):
         self.opcode = "JUMP"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var = self.ops_list[0].toVar()
         label = var.getValue()
@@ -154,7 +144,6 @@ class Ins_JUMPIFEQ(Instruction):
         self.opcode = "JUMPIFEQ"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -180,7 +169,6 @@ class Ins_JUMPIFNEQ(Instruction):
         self.opcode = "JUMPIFNEQ"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -206,7 +194,6 @@ class Ins_ADD(Instruction):
         self.opcode = "ADD"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -228,7 +215,6 @@ class Ins_SUB(Instruction):
         self.opcode = "SUB"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -250,7 +236,6 @@ class Ins_MUL(Instruction):
         self.opcode = "MUL"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -272,7 +257,6 @@ class Ins_IDIV(Instruction):
         self.opcode = "IDIV"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -299,7 +283,6 @@ class Ins_LT(Instruction):
         self.opcode = "LT"
 
     def execute(self):
-        self.printExecuting()
         #self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -325,7 +308,6 @@ class Ins_GT(Instruction):
         self.opcode = "GT"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -351,7 +333,6 @@ class Ins_EQ(Instruction):
         self.opcode = "EQ"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -377,7 +358,6 @@ class Ins_AND(Instruction):
         self.opcode = "AND"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -403,7 +383,6 @@ class Ins_OR(Instruction):
         self.opcode = "OR"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -429,7 +408,6 @@ class Ins_NOT(Instruction):
         self.opcode = "NOT"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -454,7 +432,6 @@ class Ins_INT2CHAR(Instruction):
         self.opcode = "INT2CHAR"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -480,7 +457,6 @@ class Ins_STRI2INT(Instruction):
         self.opcode = "STRI2INT"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -513,14 +489,13 @@ class Ins_WRITE(Instruction):
         self.opcode = "WRITE"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         #Get var1
         var1 = self.ops_list[0].toVar()
 
         #Print it
-        print(var1.getValue())
+        self.interpreter.writeOutput(var1.getValue())
 
 class Ins_READ(Instruction):
     """READ instruction"""
@@ -530,7 +505,6 @@ class Ins_READ(Instruction):
         self.opcode = "READ"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         #Get vars
@@ -558,14 +532,8 @@ class Ins_READ(Instruction):
 
         var1.var_type = convertTo
 
-        inp = input()
-        var1.value = inp
-
-        if convertTo == "bool":
-            if inp.lower() == "true":
-                var1.value = "true"
-            else:
-                var1.value = "false"
+        inp = self.interpreter.readInput()
+        var1.value = convertInput(inp, convertTo)
 
 class Ins_CONCAT(Instruction):
     """CONCAT instruction"""
@@ -575,7 +543,6 @@ class Ins_CONCAT(Instruction):
         self.opcode = "CONCAT"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -597,7 +564,6 @@ class Ins_STRLEN(Instruction):
         self.opcode = "STRLEN"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -618,7 +584,6 @@ class Ins_GETCHAR(Instruction):
         self.opcode = "GETCHAR"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -650,7 +615,6 @@ class Ins_SETCHAR(Instruction):
         self.opcode = "SETCHAR"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -683,7 +647,6 @@ class Ins_TYPE(Instruction):
         self.opcode = "TYPE"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
         var2 = self.ops_list[1].toVar()
@@ -702,7 +665,6 @@ class Ins_DPRINT(Instruction):
         self.opcode = "DPRINT"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         var1 = self.ops_list[0].toVar()
 
@@ -716,10 +678,9 @@ class Ins_BREAK(Instruction):
         self.opcode = "BREAK"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
-        self.interpreter.debugInfo()
+        self.interpreter.dumpState()
 
 class Ins_PUSHS(Instruction):
     """PUSHS instruction"""
@@ -729,12 +690,15 @@ class Ins_PUSHS(Instruction):
         self.opcode = "PUSHS"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         var1 = self.ops_list[0].toVar()
+        value = var1.getValue()
+        if value is None:
+            value = EMPTY_VALUES.get(var1.var_type)
 
-        self.interpreter.stackPUSHS(var1)
+        #The stack holds a copy, later writes to the variable do not change it
+        self.interpreter.stackPUSHS(Variable(None, value, var1.var_type))
 
 class Ins_POPS(Instruction):
     """POPS instruction"""
@@ -744,7 +708,6 @@ class Ins_POPS(Instruction):
         self.opcode = "POPS"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         var1 = self.ops_list[0].toVar()
@@ -756,7 +719,8 @@ class Ins_POPS(Instruction):
             print("Trying to pop an empty stack, exiting...")
             exit(56)
 
-        var1 = ret
+        var1.var_type = ret.var_type
+        var1.value = ret.value
 
 class Ins_CALL(Instruction):
     """CALL instruction"""
@@ -766,7 +730,6 @@ class Ins_CALL(Instruction):
         self.opcode = "CALL"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
 
         var1 = self.ops_list[0].toVar()
@@ -786,7 +749,6 @@ class Ins_RETURN(Instruction):
         self.opcode = "RETURN"
 
     def execute(self):
-        self.printExecuting()
         # self.check() TODO: Perform a check of operands (number of arguments, type etc...)
         ret = self.interpreter.insReturn()
         if ret == -1:
@@ -794,12 +756,212 @@ class Ins_RETURN(Instruction):
             print("Trying to pop empty callstack, exiting...")
             exit(56)
 
+#Instruction classes by operation code
+INSTRUCTIONS = {"DEFVAR": Ins_DEFVAR,
+                "MOVE": Ins_MOVE,
+                "CREATEFRAME": Ins_CREATEFRAME,
+                "PUSHFRAME": Ins_PUSHFRAME,
+                "POPFRAME": Ins_POPFRAME,
+                "LABEL": Ins_LABEL,
+                "JUMP": Ins_JUMP,
+                "JUMPIFEQ": Ins_JUMPIFEQ,
+                "JUMPIFNEQ": Ins_JUMPIFNEQ,
+                "ADD": Ins_ADD,
+                "SUB": Ins_SUB,
+                "MUL": Ins_MUL,
+                "IDIV": Ins_IDIV,
+                "LT": Ins_LT,
+                "GT": Ins_GT,
+                "EQ": Ins_EQ,
+                "AND": Ins_AND,
+                "OR": Ins_OR,
+                "NOT": Ins_NOT,
+                "INT2CHAR": Ins_INT2CHAR,
+                "STRI2INT": Ins_STRI2INT,
+                "WRITE": Ins_WRITE,
+                "READ": Ins_READ,
+                "CONCAT": Ins_CONCAT,
+                "STRLEN": Ins_STRLEN,
+                "GETCHAR": Ins_GETCHAR,
+                "SETCHAR": Ins_SETCHAR,
+                "TYPE": Ins_TYPE,
+                "DPRINT": Ins_DPRINT,
+                "BREAK": Ins_BREAK,
+                "PUSHS": Ins_PUSHS,
+                "POPS": Ins_POPS,
+                "CALL": Ins_CALL,
+                "RETURN": Ins_RETURN}
+
+#Operands of the text format which are written without a type prefix
+LABEL_OPERANDS = {"LABEL", "JUMP", "JUMPIFEQ", "JUMPIFNEQ", "CALL"} #First operand is a label
+TYPE_OPERANDS = {"READ"} #Second operand is a type
+
+EMPTY_VALUES = {"string": "", "int": 0, "bool": "false"} #Values of typed variables without one, as set by MOVE
+INPUT_INT = re.compile(r"^\s*[-+]?\d+\s*$")
+LITERAL_INT = re.compile(r"^[-+]?\d+$")
+STRING_ESCAPE = re.compile(r"\\(\d{3})")
+INVALID_ESCAPE = re.compile(r"\\(?!\d{3})") #Backslash is allowed only as the \ddd escape sequence
+NAME = re.compile("^[A-Za-z_$*&%-]{1}[A-Z0-9a-z_$*&%-]*$") #Labels and variable names, the first character cannot be a number
+
+#XML sources up to this size are parsed by loadFromSmallXML, which needs neither ElementTree nor a tree
+SMALL_XML = 1 << 20
+
+#Leading bytes of compressed sources and the modules decompressing them
+COMPRESSED_SOURCES = [(b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "lzma")]
+
+class HashingReader(io.RawIOBase):
+    """Passes data of a binary stream through and hashes it, for sources which can not be read twice"""
+
+    def __init__(self, stream):
+        import hashlib
+        self.stream = stream
+        self.hash = hashlib.sha1()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.stream.read(len(b))
+        b[:len(data)] = data
+        self.hash.update(data)
+        return len(data)
+
+def decodeString(text):
+    """Decodes \\ddd escape sequences of string literal text, None if the text is invalid"""
+    if "\\" not in text:
+        return text
+    if INVALID_ESCAPE.search(text):
+        return None
+    return STRING_ESCAPE.sub(lambda m: chr(int(m.group(1))), text)
+
+def convertInput(inp, var_type):
+    """Value of the input line inp read by READ as var_type, invalid int input reads as 0"""
+    if var_type == "int":
+        return int(inp) if INPUT_INT.match(inp) else 0
+    elif var_type == "bool":
+        return "true" if inp.lower() == "true" else "false"
+    return inp
+
+#Specialized variants emitted by the type inference pass (typeinfer.py)
+#Operand types are proven at load time, so the runtime type checks are left out
+
+class Ins_ADD_Int(Ins_ADD):
+    """ADD instruction with both operands proven int"""
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = "int"
+        var1.value = var2.value + var3.value
+
+class Ins_SUB_Int(Ins_SUB):
+    """SUB instruction with both operands proven int"""
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = "int"
+        var1.value = var2.value - var3.value
+
+class Ins_MUL_Int(Ins_MUL):
+    """MUL instruction with both operands proven int"""
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = "int"
+        var1.value = var2.value * var3.value
+
+class Ins_IDIV_Int(Ins_IDIV):
+    """IDIV instruction with both operands proven int"""
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        if var3.value == 0:
+            self.interpreter.raiseError(57, "Trying to divide by zero, exiting...")
+
+        var1.var_type = "int"
+        var1.value = var2.value // var3.value
+
+class Ins_LT_Same(Ins_LT):
+    """LT instruction with both operands proven to be of operand_type"""
+
+    def __init__(self, order, operand_type):
+        super(Ins_LT_Same, self).__init__(order)
+        self.operand_type = operand_type
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = self.operand_type
+        var1.value = "true" if var2.value < var3.value else "false"
+
+class Ins_GT_Same(Ins_GT):
+    """GT instruction with both operands proven to be of operand_type"""
+
+    def __init__(self, order, operand_type):
+        super(Ins_GT_Same, self).__init__(order)
+        self.operand_type = operand_type
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = self.operand_type
+        var1.value = "true" if var2.value > var3.value else "false"
+
+class Ins_EQ_Same(Ins_EQ):
+    """EQ instruction with both operands proven to be of operand_type"""
+
+    def __init__(self, order, operand_type):
+        super(Ins_EQ_Same, self).__init__(order)
+        self.operand_type = operand_type
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = self.operand_type
+        var1.value = "true" if var2.value == var3.value else "false"
+
+class Ins_CONCAT_Str(Ins_CONCAT):
+    """CONCAT instruction with both operands proven string"""
+
+    def execute(self):
+        var1 = self.ops_list[0].toVar()
+        var2 = self.ops_list[1].toVar()
+        var3 = self.ops_list[2].toVar()
+
+        var1.var_type = "string"
+        var1.value = var2.value + var3.value
+
 class Operand:
     """Class representing single operand of an instruction"""
 
     def __init__(self, v_type, value):
         self.v_type = v_type
         self.value = value
+        self.interpreter = Interpreter.getInstance()
+        self.literal = None #Constant Variable of a literal, bound at load by loadLiteral
+
+        #Inline cache of the resolved variable, valid while the frame epoch does not change
+        self.ic_var = None
+        self.ic_epoch = None
+        self.ic_global = False #GF variables never move, their cache entry is always valid
+        self.ic_misses = 0 #Lookups and epoch refreshes, hits are not counted on the fast path
 
     def check(self):
         """Checks if the operand is valid"""
@@ -811,18 +973,19 @@ class Operand:
             Interpreter.getInstance().raiseError(52, "No value, exiting...")
 
         if self.v_type == "int":
-            p = re.compile("^-?\d*$") #Regular expressions are black magic
-            m = p.match(self.value)
+            if isinstance(self.value, int): #Already converted on a previous check
+                return
+            m = LITERAL_INT.match(self.value)
             if m:
                 self.value = int(self.value)
             else:
                 Interpreter.getInstance().raiseError(52, "Expected integer number, exiting...")
 
         elif self.v_type == "bool":
-            if self.value != "true" or self.value != "false":
+            if self.value != "true" and self.value != "false":
                 Interpreter.getInstance().raiseError(52, "Expected boolean value, exiting...")
         elif self.v_type == "string":
-            pass # TODO :/
+            pass #Escape sequences are decoded and checked once by loadLiteral
         elif self.v_type == "label":
             self.checkName(self.value)
         elif self.v_type == "type":
@@ -842,13 +1005,46 @@ class Operand:
         else:
             Interpreter.getInstance().raiseError(52, "Non-existing type {0}, exiting...".format(self.v_type))
 
+    def loadLiteral(self, pool, shared=True, raw=True):
+        """Decodes and checks literal once at load and binds it to its constant Variable
+
+        Equal constants share one Variable of pool, executing the operand allocates
+        nothing. An operand which can be written to (shared=False) gets its own
+        Variable. Text which is already decoded (raw=False) is not decoded again."""
+        if self.v_type not in {"int", "bool", "string"} or self.literal is not None:
+            return
+        if raw and self.v_type == "string" and self.value is not None:
+            value = decodeString(self.value)
+            if value is None:
+                self.interpreter.raiseError(52, "Invalid escape sequence in string {0}, exiting...".format(self.value))
+            self.value = value
+        self.check()
+
+        key = (self.v_type, self.value)
+        var = pool.get(key)
+        if var is None:
+            var = pool[key] = Variable("literal", self.value, self.v_type)
+        self.value = var.value #Interned
+        if not shared:
+            var = Variable("literal", var.value, self.v_type)
+        self.literal = var
+        self.toVar = self.literalVar #Instance attribute shadows toVar
+
+    def literalVar(self):
+        return self.literal
+
     def checkName(self, name):
-        p = re.compile("^[A-Za-z_$*&%-]{1}[A-Z0-9a-z_$*&%-]*$")  # First character cannot be a number
-        m = p.match(name)
-        if not m:
+        if not NAME.match(name):
             Interpreter.getInstance().raiseError(52, "Name {0} contains illegal character, exiting...".format(name))
 
     def toVar(self):
+        var = self.ic_var
+        if var is not None and (self.ic_global or self.ic_epoch == self.interpreter.frameEpoch):
+            return var
+        return self.resolveVar()
+
+    def resolveVar(self):
+        """Slow path of toVar, looks the variable up and fills the inline cache"""
         self.check()
         if self.v_type == "var":
             split = self.value.split("@")
@@ -856,10 +1052,17 @@ class Operand:
             name = split[1]
 
             #Get variable from specified frame
-            var = Interpreter.getInstance().getVarFromFrame(frame, name)
+            var = self.interpreter.getVarFromFrame(frame, name)
             if var == -1:
-                Interpreter.getInstance().raiseError(54, "Variable does not exists in frame {0}, exiting...".format(frame))
+                self.interpreter.raiseError(54, "Variable does not exists in frame {0}, exiting...".format(frame))
+
+            self.ic_misses += 1
+            self.ic_var = var
+            self.ic_epoch = self.interpreter.frameEpoch
+            self.ic_global = frame == "GF"
             return var
+        elif self.literal is not None:
+            return self.literal
         elif self.v_type in {"int","bool","string","label","type"}:
             return Variable("literal", self.value, self.v_type)
 
@@ -915,28 +1118,94 @@ class Frame:
         for var in self.content:
             var.printVar()
 
+class LazyRecords:
+    """Raw instruction records of a program loaded in the lazy mode, see Interpreter.lazy"""
+
+    def __init__(self):
+        self.records = dict() #order -> (opcode, type, text, type, text, ...), the first one of every order wins
+        self.count = 0 #Instruction elements, as len(Interpreter.instruction_list)
+
+    def add(self, opcode, order, args):
+        self.count += 1
+        self.records.setdefault(order, (opcode,) + args)
+
+    def decode(self, order, interpreter):
+        """Returns new instruction object of order, KeyError if there is none
+
+        The record is dropped, every instruction is decoded once."""
+        record = self.records.pop(order)
+        instruction = interpreter.generateInstruction(record[0], order)
+        for i in range(1, len(record), 2):
+            op = Operand(record[i], record[i + 1])
+            op.loadLiteral(interpreter.constants, shared=i > 1)
+            if not interpreter.inlineCaches:
+                op.toVar = op.resolveVar
+            instruction.addOperand(op)
+        return instruction
+
+class LazyProgram(dict):
+    """Instructions by order, decoded by source.decode(order, interpreter) on first access
+
+    Hits are plain dict lookups. With capacity given at most capacity instructions
+    are kept, the oldest decoded one is dropped when the cache is full."""
+
+    def __init__(self, source, interpreter, capacity=None):
+        super(LazyProgram, self).__init__()
+        self.source = source #Program image (image.ProgramImage) or LazyRecords
+        self.interpreter = interpreter
+        self.capacity = capacity
+        self.decoded = 0
+
+    def __missing__(self, order):
+        instruction = self.source.decode(order, self.interpreter)
+        if self.capacity is not None and len(self) >= self.capacity:
+            del self[next(iter(self))]
+        self[order] = instruction
+        self.decoded += 1
+        return instruction
+
+    def get(self, order, default=None):
+        try:
+            return self[order]
+        except KeyError:
+            return default
+
+class InputPending(Exception):
+    """Raised by READ when the input queue is empty but not closed, see Interpreter.inputLines
+
+    The instruction counter still points to READ, so run() executes it again once
+    more input was queued."""
+
 class Interpreter:
     """Class representing interpreter"""
 
-    __instance = None #Reference to instance
+    __instance = None #Reference to the current instance
 
-    #We want this class to be a singleton
+    #More instances can exist (see scheduler.py), instructions and operands belong
+    #to the instance which was current when they were created
     @staticmethod
     def getInstance():
-        """ Get static instance"""
+        """ Get current instance"""
         if Interpreter.__instance == None:
             Interpreter()
         return Interpreter.__instance
 
-    def __init__(self,file):
-        if Interpreter.__instance != None:
-            raise Exception("Interpreter class is singleton")
-        else:
-            Interpreter.__instance = self
+    def activate(self):
+        """Makes this instance the current one"""
+        Interpreter.__instance = self
+
+    def __init__(self, file, lazy=False):
+        self.activate()
 
         self.instruction_list = list()
         self.label_list = list()
-        self.instructionCounter = int()
+        self.labelIndex = dict() #Label -> its dictionary in label_list
+        self.lazy = lazy #Decode instructions of XML sources when they are first executed
+        self.lazyRecords = None #Raw records of the instructions of a lazily loaded program
+        self.instructionCounter = 1 #Order of the next instruction, kept when a snapshot is restored
+        self.sourceFile = file
+        self.sourceHash = None
+        self.sourceReader = None #Hashes the source read from stdin, it can not be read again
 
         self.varStack = list() #Stack of variables to be used with POPS and PUSHS
         self.callStack = list() #Holds instruction number to return to on RETURN instruction
@@ -945,8 +1214,81 @@ class Interpreter:
         self.localFrame = None #Local frame reference
         self.tempFrame = None #Temporary frame reference
         self.globalFrame = Frame() #Global frame reference
-
-        self.loadFromXML(file)
+        self.frameEpoch = 0 #Changed whenever TF or LF changes, invalidates operand inline caches
+
+        self.specializeTypes = True #Replace instructions with proven operand types by specialized variants
+        self.inlineCaches = True #Cache resolved variables in operands, see Operand.toVar
+        self.blockDispatch = True #Execute whole basic blocks per dispatch, see dispatchBlocks
+        self.blocks = None #Start order -> (instructions, last order, executes, orders), built by prepare
+        self.stats = dict() #Statistics collected by optimization passes and profiling
+        self.constants = dict() #Constant pool, (type, value) -> Variable shared by equal literals
+        self.memoSize = None #Most cached calls of pure functions, None disables memoization, see memo.py
+        self.memo = None #memo.MemoCache of the run
+
+        self.tier = "trace" #"base" only dispatches instructions, "trace" also compiles hot loops
+        self.traceThreshold = 50 #Backward jumps to a label before its loop gets traced
+        self.traceMaxLength = 500 #Longest trace to record
+        self.traceSlice = 1000 #Most iterations of a trace before returning to the dispatch loop
+        self.traces = dict() #Compiled traces, indexed by order of the first instruction behind the label
+        self.loopCounts = dict()
+        self.untraceable = set()
+        self.profile = None #Profile of a previous run used to compile hot loops up front, see pgo.py
+
+        #Limits of untrusted programs, None means unlimited
+        self.maxInstructions = None
+        self.timeout = None #Wall-clock limit in seconds
+        self.maxVariables = None
+        self.checkInterval = 4096 #Executed instructions between two checks of the limits
+
+        self.executedInstructions = 0 #Updated every checkInterval instructions
+        self.variableCount = 0 #Variables in all reachable frames
+        self.startTime = None
+
+        #Snapshots of the interpreter state
+        self.checkpointFile = None
+        self.checkpointEvery = None #Executed instructions between two snapshots, None writes them on SIGUSR1 only
+        self.checkpointRequested = False
+        self.nextCheckpoint = None
+        self.checkpointWriter = None #Process id of the forked snapshot writer
+
+        self.observers = list() #See addObserver
+        self.execTrace = None #exectrace.TraceRecorder, see recordTrace
+
+        #Debugger hooks, a run with any of them gets its own dispatch loop (dispatchDebug)
+        self.breakpoints = dict() #Order -> callback(interpreter, instruction), see addBreakpoint
+        self.watchpoints = dict() #Variable name -> [callback, last (type, value)], see addWatchpoint
+        self.stepHooks = list() #Callbacks(interpreter, instruction), see addStepHook
+
+        #Memory accounting, counts are kept up to date by the frame and stack operations
+        self.frameCount = 1 #Global frame, frames on the stack and the temporary frame
+        self.peakFrames = 1
+        self.peakVariables = 0
+        self.peakDataStack = 0
+        self.peakCallStack = 0
+        self.peakFrameDepth = 0 #Frames on the frame stack
+        self.sampleStrings = False #Measure string values at every periodic check, see memoryStats
+        self.peakStringBytes = 0
+
+        self.inputPosition = 0 #Lines read by READ
+        self.outputPosition = 0 #Lines written by WRITE
+        self.inputLines = None #Queue of input lines used instead of stdin, see readInput
+        self.inputClosed = False #No more lines will be added to inputLines
+
+        self.program = None #Instructions indexed by order, built by prepare
+        self.image = None #Program image the instructions are decoded from, see image.py
+        self.decodeCacheSize = 8192 #Most instructions decoded from the image at once
+        self.totalInstructions = None
+        self.sliceEnd = None #Executed instruction count at which run returns, None runs to the end
+
+        self.metrics = None #metrics.MetricsExporter of the run
+        self.loadTime = 0.0 #Seconds spent in loadProgram
+        self.prepareTime = 0.0 #Seconds spent in prepare
+        self.outputBytes = 0 #UTF-8 bytes written by WRITE, newlines included
+
+        if file is not None: #The program can also come from an image, see loadImage
+            start = time.perf_counter()
+            self.loadProgram(file)
+            self.loadTime = time.perf_counter() - start
 
     def raiseError(self, errcode, message=None):
         print(message)
@@ -984,6 +1326,11 @@ class Interpreter:
             self.getLocalFrame().addVar(var)
         elif (frame == "TF"):
             self.getTempFrame().addVar(var)
+        self.variableCount += 1
+        if self.variableCount > self.peakVariables:
+            self.peakVariables = self.variableCount
+        if self.maxVariables is not None and self.variableCount > self.maxVariables:
+            self.limitExceeded(62, "Variable limit exceeded")
 
     def dumpFrames(self):
         print("Global frame:")
@@ -998,22 +1345,36 @@ class Interpreter:
             self.getTempFrame().printFrame()
 
     def createTempFrame(self):
+        if self.tempFrame is not None:
+            self.variableCount -= len(self.tempFrame.content) #Old temporary frame is dropped
+        else:
+            self.frameCount += 1
+            if self.frameCount > self.peakFrames:
+                self.peakFrames = self.frameCount
         self.tempFrame = Frame()
+        self.frameEpoch += 1
 
     def pushFrame(self):
         if self.tempFrame is None:
             self.raiseError(55,"No temporary frame, exiting...")
 
         self.frameStack.append(self.tempFrame) #Push tempFrame to stack
+        if len(self.frameStack) > self.peakFrameDepth:
+            self.peakFrameDepth = len(self.frameStack)
         self.refreshLocalFrame() #Set new local frame
         self.tempFrame = None #Deinitialize tempFrame
+        self.frameEpoch += 1
 
     def popFrame(self):
         if self.localFrame is None:
             self.raiseError(55,"No local frame, exiting...")
 
+        if self.tempFrame is not None:
+            self.variableCount -= len(self.tempFrame.content) #Old temporary frame is dropped
+            self.frameCount -= 1
         self.tempFrame = self.frameStack.pop() #Pop the stack
         self.refreshLocalFrame() #Refresh to new localFrame
+        self.frameEpoch += 1
 
     def refreshLocalFrame(self):
         if len(self.frameStack) == 0:
@@ -1028,7 +1389,9 @@ class Interpreter:
             self.raiseError(52,"Label {0} already defined, exiting...".format(label))
 
         #Seems fine, add to the label list
-        self.label_list.append({label: order})
+        label_dict = {label: order}
+        self.label_list.append(label_dict)
+        self.labelIndex[label] = label_dict
 
     def jumpToLabel(self, label):
         label_dict = self.findLabel(label)
@@ -1042,13 +1405,26 @@ class Interpreter:
 
     def findLabel(self, label):
         """Finds specified label in list, if the label is undefined it returns -1"""
-        for d in self.label_list:
-            if label in d:
-                return d
-        return -1
-
-    def debugInfo(self):
-        print("Instruction counter = {0}".format(self.instructionCounter),file = sys.stderr)
+        return self.labelIndex.get(label, -1)
+
+    def dumpState(self, file=None):
+        """Prints the position, frames and stacks to file, stderr by default; used by BREAK and the default breakpoint"""
+        file = file or sys.stderr #Looked up at the call, the scheduler redirects stderr per job
+        def describe(var):
+            if var.var_type is None:
+                return "{0}=uninitialized".format(var.name)
+            return "{0}={1}@{2}".format(var.name, var.var_type, var.value)
+
+        print("Instruction counter = {0}".format(self.instructionCounter), file=file)
+        print("executed instructions: at least {0}".format(self.executedInstructions), file=file) #Counted at checks only
+        print("GF: {0}".format(" ".join(describe(var) for var in self.globalFrame.content)), file=file)
+        for depth, frame in enumerate(reversed(self.frameStack)):
+            name = "LF" if depth == 0 else "LF-{0}".format(depth) #Frames below LF, the closest one first
+            print("{0}: {1}".format(name, " ".join(describe(var) for var in frame.content)), file=file)
+        if self.tempFrame is not None:
+            print("TF: {0}".format(" ".join(describe(var) for var in self.tempFrame.content)), file=file)
+        print("data stack: {0}".format(" ".join("{0}@{1}".format(var.var_type, var.value) for var in self.varStack)), file=file)
+        print("call stack: {0}".format(" ".join(str(order) for order in self.callStack)), file=file)
 
     def stackPOPS(self):
         if len(self.varStack) == 0:
@@ -1057,9 +1433,13 @@ class Interpreter:
 
     def stackPUSHS(self, var):
         self.varStack.append(var)
+        if len(self.varStack) > self.peakDataStack:
+            self.peakDataStack = len(self.varStack)
 
     def insCall(self,label,order):
         self.callStack.append(order)
+        if len(self.callStack) > self.peakCallStack:
+            self.peakCallStack = len(self.callStack)
         self.jumpToLabel(label)
 
     def insReturn(self):
@@ -1071,45 +1451,10 @@ class Interpreter:
     def generateInstruction(self, opcode, order):
         """Generates empty(without operands)instruction according to opcode"""
 
-        instructions = {"DEFVAR": Ins_DEFVAR(order),
-                        "MOVE": Ins_MOVE(order),
-                        "CREATEFRAME": Ins_CREATEFRAME(order),
-                        "PUSHFRAME": Ins_PUSHFRAME(order),
-                        "POPFRAME": Ins_POPFRAME(order),
-                        "LABEL": Ins_LABEL(order),
-                        "JUMP": Ins_JUMP(order),
-                        "JUMPIFEQ": Ins_JUMPIFEQ(order),
-                        "JUMPIFNEQ": Ins_JUMPIFNEQ(order),
-                        "ADD": Ins_ADD(order),
-                        "SUB": Ins_SUB(order),
-                        "MUL": Ins_MUL(order),
-                        "IDIV": Ins_IDIV(order),
-                        "LT": Ins_LT(order),
-                        "GT": Ins_GT(order),
-                        "EQ": Ins_EQ(order),
-                        "AND": Ins_AND(order),
-                        "OR": Ins_OR(order),
-                        "NOT": Ins_NOT(order),
-                        "INT2CHAR": Ins_INT2CHAR(order),
-                        "STRI2INT": Ins_STRI2INT(order),
-                        "WRITE": Ins_WRITE(order),
-                        "READ": Ins_READ(order),
-                        "CONCAT": Ins_CONCAT(order),
-                        "STRLEN": Ins_STRLEN(order),
-                        "GETCHAR": Ins_GETCHAR(order),
-                        "SETCHAR": Ins_SETCHAR(order),
-                        "TYPE": Ins_TYPE(order),
-                        "DPRINT": Ins_DPRINT(order),
-                        "BREAK": Ins_BREAK(order),
-                        "PUSHS": Ins_PUSHS(order),
-                        "POPS": Ins_POPS(order),
-                        "CALL": Ins_CALL(order),
-                        "RETURN": Ins_RETURN(order)}
-
-        if opcode not in instructions:
+        if opcode not in INSTRUCTIONS:
             self.raiseError(32, "Unknown operation code {0}, exiting...".format(opcode))
 
-        return instructions[opcode]
+        return INSTRUCTIONS[opcode](order)
 
     def addToList(self, instruction=None):
         """Adds instruction to the list of instructions"""
@@ -1128,43 +1473,950 @@ class Interpreter:
                 return ins
         return -1
 
-    def loadFromXML(self, file):
-        """Loads XML from specified file and fills the instruction list"""
-        tree = ET.parse(file)
-        root = tree.getroot()
+    def openSource(self, file):
+        """Opens program source as buffered binary stream, "-" is stdin
 
-        if root.attrib["language"].lower() != "ippcode18":
-            self.raiseError(52, "Program language is not IPPcode18, exiting...")
+        Compressed sources (gzip, bzip2, xz) are decompressed while they are read."""
+        if file == "-":
+            self.sourceReader = HashingReader(sys.stdin.buffer)
+            stream = io.BufferedReader(self.sourceReader)
+        else:
+            stream = open(file, "rb")
+
+        head = stream.peek(8)
+        for magic, module in COMPRESSED_SOURCES:
+            if head.startswith(magic):
+                if file != "-":
+                    stream.close()
+                    stream = file
+                return __import__(module).open(stream, "rb")
+        return stream
+
+    def loadProgram(self, file):
+        """Loads program in the XML or in the IPPcode18 text format, or program image"""
+        with self.openSource(file) as stream:
+            head = stream.peek(64)[:64].lstrip()
+
+            #XML always starts with a tag, the text format with the .IPPcode18 header or a comment
+            if head.startswith(b"IPPIMG"):
+                import image
+                if isinstance(stream, io.BufferedReader) and self.sourceReader is None:
+                    self.loadImage(image.ProgramImage.fromFile(file))
+                else:
+                    self.loadImage(image.ProgramImage(stream.read()))
+            elif head.startswith(b"<") or head.startswith(b"\xef\xbb\xbf<"):
+                if not self.lazy and self.sourceSize(stream) <= SMALL_XML:
+                    self.loadFromSmallXML(stream.read())
+                else:
+                    self.loadFromXML(stream)
+            else:
+                self.loadFromText(stream)
+
+        if self.sourceHash is None and self.sourceReader is not None:
+            self.sourceHash = self.sourceReader.hash.hexdigest()
+
+    def loadImage(self, image):
+        """Uses program image (image.ProgramImage), instructions are decoded when executed"""
+        self.image = image
+        for label_dict in image.labelList():
+            for label, order in label_dict.items():
+                self.addLabel(label, order)
+        self.sourceHash = image.digest
+
+    def programLength(self):
+        """Number of instructions of the program"""
+        if self.image is not None:
+            return self.image.count
+        if self.lazyRecords is not None:
+            return self.lazyRecords.count
+        return len(self.instruction_list)
+
+    def loadFromText(self, stream):
+        """Loads IPPcode18 source text from binary stream and fills the instruction list"""
+        header = False
+        order = 0
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            if "#" in line:
+                line = line[:line.index("#")]
+            tokens = line.split()
+            if not tokens:
+                continue
 
-        for instruct in root:
-            # Generate instruction and save it in i
-            ins = self.generateInstruction(instruct.attrib["opcode"], instruct.attrib["order"])
+            if not header:
+                if len(tokens) != 1 or tokens[0].lower() != ".ippcode18":
+                    self.raiseError(52, "Program language is not IPPcode18, exiting...")
+                header = True
+                continue
 
-            for arg in instruct:
-                op = Operand(arg.attrib["type"], arg.text)
+            order += 1
+            opcode = tokens[0].upper()
+            ins = self.generateInstruction(opcode, order)
+
+            for i, token in enumerate(tokens[1:]):
+                if (i == 0 and opcode in LABEL_OPERANDS) or (i == 1 and opcode in TYPE_OPERANDS):
+                    op = Operand("label" if i == 0 else "type", token)
+                elif "@" in token:
+                    prefix, value = token.split("@", 1)
+                    if prefix in {"GF", "LF", "TF"}:
+                        op = Operand("var", token)
+                    elif prefix in {"int", "bool", "string"}:
+                        op = Operand(prefix, value if value != "" else None) #Same as an empty XML element
+                    else:
+                        self.raiseError(32, "Invalid operand {0}, exiting...".format(token))
+                else:
+                    self.raiseError(32, "Invalid operand {0}, exiting...".format(token))
                 ins.addOperand(op)
 
             self.addToList(ins)
 
-    def interpret(self):
-        self.instructionCounter = 1
-        totalInstructions = len(self.instruction_list)+1
-
-        self.buildLabels()
+        if not header:
+            self.raiseError(52, "Program language is not IPPcode18, exiting...")
 
-        while(self.instructionCounter != totalInstructions):
-            #Load next instruction according to instructionCounter and execute it
-            nextInstruction = self.getInsFromList(self.instructionCounter)
+    def loadFromXML(self, stream):
+        """Loads XML from binary stream and fills the instruction list
+
+        The XML is parsed incrementally, every instruction element is dropped once
+        its instruction was created, so the whole tree never exists at once.
+        In the lazy mode only LABELs become instructions, the other elements are
+        kept as raw records (LazyRecords) until they are executed."""
+        import xml.etree.ElementTree as ET
+        if self.lazy:
+            self.lazyRecords = LazyRecords()
+        root = None
+        depth = 0
+        for event, element in ET.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                    if root.attrib["language"].lower() != "ippcode18":
+                        self.raiseError(52, "Program language is not IPPcode18, exiting...")
+                continue
 
-            #If we got a label instruction, skip it
-            if nextInstruction.opcode == "LABEL":
-                self.instructionCounter = self.instructionCounter + 1
+            depth -= 1
+            if depth != 1:
                 continue
 
-            nextInstruction.execute()
+            opcode = element.attrib["opcode"]
+            if self.lazyRecords is not None:
+                order = int(element.attrib["order"])
+                if opcode not in INSTRUCTIONS:
+                    self.raiseError(32, "Unknown operation code {0}, exiting...".format(opcode))
+                args = list()
+                for arg in element:
+                    args += [sys.intern(arg.attrib["type"]), arg.text]
+                self.lazyRecords.add(sys.intern(opcode), order, tuple(args))
+                if opcode != "LABEL":
+                    del root[:]
+                    continue
 
-            #Increment the instruction counter
-            self.instructionCounter = self.instructionCounter + 1
+            # Generate instruction and save it in i
+            ins = self.generateInstruction(opcode, element.attrib["order"])
+
+            for arg in element:
+                op = Operand(arg.attrib["type"], arg.text)
+                ins.addOperand(op)
+
+            self.addToList(ins)
+            del root[:]
+
+    def sourceSize(self, stream):
+        """Size of the source file stream reads, infinite for stdin and compressed sources"""
+        import os
+        if isinstance(stream, io.BufferedReader) and self.sourceReader is None:
+            return os.fstat(stream.fileno()).st_size
+        return float("inf")
+
+    def loadFromSmallXML(self, data):
+        """Loads XML from bytes data with expat, without building elements
+
+        Same checks in the same order as loadFromXML, for small sources where the
+        import of ElementTree takes longer than parsing the program."""
+        from xml.parsers import expat
+
+        parser = expat.ParserCreate(None, "}") #Namespaces are processed as by ElementTree
+        depth = 0
+        instruction = None #(attributes, [[arguments attributes, text]]) of the open instruction
+        text = None #Character data of the open argument up to its first child element
+
+        def argumentText():
+            nonlocal text
+            instruction[1][-1][1] = "".join(text) if text else None
+            text = None
+
+        def start(tag, attrib):
+            nonlocal depth, instruction, text
+            depth += 1
+            if depth == 1:
+                if attrib["language"].lower() != "ippcode18":
+                    self.raiseError(52, "Program language is not IPPcode18, exiting...")
+            elif depth == 2:
+                instruction = (attrib, list())
+            elif depth == 3:
+                instruction[1].append([attrib, None])
+                text = list()
+            elif text is not None:
+                argumentText()
+
+        def end(tag):
+            nonlocal depth
+            depth -= 1
+            if depth == 2 and text is not None:
+                argumentText()
+            elif depth == 1:
+                attrib, args = instruction
+                ins = self.generateInstruction(attrib["opcode"], attrib["order"])
+                for arg, value in args:
+                    ins.addOperand(Operand(arg["type"], value))
+                self.addToList(ins)
+
+        def characters(data):
+            if text is not None and depth == 3:
+                text.append(data)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = characters
+        parser.buffer_text = True
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError as e:
+            #Reported the same way as by ElementTree in loadFromXML
+            import xml.etree.ElementTree as ET
+            error = ET.ParseError(str(e))
+            error.code, error.position = e.code, (e.lineno, e.offset)
+            raise error from None
+
+    def interpret(self):
+        self.prepare()
+        try:
+            self.run()
+        finally:
+            self.finish()
+
+    def prepare(self):
+        """Runs the load time passes, the program can be executed by run afterwards"""
+        self.activate()
+        start = time.perf_counter()
+        self.totalInstructions = self.programLength()+1
+
+        #An image has its labels resolved and is specialized when it is built
+        if self.image is None:
+            self.buildLabels()
+            self.internConstants()
+
+            #The type inference needs the whole program, a lazy program is not specialized
+            if self.specializeTypes and self.lazyRecords is None:
+                self.specialize()
+
+            #The purity analysis needs the whole program as well
+            if self.memoSize is not None and self.lazyRecords is None:
+                self.memoize()
+
+            if not self.inlineCaches:
+                self.disableInlineCaches()
+
+        program = self.buildProgram()
+        if self.blockDispatch and self.image is None and self.lazyRecords is None:
+            self.buildBlocks()
+        if self.profile is not None and self.tier == "trace":
+            import pgo
+            self.stats["traces from profile"] = pgo.compileHotLoops(self, program, self.profile)
+
+        self.startTime = time.perf_counter()
+        self.prepareTime = self.startTime - start
+
+    def run(self, instructions=None):
+        """Continues the prepared program, returns True once it finished
+
+        With instructions given it returns False after executing about that many
+        instructions, the slice ends at the next check of the limits and a running
+        trace can overshoot it by one iteration. READ raises InputPending when it
+        waits for queued input."""
+        self.sliceEnd = None if instructions is None else self.executedInstructions + instructions
+
+        #Observers and debugger hooks need to see every instruction, they get their
+        #own dispatch loops so the common loop does not pay for them
+        if self.breakpoints or self.watchpoints or self.stepHooks:
+            return self.dispatchDebug(self.program, self.totalInstructions)
+        if self.observers:
+            return self.dispatchObserved(self.program, self.totalInstructions)
+        if self.execTrace is not None:
+            return self.dispatchRecorded(self.program, self.totalInstructions)
+        if self.blocks is not None:
+            return self.dispatchBlocks(self.program, self.totalInstructions)
+        return self.dispatch(self.program, self.totalInstructions)
+
+    def finish(self):
+        """Called once the run ended, normally or not"""
+        self.waitForCheckpointWriter()
+        for observer in self.observers:
+            observer.finish()
+        if self.execTrace is not None:
+            self.execTrace.finish()
+
+    def dispatch(self, program, totalInstructions):
+        """Main dispatch loop, returns False when the time slice ended"""
+        tracing = self.tier == "trace"
+        interval = self.nextCheckInterval()
+        budget = interval #Instructions left until the next check of the limits
+
+        try:
+            while(self.instructionCounter != totalInstructions):
+                #Load next instruction according to instructionCounter and execute it
+                order = self.instructionCounter
+                nextInstruction = program[order]
+
+                #If we got a label instruction, skip it
+                if nextInstruction.opcode == "LABEL":
+                    self.instructionCounter = order + 1
+                    continue
+
+                nextInstruction.execute()
+                budget -= 1
+
+                #Increment the instruction counter
+                counter = self.instructionCounter + 1
+                self.instructionCounter = counter
+
+                #Backward jump, counter points just behind the target label
+                if tracing and counter <= order:
+                    budget -= self.backwardJump(counter, budget)
+
+                if budget <= 0:
+                    self.executedInstructions += interval - budget
+                    interval = budget = self.nextCheckInterval()
+                    self.periodicCheck()
+                    if self.sliceEnd is not None and self.executedInstructions >= self.sliceEnd:
+                        return False
+        finally:
+            self.executedInstructions += interval - budget
+        return True
+
+    def dispatchBlocks(self, program, totalInstructions):
+        """Dispatch loop executing a whole basic block (see cfg.py) per iteration
+
+        The instruction counter is only updated at block exits, while a block runs it
+        points to its last instruction, so a jump, CALL or RETURN ending the block
+        sees its own order. When an instruction raises, the counter is moved to it.
+        Positions inside a block (e.g. READ which waited for input) and blocks longer
+        than the instructions left until the next check are executed one instruction
+        at a time, so the limits stay exact."""
+        blocks = self.blocks
+        tracing = self.tier == "trace"
+        interval = self.nextCheckInterval()
+        budget = interval
+
+        try:
+            while(self.instructionCounter != totalInstructions):
+                order = self.instructionCounter
+                block = blocks.get(order)
+                if block is not None and block[0] <= budget:
+                    length, last, executes, orders = block
+                    self.instructionCounter = last
+                    done = 0
+                    try:
+                        for execute in executes:
+                            execute()
+                            done += 1
+                    except BaseException:
+                        self.instructionCounter = orders[done]
+                        budget -= done
+                        raise
+                    budget -= length
+                else:
+                    nextInstruction = program[order]
+                    last = order
+                    if nextInstruction.opcode == "LABEL":
+                        self.instructionCounter = order + 1
+                        continue
+                    nextInstruction.execute()
+                    budget -= 1
+
+                counter = self.instructionCounter + 1
+                self.instructionCounter = counter
+
+                if tracing and counter <= last:
+                    budget -= self.backwardJump(counter, budget)
+
+                if budget <= 0:
+                    self.executedInstructions += interval - budget
+                    interval = budget = self.nextCheckInterval()
+                    self.periodicCheck()
+                    if self.sliceEnd is not None and self.executedInstructions >= self.sliceEnd:
+                        return False
+        finally:
+            self.executedInstructions += interval - budget
+        return True
+
+    def dispatchRecorded(self, program, totalInstructions):
+        """dispatchBlocks writing the execution trace (see exectrace.py)
+
+        Every executed basic block is recorded as a whole, compiled traces record
+        their iterations themselves. Instructions executed one at a time, which are
+        all of them in a program without basic blocks, are recorded one by one."""
+        recorder = self.execTrace
+        events = recorder.events
+        recorded = recorder.blocks
+        blocks = self.blocks if self.blocks is not None else dict()
+        tracing = self.tier == "trace"
+        interval = self.nextCheckInterval()
+        budget = interval
+
+        try:
+            while(self.instructionCounter != totalInstructions):
+                order = self.instructionCounter
+                block = recorded.get(order)
+                if block is None and order in blocks:
+                    block = recorded[order] = recorder.block(program, blocks[order])
+                if block is not None and block[0] <= budget:
+                    length, last, executes, orders, taken, notTaken = block
+                    self.instructionCounter = last
+                    done = 0
+                    try:
+                        for execute in executes:
+                            execute()
+                            done += 1
+                    except BaseException:
+                        self.instructionCounter = orders[done]
+                        budget -= done
+                        if done:
+                            events.append(recorder.prefix(taken, done))
+                        raise
+                    budget -= length
+                    counter = self.instructionCounter + 1
+                    events.append(taken if counter != last + 1 else notTaken)
+                else:
+                    nextInstruction = program[order]
+                    last = order
+                    if nextInstruction.opcode == "LABEL":
+                        self.instructionCounter = order + 1
+                        continue
+                    nextInstruction.execute()
+                    budget -= 1
+                    counter = self.instructionCounter + 1
+                    recorder.step(nextInstruction, counter)
+
+                self.instructionCounter = counter
+
+                if tracing and counter <= last:
+                    budget -= self.backwardJump(counter, budget)
+
+                if budget <= 0:
+                    self.executedInstructions += interval - budget
+                    interval = budget = self.nextCheckInterval()
+                    self.periodicCheck()
+                    if self.sliceEnd is not None and self.executedInstructions >= self.sliceEnd:
+                        return False
+        finally:
+            self.executedInstructions += interval - budget
+        return True
+
+    def dispatchObserved(self, program, totalInstructions):
+        """Dispatch loop reporting every executed instruction to the observers
+
+        Hot loops are not traced, a compiled trace would hide its instructions."""
+        observers = self.stepObservers()
+        interval = self.nextCheckInterval()
+        budget = interval
+
+        try:
+            while(self.instructionCounter != totalInstructions):
+                order = self.instructionCounter
+                nextInstruction = program[order]
+
+                if nextInstruction.opcode == "LABEL":
+                    self.instructionCounter = order + 1
+                    continue
+
+                nextInstruction.execute()
+                budget -= 1
+
+                counter = self.instructionCounter + 1
+                self.instructionCounter = counter
+
+                for observer in observers:
+                    observer.step(nextInstruction, counter)
+
+                if budget <= 0:
+                    self.executedInstructions += interval - budget
+                    interval = budget = self.nextCheckInterval()
+                    self.periodicCheck()
+                    if self.sliceEnd is not None and self.executedInstructions >= self.sliceEnd:
+                        return False
+        finally:
+            self.executedInstructions += interval - budget
+        return True
+
+    def dispatchDebug(self, program, totalInstructions):
+        """Dispatch loop calling the debugger hooks, the observers are notified as well
+
+        Breakpoints are checked before the instruction of their order, step hooks
+        and watchpoints after every executed instruction. Jumps continue behind
+        their label, a breakpoint on a LABEL is reached only by falling through."""
+        breakpoints = self.breakpoints
+        watchpoints = self.watchpoints
+        stepHooks = self.stepHooks
+        observers = self.stepObservers()
+        interval = self.nextCheckInterval()
+        budget = interval
+
+        try:
+            while(self.instructionCounter != totalInstructions):
+                order = self.instructionCounter
+                nextInstruction = program[order]
+
+                if order in breakpoints:
+                    breakpoints[order](self, nextInstruction)
+
+                if nextInstruction.opcode == "LABEL":
+                    self.instructionCounter = order + 1
+                    continue
+
+                nextInstruction.execute()
+                budget -= 1
+
+                counter = self.instructionCounter + 1
+                self.instructionCounter = counter
+
+                for observer in observers:
+                    observer.step(nextInstruction, counter)
+                for hook in stepHooks:
+                    hook(self, nextInstruction)
+                if watchpoints:
+                    self.checkWatchpoints(nextInstruction)
+
+                if budget <= 0:
+                    self.executedInstructions += interval - budget
+                    interval = budget = self.nextCheckInterval()
+                    self.periodicCheck()
+                    if self.sliceEnd is not None and self.executedInstructions >= self.sliceEnd:
+                        return False
+        finally:
+            self.executedInstructions += interval - budget
+        return True
+
+    def addBreakpoint(self, order, callback=None):
+        """Calls callback(interpreter, instruction) whenever the instruction of order is
+        about to be executed, by default the state is printed by dumpState"""
+        self.breakpoints[order] = callback or self.printBreakpoint
+
+    def removeBreakpoint(self, order):
+        self.breakpoints.pop(order, None)
+
+    def addWatchpoint(self, name, callback=None):
+        """Calls callback(interpreter, name, old, new, instruction) after an instruction
+        changed variable name, e.g. "GF@x"; old and new are (type, value) tuples,
+        None while the variable does not exist"""
+        self.watchpoints[name] = [callback or self.printWatchpoint, None]
+
+    def removeWatchpoint(self, name):
+        self.watchpoints.pop(name, None)
+
+    def addStepHook(self, callback):
+        """Calls callback(interpreter, instruction) after every executed instruction"""
+        self.stepHooks.append(callback)
+
+    def removeStepHook(self, callback):
+        if callback in self.stepHooks:
+            self.stepHooks.remove(callback)
+
+    def checkWatchpoints(self, instruction):
+        for name, watch in self.watchpoints.items():
+            var = self.peekVariable(name)
+            current = None if var is None else (var.var_type, var.value)
+            if current != watch[1]:
+                old = watch[1]
+                watch[1] = current
+                watch[0](self, name, old, current, instruction)
+
+    def peekVariable(self, name):
+        """Variable of name like "GF@x", None if it or its frame does not exist; never fails"""
+        frame, _, name = name.partition("@")
+        frame = {"GF": self.globalFrame, "LF": self.localFrame, "TF": self.tempFrame}.get(frame)
+        if frame is None:
+            return None
+        var = frame.getVar(name)
+        return None if var == -1 else var
+
+    def printBreakpoint(self, interpreter, instruction):
+        print("Breakpoint at order {0} ({1})".format(instruction.order, instruction.opcode), file=sys.stderr)
+        self.dumpState()
+
+    def printWatchpoint(self, interpreter, name, old, new, instruction):
+        def describe(value):
+            if value is None:
+                return "undefined"
+            return "uninitialized" if value[0] is None else "{0}@{1}".format(*value)
+
+        print("Watchpoint {0}: {1} -> {2} by {3} at order {4}".format(
+            name, describe(old), describe(new), instruction.opcode, instruction.order), file=sys.stderr)
+
+    def printStep(self, interpreter, instruction):
+        print("Instruction {0} executed, order is {1}, counter is {2}".format(
+            instruction.opcode, instruction.order, self.instructionCounter), file=sys.stderr)
+
+    def addObserver(self, observer):
+        """Registers object with step(instruction, counter) and finish() methods
+
+        step is called after every executed instruction with the order of the next one."""
+        self.observers.append(observer)
+
+    def recordTrace(self, recorder):
+        """Writes the execution trace of the run to recorder (exectrace.TraceRecorder)
+
+        Unlike observers the recorder does not need every instruction reported, the
+        run keeps its basic blocks and compiled traces, see dispatchRecorded."""
+        self.execTrace = recorder
+
+    def stepObservers(self):
+        """Observers to report every instruction to, the execution trace included"""
+        if self.execTrace is None:
+            return self.observers
+        return self.observers + [self.execTrace]
+
+    def periodicCheck(self):
+        """Called by the dispatch loops every few thousand instructions"""
+        self.checkLimits()
+        if self.execTrace is not None:
+            self.execTrace.checkFlush()
+        if self.sampleStrings:
+            self.stringBytes()
+        if self.checkpointFile is not None:
+            self.checkpoint()
+        if self.metrics is not None:
+            self.metrics.periodic()
+
+    def nextCheckInterval(self):
+        """Number of instructions to execute before the limits are checked again"""
+        interval = self.checkInterval
+        if self.maxInstructions is not None:
+            interval = min(interval, self.maxInstructions - self.executedInstructions)
+        if self.sliceEnd is not None:
+            interval = min(interval, self.sliceEnd - self.executedInstructions)
+        return max(1, interval)
+
+    def stringBytes(self):
+        """Returns UTF-8 size of all string values held in frames and on the data stack"""
+        frames = [self.globalFrame] + self.frameStack
+        if self.tempFrame is not None:
+            frames.append(self.tempFrame)
+
+        total = 0
+        for frame in frames:
+            for var in frame.content:
+                if type(var.value) is str:
+                    total += len(var.value.encode("utf-8", "surrogatepass"))
+        for var in self.varStack:
+            if type(var.value) is str:
+                total += len(var.value.encode("utf-8", "surrogatepass"))
+
+        if total > self.peakStringBytes:
+            self.peakStringBytes = total
+        return total
+
+    def memoryStats(self):
+        """Returns peak and final counts of frames, variables, stacks and string bytes
+
+        Peak string bytes are sampled at the periodic checks only."""
+        final_strings = self.stringBytes()
+        return {"frames": {"peak": self.peakFrames, "final": self.frameCount},
+                "variables": {"peak": self.peakVariables, "final": self.variableCount},
+                "data_stack_depth": {"peak": self.peakDataStack, "final": len(self.varStack)},
+                "call_stack_depth": {"peak": self.peakCallStack, "final": len(self.callStack)},
+                "string_bytes": {"peak": self.peakStringBytes, "final": final_strings}}
+
+    def readInput(self):
+        """Reads one line of input for READ, from inputLines if it is set"""
+        if self.inputLines is not None:
+            if not self.inputLines:
+                if self.inputClosed:
+                    raise EOFError("EOF when reading a line") #Same as input()
+                raise InputPending()
+            inp = self.inputLines.popleft()
+        else:
+            inp = input()
+        self.inputPosition += 1
+        return inp
+
+    def writeOutput(self, value):
+        """Writes one line of output for WRITE"""
+        text = str(value)
+        print(text)
+        self.outputPosition += 1
+        self.outputBytes += (len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))) + 1
+
+    def checkpoint(self):
+        """Writes a snapshot if it was requested by a signal or enough instructions were executed"""
+        if self.checkpointEvery is not None:
+            if self.nextCheckpoint is None:
+                self.nextCheckpoint = self.executedInstructions + self.checkpointEvery
+            elif self.executedInstructions >= self.nextCheckpoint:
+                self.checkpointRequested = True
+                self.nextCheckpoint = self.executedInstructions + self.checkpointEvery
+
+        if self.checkpointRequested:
+            self.checkpointRequested = False
+            self.writeSnapshot(self.checkpointFile)
+
+    def requestCheckpoint(self, signum=None, frame=None):
+        """Signal handler, the snapshot is written at the next check of the limits"""
+        self.checkpointRequested = True
+
+    def snapshotState(self):
+        """Everything needed to continue the run in another process"""
+        return {"version": 1,
+                "source": self.sourceDigest(),
+                "instructionCounter": self.instructionCounter,
+                "globalFrame": self.globalFrame,
+                "frameStack": self.frameStack,
+                "tempFrame": self.tempFrame,
+                "varStack": self.varStack,
+                "callStack": self.callStack,
+                "variableCount": self.variableCount,
+                "executedInstructions": self.executedInstructions,
+                "inputPosition": self.inputPosition,
+                "outputPosition": self.outputPosition}
+
+    def sourceDigest(self):
+        """Digest of the program, a snapshot can only be restored with the same program"""
+        if self.sourceHash is None:
+            import hashlib
+            with open(self.sourceFile, "rb") as f:
+                self.sourceHash = hashlib.sha1(f.read()).hexdigest()
+        return self.sourceHash
+
+    def writeSnapshot(self, path):
+        """Writes the snapshot to path
+
+        Where fork is available the snapshot is pickled by a child process working on
+        a copy-on-write image of the interpreter, so the run only pays for the fork."""
+        import os
+        import pickle
+
+        sys.stdout.flush() #Output up to outputPosition has to be written before the snapshot
+        state = self.snapshotState()
+        self.waitForCheckpointWriter() #Only one writer at a time
+
+        if hasattr(os, "fork"):
+            pid = os.fork()
+            if pid != 0:
+                self.checkpointWriter = pid
+                return
+
+        status = 0
+        try:
+            tmp = "{0}.tmp{1}".format(path, os.getpid())
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path) #Never leave a half written snapshot behind
+        except OSError as e:
+            print("Cannot write snapshot {0}: {1}".format(path, e), file=sys.stderr)
+            status = 1
+
+        if hasattr(os, "fork"):
+            os._exit(status) #We are the forked writer
+
+    def waitForCheckpointWriter(self):
+        if self.checkpointWriter is not None:
+            import os
+            os.waitpid(self.checkpointWriter, 0)
+            self.checkpointWriter = None
+
+    def restoreSnapshot(self, path):
+        """Restores state saved by writeSnapshot, input lines already read are skipped"""
+        import pickle
+
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            self.raiseError(11, "Cannot read snapshot {0}: {1}, exiting...".format(path, e))
+
+        if state.get("version") != 1 or state.get("source") != self.sourceDigest():
+            self.raiseError(11, "Snapshot {0} does not belong to this program, exiting...".format(path))
+
+        self.instructionCounter = state["instructionCounter"]
+        self.globalFrame = state["globalFrame"]
+        self.frameStack = state["frameStack"]
+        self.tempFrame = state["tempFrame"]
+        self.varStack = state["varStack"]
+        self.callStack = state["callStack"]
+        self.variableCount = state["variableCount"]
+        self.frameCount = 1 + len(self.frameStack) + (self.tempFrame is not None)
+        self.executedInstructions = state["executedInstructions"]
+        self.outputPosition = state["outputPosition"]
+        self.refreshLocalFrame()
+        self.frameEpoch += 1
+
+        #The resumed run gets the same input, skip what was consumed before the snapshot
+        for i in range(state["inputPosition"]):
+            try:
+                self.readInput()
+            except EOFError:
+                break
+
+    def checkLimits(self):
+        """Ends the run if any of the limits was exceeded"""
+        if self.maxInstructions is not None and self.executedInstructions >= self.maxInstructions:
+            self.limitExceeded(60, "Instruction limit exceeded")
+        if self.timeout is not None and time.perf_counter() - self.startTime >= self.timeout:
+            self.limitExceeded(61, "Time limit exceeded")
+
+    def limitExceeded(self, errcode, message):
+        """Prints short report of the interpreter state to stderr and exits"""
+        sys.stdout.flush()
+        print("{0}, exiting...".format(message), file=sys.stderr)
+        print("executed instructions: at least {0}".format(self.executedInstructions), file=sys.stderr) #Counted at checks only
+        print("instruction counter: {0}".format(self.instructionCounter), file=sys.stderr)
+        print("elapsed time: {0:.3f} s".format(time.perf_counter() - self.startTime), file=sys.stderr)
+        print("variables: {0}".format(self.variableCount), file=sys.stderr)
+        print("frame stack depth: {0}".format(len(self.frameStack)), file=sys.stderr)
+        print("data stack depth: {0}".format(len(self.varStack)), file=sys.stderr)
+        print("call stack depth: {0}".format(len(self.callStack)), file=sys.stderr)
+        exit(errcode)
+
+    def internConstants(self):
+        """Decodes and checks the literals, equal constants share one Variable of the pool"""
+        for instruction in self.instruction_list:
+            for i, op in enumerate(instruction.ops_list):
+                op.loadLiteral(self.constants, shared=i > 0) #First operand is the written one
+
+    def buildBlocks(self):
+        """Splits the program into basic blocks for dispatchBlocks"""
+        import cfg
+        ends = cfg.BLOCK_END_OPCODES
+        if self.maxVariables is not None:
+            #DEFVAR exceeding the limit reports the instruction counter, which has to be its own order
+            ends = ends | {"DEFVAR"}
+        graph = cfg.ControlFlowGraph(self, self.program, ends)
+        self.blocks = dict()
+        for start, block in graph.blocks.items():
+            body = block.body()
+            entry = (len(body), block.end, tuple(instruction.execute for instruction in body),
+                     tuple(instruction.order for instruction in body))
+            #Jumps continue behind their label, the block is entered there as well
+            for instruction in block.instructions:
+                self.blocks[instruction.order] = entry
+                if instruction.opcode != "LABEL":
+                    break
+        self.stats["basic blocks"] = len(graph.blocks)
+
+    def disableInlineCaches(self):
+        """Makes every operand resolve its variable on each access, the reference behaviour"""
+        for instruction in self.instruction_list:
+            for op in instruction.ops_list:
+                op.toVar = op.resolveVar #Instance attribute shadows the cached toVar
+
+    def buildProgram(self):
+        """Indexes the instruction list by order"""
+        if self.image is not None:
+            self.program = LazyProgram(self.image, self, self.decodeCacheSize)
+            return self.program
+        if self.lazyRecords is not None:
+            self.program = LazyProgram(self.lazyRecords, self)
+            return self.program
+
+        self.program = dict()
+        for instruction in self.instruction_list:
+            if instruction.order not in self.program: #Same as getInsFromList, first one wins
+                self.program[instruction.order] = instruction
+        return self.program
+
+    def backwardJump(self, start, budget):
+        """Counts iterations of the loop starting at order start and runs its trace once it is hot
+
+        Neither the recording nor the trace executes more than budget instructions, so
+        the next check of the limits is not delayed. Returns number of executed instructions"""
+        trace = self.traces.get(start)
+        if trace is not None:
+            return self.runTrace(trace, budget)
+
+        if start in self.untraceable:
+            return 0
+
+        count = self.loopCounts.get(start, 0) + 1
+        self.loopCounts[start] = count
+        if count < self.traceThreshold:
+            return 0
+
+        import tracing
+
+        trace, executed = tracing.record(self, self.program, start, self.traceMaxLength, self.totalInstructions, budget)
+        if trace is None:
+            if executed < budget:
+                self.untraceable.add(start) #Do not try to record the loop again
+            return executed
+
+        self.traces[start] = trace
+        if self.instructionCounter == start:
+            return executed + self.runTrace(trace, budget - executed)
+        return executed
+
+    def runTrace(self, trace, budget):
+        """Runs whole iterations of trace fitting into budget instructions, returns number of executed instructions"""
+        iterations = min(self.traceSlice, budget // len(trace.entries))
+        if iterations == 0:
+            return 0 #The dispatch loop steps to the next check
+        return trace.run(self, iterations)
+
+    def specialize(self):
+        """Runs the type inference pass and records how many sites were specialized"""
+        import typeinfer
+
+        report = typeinfer.specialize(self)
+        specialized = sum(counts[0] for counts in report.values())
+        candidates = sum(counts[1] for counts in report.values())
+        self.stats["specialized sites"] = "{0} of {1}".format(specialized, candidates)
+        for opcode in sorted(report):
+            self.stats["specialized " + opcode] = "{0} of {1}".format(report[opcode][0], report[opcode][1])
+
+    def memoize(self):
+        """Runs the purity analysis and memoizes calls of the pure functions"""
+        import memo
+
+        functions = memo.memoize(self, self.memoSize)
+        memoized = [info for info in functions.values() if info.memoizable]
+        self.stats["memoized functions"] = "{0} of {1}".format(len(memoized), len(functions))
+        for entry, info in sorted(functions.items()):
+            if info.memoizable:
+                self.stats["memo " + info.label] = "pure, pops {0}, pushes {1}".format(info.pops, info.pushes)
+            else:
+                self.stats["memo " + info.label] = "not memoized, " + (info.reason or "effect not known")
+
+    def collectStats(self):
+        """Adds counters spread over the program to the statistics"""
+        misses = 0
+        #Instructions of an image only while they are in the decode cache, of a lazy program once decoded
+        lazy = isinstance(self.program, LazyProgram)
+        for instruction in self.program.values() if lazy else self.instruction_list:
+            for op in instruction.ops_list:
+                misses += op.ic_misses
+        self.stats["inline cache misses"] = misses
+        import pgo
+        for observer in self.observers:
+            if isinstance(observer, pgo.ProfileCollector):
+                #Hits are known only when executions are counted, every execution resolves each variable operand once
+                self.stats["inline cache hits"] = observer.variableAccesses(self.program) - misses
+        self.stats["interned constants"] = len(self.constants)
+        if lazy:
+            self.stats["decoded instructions"] = self.program.decoded
+        if self.memo is not None:
+            self.memo.collectStats(self.stats)
+
+        if self.tier == "trace":
+            self.stats["traces compiled"] = len(self.traces)
+            self.stats["loops not traceable"] = len(self.untraceable)
+            for start, trace in sorted(self.traces.items()):
+                rate = 100.0 * trace.guard_failures / trace.calls if trace.calls else 0.0
+                self.stats["trace " + trace.label] = "order {0}, {1} instructions, {2} entries, {3} iterations, {4} guard failures ({5:.1f}%)".format(
+                    start, len(trace.entries), trace.calls, trace.iterations, trace.guard_failures, rate)
+
+    def printStats(self):
+        """Prints collected statistics to stderr"""
+        self.collectStats()
+        for key, value in self.stats.items():
+            print("{0}: {1}".format(key, value), file=sys.stderr)
 
     def buildLabels(self):
         for instruction in self.instruction_list:
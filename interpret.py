@@ -1,22 +1,140 @@
 import os.path
-import argparse
+import sys
 import instruct as ins
 
-parser = argparse.ArgumentParser(description='Simple IPPcode18 interpreter')
-parser.add_argument('--source', help='File to interpret', required=True)
-args = vars(parser.parse_args())
+#Command line options, (flag, keyword arguments of ArgumentParser.add_argument)
+OPTIONS = [
+    ('--source', dict(help='File to interpret, XML or IPPcode18 source text, can be compressed (gzip, bzip2, xz); "-" reads it from stdin, READ then gets no input', required=True)),
+    ('--stats', dict(help='Print optimization statistics to stderr on exit', action='store_true')),
+    ('--no-specialize', dict(help='Disable specialization of instructions with proven operand types', action='store_true')),
+    ('--no-inline-cache', dict(help='Resolve variables on every access instead of caching them in operands', action='store_true')),
+    ('--lazy', dict(help='Decode instructions of an XML source when they are first executed, for large programs of which a run executes a small part; operands are checked when decoded and instructions are not specialized', action='store_true')),
+    ('--no-block-dispatch', dict(help='Dispatch every instruction on its own instead of whole basic blocks', action='store_true')),
+    ('--memoize', dict(help='Cache results of calls of functions proven pure, at most N calls (10000 if N is omitted); not used with program images and --lazy', nargs='?', const=10000, type=int, metavar='N')),
+    ('--tier', dict(help='Highest execution tier, "trace" compiles hot loops', choices=['base', 'trace'], default='trace')),
+    ('--trace-threshold', dict(help='Loop iterations before the loop gets traced', type=int, default=50)),
+    ('--max-instructions', dict(help='Stop with exit code 60 after executing N instructions', type=int, metavar='N')),
+    ('--timeout', dict(help='Stop with exit code 61 after running for SECONDS', type=float, metavar='SECONDS')),
+    ('--max-variables', dict(help='Stop with exit code 62 when more than N variables are defined', type=int, metavar='N')),
+    ('--checkpoint', dict(help='Write snapshots of the interpreter state to FILE on SIGUSR1', metavar='FILE')),
+    ('--checkpoint-every', dict(help='Also write a snapshot every N executed instructions', type=int, metavar='N')),
+    ('--resume', dict(help='Continue the run saved in snapshot FILE, the input is expected to be the same', metavar='FILE')),
+    ('--exec-trace', dict(help='Record every executed instruction to binary trace FILE, see tracetool.py', metavar='FILE')),
+    ('--break', dict(help='Print the state to stderr whenever the instruction of ORDER is reached, can be repeated', type=int, action='append', default=[], metavar='ORDER', dest='breakpoints')),
+    ('--watch', dict(help='Print changes of variable VAR, e.g. GF@x, to stderr, can be repeated', action='append', default=[], metavar='VAR')),
+    ('--steps', dict(help='Print every executed instruction to stderr', action='store_true')),
+    ('--profile-out', dict(help='Write execution counts and branch directions to FILE', metavar='FILE')),
+    ('--profile-in', dict(help='Compile hot loops recorded in profile FILE before the run starts', metavar='FILE')),
+    ('--memstats', dict(help='Write JSON report of memory usage to FILE on exit, stderr if FILE is omitted', nargs='?', const='-', metavar='FILE')),
+    ('--metrics', dict(help='Write runtime metrics to FILE every few seconds and on exit', metavar='FILE')),
+    ('--metrics-format', dict(help='"json" appends one JSON object per line, "prometheus" replaces FILE with the text exposition format', choices=['json', 'prometheus'], default='json')),
+    ('--metrics-interval', dict(help='Seconds between two writes of the metrics while running', type=float, default=10.0, metavar='SECONDS'))]
+
+def parseArguments(argv):
+    """Returns the options given by argv as a dictionary
+
+    The import of argparse and building the parser take a good part of the startup
+    of a short run, the common "--source FILE" alone is parsed without them."""
+    if len(argv) == 2 and argv[0] == "--source" and (argv[1] == "-" or not argv[1].startswith("-")):
+        args = dict()
+        for flag, options in OPTIONS:
+            dest = options.get("dest", flag.lstrip("-").replace("-", "_"))
+            default = options.get("default", False if options.get("action") == "store_true" else None)
+            args[dest] = list(default) if isinstance(default, list) else default
+        args["source"] = argv[1]
+        return args
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Simple IPPcode18 interpreter')
+    for flag, options in OPTIONS:
+        parser.add_argument(flag, **options)
+    return vars(parser.parse_args(argv))
+
+args = parseArguments(sys.argv[1:])
 
 #We got the filename
 file = args["source"]
 
-if os.path.isfile(file) is False:
+if file != "-" and os.path.isfile(file) is False:
     print("Specified file does not exist, exiting...")
     exit(11)
 
+if args["memstats"] is not None:
+    import tracemalloc
+    tracemalloc.start()
+
 #Create interpreter object
-inter = ins.Interpreter(file)
+inter = ins.Interpreter(file, lazy=args["lazy"])
+
+if args["memstats"] is not None:
+    loaderPeak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    inter.sampleStrings = True
+inter.specializeTypes = not args["no_specialize"]
+inter.inlineCaches = not args["no_inline_cache"]
+inter.blockDispatch = not args["no_block_dispatch"]
+inter.memoSize = args["memoize"]
+inter.tier = args["tier"]
+inter.traceThreshold = args["trace_threshold"]
+inter.maxInstructions = args["max_instructions"]
+inter.timeout = args["timeout"]
+inter.maxVariables = args["max_variables"]
+
+if args["checkpoint"] is not None:
+    inter.checkpointFile = args["checkpoint"]
+    inter.checkpointEvery = args["checkpoint_every"]
+    import signal
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, inter.requestCheckpoint)
+
+for order in args["breakpoints"]:
+    inter.addBreakpoint(order)
+for name in args["watch"]:
+    inter.addWatchpoint(name)
+if args["steps"]:
+    inter.addStepHook(inter.printStep)
+
+if args["exec_trace"] is not None:
+    import exectrace
+    inter.recordTrace(exectrace.TraceRecorder(args["exec_trace"]))
+
+if args["profile_out"] is not None:
+    import pgo
+    inter.addObserver(pgo.ProfileCollector(inter, args["profile_out"]))
+
+if args["profile_in"] is not None:
+    import pgo
+    inter.profile = pgo.loadProfile(args["profile_in"], inter)
+
+if args["metrics"] is not None:
+    import metrics
+    inter.metrics = metrics.MetricsExporter(inter, args["metrics"], args["metrics_format"], args["metrics_interval"])
+
+if args["resume"] is not None:
+    inter.restoreSnapshot(args["resume"])
+
+failure = None
+try:
+    inter.interpret()
+except BaseException as e:
+    failure = e
+    raise
+finally:
+    if inter.metrics is not None:
+        inter.metrics.write(metrics.exitCode(failure))
+
+    if args["stats"]:
+        inter.printStats()
 
-inter.interpret()
+    if args["memstats"] is not None:
+        import json
+        report = inter.memoryStats()
+        report["tracemalloc_peak_bytes"] = {"loader": loaderPeak, "execution": tracemalloc.get_traced_memory()[1]}
+        if args["memstats"] == "-":
+            print(json.dumps(report, sort_keys=True), file=sys.stderr)
+        else:
+            with open(args["memstats"], "w") as f:
+                json.dump(report, f, sort_keys=True, indent=2)
 
 
 
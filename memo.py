@@ -0,0 +1,347 @@
+#Memoization of pure subroutines
+#A static analysis finds the CALL targets whose effect depends only on values on
+#the data stack and in the temporary frame and which change nothing else: no
+#READ, WRITE, DPRINT or BREAK, no global variables and no access to the local
+#frame of the caller, on every path. Calls of such functions are looked up in a
+#bounded LRU cache keyed on those values, a hit replays the recorded effect,
+#the results pushed to the data stack and the resulting temporary frame,
+#instead of executing the call.
+#
+#Instructions of a replayed call are not executed, so they do not count against
+#Interpreter.maxInstructions, and peaks reached inside the call are not seen by
+#the memory accounting.
+
+import sys
+from collections import OrderedDict
+import cfg
+import instruct as ins
+
+#Instructions with effects outside of the data stack and the frames
+IMPURE_OPCODES = {"READ", "WRITE", "DPRINT", "BREAK"}
+
+class FunctionInfo:
+    """What the analysis found out about the function starting at label entry"""
+
+    def __init__(self, entry, label):
+        self.entry = entry #Order of the label
+        self.label = label
+        self.pure = True
+        self.reason = None #Why the function is not pure
+        self.complete = True #False while some path calls a function with unknown effect
+        self.pops = None #Values the function takes from the data stack
+        self.pushes = None #Values it leaves there in their place
+        self.usesEntryTF = False #The temporary frame of the caller is an input
+        self.returnTF = "entry" #Origin of the temporary frame after RETURN: "entry", "own" or None
+
+    @property
+    def memoizable(self):
+        return self.pure and self.complete and self.pops is not None
+
+    @property
+    def framed(self):
+        """The function depends on or replaces the temporary frame"""
+        return self.usesEntryTF or self.returnTF != "entry"
+
+    def summary(self):
+        return (self.pure, self.complete, self.pops, self.pushes, self.usesEntryTF, self.returnTF)
+
+    def reject(self, reason, instruction):
+        if self.pure:
+            self.pure = False
+            self.reason = "{0} at order {1}".format(reason, instruction.order)
+
+class PurityAnalysis:
+    """Finds the pure CALL targets of a program and their stack effects
+
+    Every program point of a function gets a state (stack height relative to
+    the entry, origins of the frames the function pushed, origin of TF), the
+    stack height and the number of pushed frames have to be the same on all
+    paths. Calls use the effect found for the callee,
+    recursive functions are iterated until the effects do not change."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.graph = cfg.ControlFlowGraph(interpreter)
+        self.functions = dict() #Label order -> FunctionInfo
+
+    def targets(self):
+        """Label orders of the CALL instructions of the program"""
+        targets = dict()
+        for block in self.graph.blocks.values():
+            terminator = block.terminator
+            if terminator.opcode == "CALL":
+                target = cfg.labelTarget(self.interpreter, terminator)
+                if target is not None:
+                    targets[target] = terminator.ops_list[0].value
+        return targets
+
+    def run(self):
+        targets = self.targets()
+        for rounds in range(len(targets) + 2):
+            changed = False
+            for entry, label in sorted(targets.items()):
+                info = self.analyze(entry, label)
+                previous = self.functions.get(entry)
+                if previous is None or previous.summary() != info.summary():
+                    changed = True
+                self.functions[entry] = info
+            if not changed:
+                return self.functions
+        #The effects did not settle, nothing is memoized
+        for info in self.functions.values():
+            info.complete = False
+        return self.functions
+
+    @staticmethod
+    def joinOrigin(first, second, info):
+        """Origin of a frame which comes from first on one path and from second on another"""
+        if first == second:
+            return first
+        if "entry" in (first, second):
+            info.usesEntryTF = True #It may still be the frame of the caller
+        return "own"
+
+    def join(self, first, second, info):
+        """State of a point reached with both states, None if they can not be merged"""
+        if first[0] != second[0] or len(first[1]) != len(second[1]):
+            return None
+        frames = tuple(self.joinOrigin(a, b, info) for a, b in zip(first[1], second[1]))
+        return (first[0], frames, self.joinOrigin(first[2], second[2], info))
+
+    def analyze(self, entry, label):
+        info = FunctionInfo(entry, label)
+        blocks = self.graph.blocks
+        states = {entry: (0, (), "entry")}
+        low = 0
+        returns = set()
+        worklist = [entry]
+        while worklist and info.pure:
+            block = blocks[worklist.pop()]
+            height, frames, tf = states[block.start]
+            successors = list() #Left empty when the path can not be followed
+            for instruction in block.instructions:
+                opcode = instruction.opcode
+                if opcode in IMPURE_OPCODES:
+                    info.reject(opcode, instruction)
+                for op in instruction.ops_list:
+                    if op.v_type != "var":
+                        continue
+                    frame = op.value.split("@")[0]
+                    if frame == "GF":
+                        info.reject("global variable", instruction)
+                    elif frame == "LF" and not frames:
+                        info.reject("local frame of the caller", instruction)
+                    elif frame == "TF" and tf == "entry":
+                        info.usesEntryTF = True
+
+                if opcode == "CREATEFRAME":
+                    tf = "own"
+                elif opcode == "PUSHFRAME":
+                    if tf == "entry":
+                        info.usesEntryTF = True
+                    frames = frames + (tf,)
+                    tf = None
+                elif opcode == "POPFRAME":
+                    if not frames:
+                        info.reject("POPFRAME of the caller's frame", instruction)
+                        break
+                    tf = frames[-1]
+                    frames = frames[:-1]
+                elif opcode == "PUSHS":
+                    height += 1
+                elif opcode == "POPS":
+                    height -= 1
+                    low = min(low, height)
+                elif opcode == "CALL":
+                    target = cfg.labelTarget(self.interpreter, instruction)
+                    callee = self.functions.get(target)
+                    if target is None or (callee is not None and not callee.pure):
+                        info.reject("call of impure function", instruction)
+                        break
+                    if callee is None or callee.pops is None:
+                        info.complete = False #Effect not known yet, the path is followed in a later round
+                        break
+                    low = min(low, height - callee.pops)
+                    height += callee.pushes - callee.pops
+                    if callee.usesEntryTF and tf == "entry":
+                        info.usesEntryTF = True
+                    if callee.returnTF != "entry":
+                        tf = callee.returnTF
+                elif opcode == "RETURN":
+                    if frames:
+                        info.reject("RETURN with pushed frames", instruction)
+                        break
+                    returns.add((height, tf))
+            else:
+                opcode = block.terminator.opcode
+                if opcode in cfg.JUMP_OPCODES:
+                    successors.append(cfg.labelTarget(self.interpreter, block.terminator))
+                if opcode not in {"JUMP", "RETURN"}:
+                    successors.append(block.end + 1) #CALL continues behind it once the callee returns
+
+            state = (height, frames, tf)
+            for successor in successors:
+                if successor not in blocks:
+                    continue #Undefined label or end of the program
+                if successor not in states:
+                    states[successor] = state
+                    worklist.append(successor)
+                elif states[successor] != state:
+                    joined = self.join(states[successor], state, info)
+                    if joined is None:
+                        info.reject("stack or frames differ between paths", blocks[successor].instructions[0])
+                    elif joined != states[successor]:
+                        states[successor] = joined
+                        worklist.append(successor)
+
+        heights = {height for height, tf in returns}
+        if len(heights) > 1:
+            info.reject("stack effect differs between returns", blocks[entry].instructions[0])
+        elif heights:
+            info.pops = -low
+            info.pushes = heights.pop() - low
+            origins = {tf for height, tf in returns}
+            if "entry" in origins:
+                info.usesEntryTF = info.usesEntryTF or len(origins) > 1
+            info.returnTF = origins.pop() if len(origins) == 1 else "own"
+        return info
+
+def sizeOf(value):
+    """Approximate bytes held by a cache key or entry"""
+    size = sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(sizeOf(item) for item in value)
+    elif isinstance(value, ins.Variable):
+        size += sizeOf(value.value)
+    return size
+
+class MemoCache:
+    """Bounded LRU cache of the effects of pure function calls"""
+
+    def __init__(self, interpreter, size):
+        self.interpreter = interpreter
+        self.size = size
+        self.entries = OrderedDict() #Key -> (pushed Variables, TF contents or None)
+        self.recording = list() #(key, call stack depth, stack base, function) of the calls in progress
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def frameContents(frame):
+        if frame is None:
+            return None
+        return tuple((var.name, var.var_type, var.value) for var in frame.content)
+
+    def call(self, function):
+        """Replays the call of function and returns True if its inputs were seen before"""
+        interpreter = self.interpreter
+        stack = interpreter.varStack
+        base = len(stack) - function.pops
+        if base < 0:
+            return False #The call fails, let it do so
+        key = (function.entry, tuple((var.var_type, var.value) for var in stack[base:]))
+        if function.usesEntryTF:
+            key += (self.frameContents(interpreter.tempFrame),)
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            self.recording.append((key, len(interpreter.callStack), base, function))
+            return False
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        outputs, frame = entry
+        del stack[base:]
+        stack.extend(outputs) #Values on the stack are never changed, POPS copies them
+        if len(stack) > interpreter.peakDataStack:
+            interpreter.peakDataStack = len(stack)
+        if function.framed:
+            self.replaceTempFrame(frame)
+        return True
+
+    def replaceTempFrame(self, contents):
+        interpreter = self.interpreter
+        if interpreter.tempFrame is not None:
+            interpreter.variableCount -= len(interpreter.tempFrame.content)
+            interpreter.frameCount -= 1
+        if contents is None:
+            interpreter.tempFrame = None
+        else:
+            frame = ins.Frame()
+            for name, var_type, value in contents:
+                frame.addVar(ins.Variable(name, value, var_type))
+            interpreter.tempFrame = frame
+            interpreter.variableCount += len(contents)
+            interpreter.frameCount += 1
+            interpreter.peakVariables = max(interpreter.peakVariables, interpreter.variableCount)
+            interpreter.peakFrames = max(interpreter.peakFrames, interpreter.frameCount)
+        interpreter.frameEpoch += 1
+
+    def returned(self):
+        """Stores the effect of the recorded call the RETURN just finished"""
+        interpreter = self.interpreter
+        if not self.recording or self.recording[-1][1] != len(interpreter.callStack):
+            return
+        key, depth, base, function = self.recording.pop()
+        outputs = tuple(interpreter.varStack[base:])
+        frame = self.frameContents(interpreter.tempFrame) if function.framed else None
+        self.entries[key] = (outputs, frame)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def collectStats(self, stats):
+        calls = self.hits + self.misses
+        stats["memo hits"] = self.hits
+        stats["memo misses"] = self.misses
+        stats["memo hit rate"] = "{0:.1f}%".format(100.0 * self.hits / calls if calls else 0.0)
+        stats["memo entries"] = "{0} of {1}".format(len(self.entries), self.size)
+        stats["memo evictions"] = self.evictions
+        stats["memo bytes"] = sys.getsizeof(self.entries) + sum(sizeOf(key) + sizeOf(entry) for key, entry in self.entries.items())
+
+class Ins_CALL_Memo(ins.Ins_CALL):
+    """CALL of a pure function, looked up in the memo cache first"""
+
+    def __init__(self, order, function):
+        super(Ins_CALL_Memo, self).__init__(order)
+        self.function = function
+
+    def execute(self):
+        if self.interpreter.memo.call(self.function):
+            return
+        super(Ins_CALL_Memo, self).execute()
+
+class Ins_RETURN_Memo(ins.Ins_RETURN):
+    """RETURN which completes the recording of a memoized call"""
+
+    def __init__(self, order):
+        super(Ins_RETURN_Memo, self).__init__(order)
+
+    def execute(self):
+        super(Ins_RETURN_Memo, self).execute()
+        self.interpreter.memo.returned()
+
+def memoize(interpreter, size):
+    """Replaces calls of pure functions by memoized ones, labels have to be built
+
+    Returns dictionary with the FunctionInfo of every CALL target"""
+    functions = PurityAnalysis(interpreter).run()
+    if not any(info.memoizable for info in functions.values()):
+        return functions
+
+    interpreter.memo = MemoCache(interpreter, size)
+    for i, instruction in enumerate(interpreter.instruction_list):
+        if instruction.opcode == "CALL":
+            info = functions.get(cfg.labelTarget(interpreter, instruction))
+            if info is None or not info.memoizable:
+                continue
+            variant = Ins_CALL_Memo(instruction.order, info)
+        elif instruction.opcode == "RETURN":
+            variant = Ins_RETURN_Memo(instruction.order)
+        else:
+            continue
+        variant.ops_list = instruction.ops_list
+        interpreter.instruction_list[i] = variant
+    return functions
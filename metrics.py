@@ -0,0 +1,127 @@
+#Metrics export
+#Writes runtime metrics of a run to a file, as JSON lines (one object appended per
+#write) or in the Prometheus text exposition format (the file is replaced on every
+#write, e.g. for the textfile collector of node_exporter). Metrics are written
+#every few seconds while the program runs and once more when it exits.
+#
+#Everything is read from counters the interpreter keeps anyway, the exporter only
+#runs at the periodic checks of the limits. The opcode histogram is sampled there:
+#every check records the opcode of the instruction at the counter. The check
+#interval is set to a prime so the samples do not keep hitting the same
+#instruction of a loop. Traced loops are checked when a trace returns, their
+#samples land on the instructions behind the loop.
+
+import json
+import os
+import time
+
+SAMPLE_INTERVAL = 4093 #Instructions between two samples, prime
+FORMATS = ("json", "prometheus")
+
+#Prometheus name, type and help of every exported value, see MetricsExporter.collect
+METRICS = [("load_seconds", "gauge", "Time spent loading the program"),
+           ("prepare_seconds", "gauge", "Time spent in the load time passes"),
+           ("run_seconds", "gauge", "Time since the program started running"),
+           ("executed_instructions", "counter", "Executed instructions"),
+           ("instructions_per_second", "gauge", "Executed instructions per second of running"),
+           ("peak_frame_depth", "gauge", "Most frames on the frame stack"),
+           ("peak_data_stack_depth", "gauge", "Most values on the data stack"),
+           ("peak_call_stack_depth", "gauge", "Most return addresses on the call stack"),
+           ("peak_variables", "gauge", "Most variables defined at once"),
+           ("output_bytes", "counter", "Bytes written by WRITE"),
+           ("output_lines", "counter", "Lines written by WRITE"),
+           ("finished", "gauge", "1 once the run ended"),
+           ("exit_code", "gauge", "Exit code of the finished run")]
+
+class MetricsExporter:
+    """Writes metrics of interpreter to path, see Interpreter.metrics"""
+
+    def __init__(self, interpreter, path, format="json", interval=10.0):
+        if format not in FORMATS:
+            raise ValueError("Unknown metrics format {0}".format(format))
+        self.interpreter = interpreter
+        self.path = path
+        self.format = format
+        self.interval = interval #Seconds between two writes while running, None writes on exit only
+        self.nextWrite = None
+        self.opcodes = dict() #Opcode -> samples
+        interpreter.checkInterval = SAMPLE_INTERVAL
+
+    def periodic(self):
+        """Called at every check of the limits"""
+        interpreter = self.interpreter
+        instruction = interpreter.program.get(interpreter.instructionCounter)
+        if instruction is not None and instruction.opcode != "LABEL":
+            self.opcodes[instruction.opcode] = self.opcodes.get(instruction.opcode, 0) + 1
+
+        if self.interval is not None:
+            now = time.perf_counter()
+            if self.nextWrite is None:
+                self.nextWrite = interpreter.startTime + self.interval
+            if now >= self.nextWrite:
+                self.nextWrite = now + self.interval
+                self.write()
+
+    def collect(self, exit_code=None):
+        """Returns the metrics as a dictionary, exit_code is given once the run ended"""
+        interpreter = self.interpreter
+        running = time.perf_counter() - interpreter.startTime if interpreter.startTime is not None else 0.0
+        values = {"load_seconds": interpreter.loadTime,
+                  "prepare_seconds": interpreter.prepareTime,
+                  "run_seconds": running,
+                  "executed_instructions": interpreter.executedInstructions, #Updated at the checks only while running
+                  "instructions_per_second": interpreter.executedInstructions / running if running > 0 else 0.0,
+                  "peak_frame_depth": interpreter.peakFrameDepth,
+                  "peak_data_stack_depth": interpreter.peakDataStack,
+                  "peak_call_stack_depth": interpreter.peakCallStack,
+                  "peak_variables": interpreter.peakVariables,
+                  "output_bytes": interpreter.outputBytes,
+                  "output_lines": interpreter.outputPosition,
+                  "finished": 0 if exit_code is None else 1}
+        if exit_code is not None:
+            values["exit_code"] = exit_code
+        return values
+
+    def write(self, exit_code=None):
+        values = self.collect(exit_code)
+        if self.format == "json":
+            record = dict(values)
+            record["time"] = time.time()
+            record["source"] = self.interpreter.sourceFile
+            record["opcode_samples"] = self.opcodes
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+        else:
+            #Written next to the file and renamed, a scrape never sees half of it
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as f:
+                f.write(self.prometheus(values))
+            os.replace(temporary, self.path)
+
+    def prometheus(self, values):
+        """Text exposition of values and the opcode samples"""
+        source = str(self.interpreter.sourceFile).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        labels = "source=\"{0}\"".format(source)
+        lines = list()
+        for name, kind, description in METRICS:
+            if name not in values:
+                continue
+            metric = "ipp_" + name + ("_total" if kind == "counter" else "")
+            lines.append("# HELP {0} {1}".format(metric, description))
+            lines.append("# TYPE {0} {1}".format(metric, kind))
+            lines.append("{0}{{{1}}} {2}".format(metric, labels, values[name]))
+        lines.append("# HELP ipp_opcode_samples_total Samples of the executed opcodes, one every {0} instructions".format(SAMPLE_INTERVAL))
+        lines.append("# TYPE ipp_opcode_samples_total counter")
+        for opcode, samples in sorted(self.opcodes.items()):
+            lines.append("ipp_opcode_samples_total{{{0},opcode=\"{1}\"}} {2}".format(labels, opcode, samples))
+        return "\n".join(lines) + "\n"
+
+def exitCode(exception):
+    """Exit code of the process ending with exception, which is None for a normal end"""
+    if exception is None:
+        return 0
+    if isinstance(exception, SystemExit):
+        if exception.code is None:
+            return 0
+        return exception.code if isinstance(exception.code, int) else 1
+    return 1 #Traceback
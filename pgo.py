@@ -0,0 +1,148 @@
+#Profile-guided optimization
+#A profiling run (interpret.py --profile-out) records how many times every
+#instruction was executed, which way every conditional jump went and the types
+#compared by it. A later run of the same program (--profile-in) lays out the
+#hot path of every hot loop as a trace, following the more frequent direction
+#of every branch and leaving the other one through a guard, and compiles the
+#traces before the program starts instead of warming them up.
+
+import json
+import cfg
+import tracing
+
+PROFILE_VERSION = 1
+
+#Opcodes whose operand types are recorded
+TYPED_OPCODES = tracing.CONDITIONAL_JUMPS | set(tracing.COMPARISONS)
+
+class ProfileCollector:
+    """Observer counting executions and branch directions, see Interpreter.addObserver"""
+
+    def __init__(self, interpreter, path):
+        self.interpreter = interpreter
+        self.path = path
+        self.counts = dict()
+        self.branches = dict() #order -> [taken, not taken]
+        self.types = dict() #order -> compared type, None if more types were seen
+
+    def step(self, instruction, counter):
+        order = instruction.order
+        self.counts[order] = self.counts.get(order, 0) + 1
+
+        opcode = instruction.opcode
+        if opcode in TYPED_OPCODES:
+            compared = instruction.ops_list[1].toVar().var_type
+            if self.types.setdefault(order, compared) != compared:
+                self.types[order] = None
+            if opcode in tracing.CONDITIONAL_JUMPS:
+                branch = self.branches.setdefault(order, [0, 0])
+                branch[0 if counter != order + 1 else 1] += 1
+
+    def variableAccesses(self, program):
+        """Returns how many times variable operands of the counted instructions were resolved"""
+        accesses = 0
+        for order, count in self.counts.items():
+            accesses += count * sum(1 for op in program[order].ops_list if op.v_type == "var")
+        return accesses
+
+    def finish(self):
+        profile = {"version": PROFILE_VERSION,
+                   "source": self.interpreter.sourceDigest(),
+                   "counts": self.counts,
+                   "branches": self.branches,
+                   "types": self.types}
+        with open(self.path, "w") as f:
+            json.dump(profile, f, sort_keys=True)
+
+def loadProfile(path, interpreter):
+    """Returns profile stored in path, keys are converted back to instruction orders"""
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        interpreter.raiseError(11, "Cannot read profile {0}: {1}, exiting...".format(path, e))
+
+    if profile.get("version") != PROFILE_VERSION or profile.get("source") != interpreter.sourceDigest():
+        interpreter.raiseError(11, "Profile {0} does not belong to this program, exiting...".format(path))
+
+    for key in ("counts", "branches", "types"):
+        profile[key] = {int(order): value for order, value in profile[key].items()}
+    return profile
+
+def hotLoops(interpreter, program, profile, threshold):
+    """Returns {start: back edge count} of loops iterated at least threshold times"""
+    loops = dict()
+    for order, count in profile["counts"].items():
+        instruction = program.get(order)
+        if instruction is None or instruction.opcode not in {"JUMP"} | tracing.CONDITIONAL_JUMPS:
+            continue
+        target = cfg.labelTarget(interpreter, instruction)
+        if target is None or target >= order:
+            continue #Not a backward jump
+
+        if instruction.opcode != "JUMP":
+            count = profile["branches"].get(order, [0, 0])[0]
+        start = target + 1
+        loops[start] = loops.get(start, 0) + count
+    return {start: count for start, count in loops.items() if count >= threshold}
+
+def hotPath(interpreter, program, profile, start, max_length):
+    """Follows the hot direction of every branch from start back to start
+
+    Returns list of TraceEntries or None if the path leaves the loop or goes through code
+    the profile never saw executed."""
+    counts = profile["counts"]
+    entries = list()
+    order = start
+
+    while len(entries) < max_length:
+        instruction = program.get(order)
+        if instruction is None:
+            return None
+        if instruction.opcode == "LABEL":
+            order += 1
+            continue
+        if not counts.get(order) or instruction.opcode in tracing.UNTRACEABLE:
+            return None
+
+        operand_type = None
+        taken = False
+        if instruction.opcode in TYPED_OPCODES:
+            operand_type = profile["types"].get(order)
+            if operand_type is None:
+                return None #Compared values of more types, nothing to guard on
+        if instruction.opcode in tracing.CONDITIONAL_JUMPS:
+            branch = profile["branches"].get(order, [0, 0])
+            taken = branch[0] > branch[1]
+        elif instruction.opcode == "JUMP":
+            taken = True
+
+        entries.append(tracing.TraceEntry(instruction, taken, operand_type))
+
+        if taken:
+            target = cfg.labelTarget(interpreter, instruction)
+            if target is None:
+                return None
+            order = target + 1
+            if order == start:
+                return entries
+        else:
+            order += 1
+
+    return None
+
+def compileHotLoops(interpreter, program, profile):
+    """Compiles traces of all hot loops of the profile, returns number of compiled traces"""
+    loops = hotLoops(interpreter, program, profile, interpreter.traceThreshold)
+    compiled = 0
+    #Hottest loops first
+    for start in sorted(loops, key=lambda s: -loops[s]):
+        if start in interpreter.traces:
+            continue
+        entries = hotPath(interpreter, program, profile, start, interpreter.traceMaxLength)
+        if entries is None:
+            continue
+        label = program[start - 1].ops_list[0].value
+        interpreter.traces[start] = tracing.TraceCompiler(tracing.Trace(start, label, entries), interpreter.execTrace).compile()
+        compiled += 1
+    return compiled
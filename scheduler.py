@@ -0,0 +1,259 @@
+#Cooperative scheduler
+#Runs many interpreter instances in one process. Every job gets time slices of
+#about Scheduler.slice instructions in round robin order, a job whose READ waits
+#for input is parked until Job.feed or Job.closeInput wakes it up. Output of
+#every job (WRITE, DPRINT, error messages) goes to its own buffers.
+#Job.runAsync runs a job as an asyncio task instead, with async input and output
+#streams.
+
+import argparse
+import collections
+import io
+import os
+import sys
+import time
+import traceback
+import instruct
+
+class Job:
+    """Single program run by the Scheduler"""
+
+    def __init__(self, source, stdin=None, name=None, options=None):
+        self.source = source
+        self.name = source if name is None else name
+        self.options = options or dict() #Interpreter attributes set before the run, e.g. {"tier": "base"}
+        self.interpreter = None #Created by the first time slice, so load errors end up in the buffers
+
+        self.stdout = io.StringIO()
+        self.stderr = io.StringIO()
+        self.returncode = None #Exit code once the job finished
+        self.executed = 0 #Executed instructions, known once the job finished
+
+        self.scheduler = None
+        self.parked = False
+        self.inputLines = collections.deque()
+        self.inputClosed = False
+        self.partialLine = ""
+
+        if stdin is not None:
+            self.feed(stdin)
+            self.closeInput()
+
+    def feed(self, text):
+        """Queues input text, an unterminated last line waits for the rest of it"""
+        lines = (self.partialLine + text).split("\n")
+        self.partialLine = lines.pop()
+        self.inputLines.extend(lines)
+        if lines and self.scheduler is not None:
+            self.scheduler.wake(self)
+
+    def closeInput(self):
+        """No more input, READ behind the end of the input fails as on end of stdin"""
+        if self.partialLine:
+            self.inputLines.append(self.partialLine)
+            self.partialLine = ""
+        self.inputClosed = True
+        if self.interpreter is not None:
+            self.interpreter.inputClosed = True
+        if self.scheduler is not None:
+            self.scheduler.wake(self)
+
+    def start(self):
+        self.interpreter = instruct.Interpreter(self.source)
+        for key, value in self.options.items():
+            setattr(self.interpreter, key, value)
+        self.interpreter.inputLines = self.inputLines
+        self.interpreter.inputClosed = self.inputClosed
+        self.interpreter.prepare()
+
+    def step(self, instructions):
+        """Runs one time slice, returns True if the job can continue right away"""
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        try:
+            if self.interpreter is None:
+                self.start()
+            else:
+                self.interpreter.activate()
+            if self.interpreter.run(instructions):
+                self.end(0)
+                return False
+            return True
+        except instruct.InputPending:
+            return False
+        except SystemExit as e:
+            #exit() of the interpreter, same exit codes as a separate process
+            if e.code is None or isinstance(e.code, int):
+                self.end(e.code or 0)
+            else:
+                print(e.code, file=sys.stderr)
+                self.end(1)
+            return False
+        except Exception:
+            traceback.print_exc()
+            self.end(1)
+            return False
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    async def runAsync(self, reader=None, writer=None, errors=None, instructions=1000):
+        """Runs the job on the asyncio event loop, returns its exit code
+
+        READ waits for reader.readline() (e.g. asyncio.StreamReader), no reader means
+        empty input. Output is passed to writer.write and errors.write (bytes) after
+        every time slice, their drain() is awaited if they have one. Without a writer
+        the output stays in the buffers. The loop gets control back after every slice
+        of about instructions instructions and while READ waits for a line."""
+        import asyncio
+
+        if reader is None and not self.inputClosed:
+            self.closeInput()
+
+        while True:
+            running = self.step(instructions)
+            await self.flushAsync(self.stdout, writer)
+            await self.flushAsync(self.stderr, errors)
+
+            if self.returncode is not None:
+                return self.returncode
+            if running:
+                await asyncio.sleep(0) #Let other tasks run
+            elif not self.inputLines and not self.inputClosed:
+                line = await reader.readline()
+                if not line:
+                    self.closeInput()
+                else:
+                    self.feed(line.decode("utf-8") if isinstance(line, bytes) else line)
+
+    async def flushAsync(self, buf, stream):
+        if stream is None or not buf.tell():
+            return
+        stream.write(buf.getvalue().encode("utf-8"))
+        buf.seek(0)
+        buf.truncate()
+        if hasattr(stream, "drain"):
+            await stream.drain()
+
+    def end(self, returncode):
+        self.returncode = returncode
+        if self.interpreter is not None:
+            self.executed = self.interpreter.executedInstructions
+            try:
+                self.interpreter.finish()
+            except Exception:
+                traceback.print_exc()
+            self.interpreter = None #Drop the program and its frames, the job may be kept for its output
+
+class Scheduler:
+    """Round robin scheduler of Jobs"""
+
+    def __init__(self, slice=1000):
+        self.slice = slice #Instructions per time slice
+        self.ready = collections.deque()
+        self.parked = set()
+        self.finished = list()
+
+    def submit(self, job):
+        job.scheduler = self
+        self.ready.append(job)
+        return job
+
+    def wake(self, job):
+        """Moves parked job back to the ready queue"""
+        if job.parked:
+            job.parked = False
+            self.parked.discard(job)
+            self.ready.append(job)
+
+    def step(self):
+        """Runs one time slice of the next ready job, returns False if no job is ready"""
+        if not self.ready:
+            return False
+        job = self.ready.popleft()
+        if job.step(self.slice):
+            self.ready.append(job)
+        elif job.returncode is not None:
+            self.finished.append(job)
+        else:
+            job.parked = True
+            self.parked.add(job)
+            #Input could have been queued while the slice was running
+            if job.inputLines or job.inputClosed:
+                self.wake(job)
+        return True
+
+    def run(self):
+        """Runs until no job is ready, parked jobs are left waiting for their input"""
+        while self.step():
+            pass
+        return self.finished
+
+def runAsync(jobs, instructions):
+    """Runs (Job, input text) pairs as tasks of one asyncio event loop
+
+    The input of every job is fed line by line through an asyncio.StreamReader,
+    so READ waits for it. Returns the jobs once all of them finished."""
+    import asyncio
+
+    async def feed(reader, text):
+        for line in text.splitlines(keepends=True):
+            reader.feed_data(line.encode("utf-8"))
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    async def runAll():
+        tasks = list()
+        for job, text in jobs:
+            reader = asyncio.StreamReader()
+            tasks.append(job.runAsync(reader, instructions=instructions))
+            tasks.append(feed(reader, text))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(runAll())
+    return [job for job, text in jobs]
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs many IPPcode18 programs in one process')
+    parser.add_argument('programs', help='Programs to run, PROGRAM.in is used as input if it exists', nargs='+')
+    parser.add_argument('--slice', help='Instructions per time slice', type=int, default=1000)
+    parser.add_argument('--tier', help='Highest execution tier, see interpret.py', choices=['base', 'trace'], default='trace')
+    parser.add_argument('--out', help='Directory for outputs of the jobs, N.out, N.err and N.code for the N-th program')
+    parser.add_argument('--async', dest='asynchronous', help='Run the jobs as tasks of an asyncio event loop, input is streamed to them', action='store_true')
+    args = parser.parse_args()
+
+    scheduler = Scheduler(args.slice)
+    jobs = list()
+    for i, path in enumerate(args.programs):
+        if not os.path.isfile(path):
+            print("Specified file {0} does not exist, exiting...".format(path))
+            exit(11)
+        stdin = ""
+        if os.path.exists(os.path.splitext(path)[0] + ".in"):
+            with open(os.path.splitext(path)[0] + ".in", encoding="utf-8") as f:
+                stdin = f.read()
+        if args.asynchronous:
+            jobs.append((Job(path, name=str(i), options={"tier": args.tier}), stdin))
+        else:
+            scheduler.submit(Job(path, stdin, name=str(i), options={"tier": args.tier}))
+
+    start = time.perf_counter()
+    finished = runAsync(jobs, args.slice) if args.asynchronous else scheduler.run()
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for job in finished:
+        failed += job.returncode != 0
+        if args.out is not None:
+            base = os.path.join(args.out, job.name)
+            with open(base + ".out", "w", encoding="utf-8") as f:
+                f.write(job.stdout.getvalue())
+            with open(base + ".err", "w", encoding="utf-8") as f:
+                f.write(job.stderr.getvalue())
+            with open(base + ".code", "w") as f:
+                f.write("{0}\n".format(job.returncode))
+
+    print("{0} jobs in {1:.3f} s, {2:.1f} jobs/s, {3} failed".format(
+        len(finished), elapsed, len(finished) / elapsed if elapsed else 0.0, failed), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
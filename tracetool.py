@@ -0,0 +1,110 @@
+import argparse
+import sys
+import exectrace
+import instruct
+
+def loadOpcodes(source):
+    """Maps instruction orders of the source program to opcodes
+
+    The program is loaded the way interpret.py loads it, so any source format
+    it takes works (XML, IPPcode18 text, compressed or a program image)."""
+    opcodes = dict()
+    if source is None:
+        return opcodes
+    interpreter = instruct.Interpreter(source)
+    if interpreter.image is not None:
+        program = interpreter.buildProgram()
+        for order in interpreter.image.orders:
+            opcodes[order] = program[order].opcode
+        return opcodes
+    for instruction in interpreter.instruction_list:
+        opcodes.setdefault(instruction.order, instruction.opcode) #First one wins, as in Interpreter.buildProgram
+    return opcodes
+
+def formatRecord(index, record, opcodes):
+    return "{0:>10} {1:>6} {2:<10} {3}".format(index, record.order, opcodes.get(record.order, ""), record.describe())
+
+def replay(args):
+    opcodes = loadOpcodes(args.source)
+    for i, record in enumerate(exectrace.readTrace(args.trace)):
+        if args.limit is not None and i >= args.limit:
+            break
+        print(formatRecord(i, record, opcodes))
+
+def summary(args):
+    opcodes = loadOpcodes(args.source)
+    counts = dict()
+    branches = dict() #order -> [taken, not taken]
+    writes = 0
+    total = 0
+    for record in exectrace.readTrace(args.trace):
+        total += 1
+        counts[record.order] = counts.get(record.order, 0) + 1
+        if record.tag == exectrace.TAG_TAKEN:
+            branches.setdefault(record.order, [0, 0])[0] += 1
+        elif record.tag == exectrace.TAG_NOT_TAKEN:
+            branches.setdefault(record.order, [0, 0])[1] += 1
+        elif record.tag != exectrace.TAG_NONE:
+            writes += 1
+
+    print("executed instructions: {0}".format(total))
+    print("distinct instructions: {0}".format(len(counts)))
+    print("values written: {0}".format(writes))
+
+    print("hottest instructions:")
+    for order, count in sorted(counts.items(), key=lambda item: -item[1])[:args.top]:
+        print("{0:>6} {1:<10} {2:>10} ({3:.1f}%)".format(order, opcodes.get(order, ""), count, 100.0 * count / total))
+
+    if branches:
+        print("branches:")
+        for order, (taken, not_taken) in sorted(branches.items()):
+            print("{0:>6} {1:<10} taken {2}, not taken {3}".format(order, opcodes.get(order, ""), taken, not_taken))
+
+def diff(args):
+    """Prints the first record where the traces diverge, exits with 1 if they differ"""
+    opcodes = loadOpcodes(args.source)
+    first = exectrace.readTrace(args.trace)
+    second = exectrace.readTrace(args.other)
+    history = list()
+    index = 0
+
+    while True:
+        a = next(first, None)
+        b = next(second, None)
+        if a is None and b is None:
+            print("traces are identical ({0} records)".format(index))
+            return 0
+        if a is None or b is None or a.key() != b.key():
+            break
+        history = (history + [a])[-args.context:]
+        index += 1
+
+    print("traces diverge at record {0}".format(index))
+    for i, record in enumerate(history):
+        print("  " + formatRecord(index - len(history) + i, record, opcodes))
+    print("< " + (formatRecord(index, a, opcodes) if a is not None else "end of trace"))
+    print("> " + (formatRecord(index, b, opcodes) if b is not None else "end of trace"))
+    return 1
+
+parser = argparse.ArgumentParser(description='Reader of IPPcode18 execution traces written by interpret.py --exec-trace')
+parser.add_argument('--source', help='Program the trace was recorded from, used to show opcodes')
+commands = parser.add_subparsers(dest='command', required=True)
+
+p = commands.add_parser('replay', help='Print the executed instructions in order')
+p.add_argument('trace')
+p.add_argument('--limit', help='Print at most N records', type=int, metavar='N')
+p.set_defaults(func=replay)
+
+p = commands.add_parser('summary', help='Print instruction and branch statistics')
+p.add_argument('trace')
+p.add_argument('--top', help='Number of hottest instructions to print', type=int, default=10)
+p.set_defaults(func=summary)
+
+p = commands.add_parser('diff', help='Find the first record where two traces diverge')
+p.add_argument('trace')
+p.add_argument('other')
+p.add_argument('--context', help='Number of common records printed before the difference', type=int, default=5)
+p.set_defaults(func=diff)
+
+args = parser.parse_args()
+sys.exit(args.func(args) or 0)
@@ -0,0 +1,285 @@
+#Tracing compilation tier
+#Hot loops are recorded while the dispatch loop executes them and the recorded
+#straight-line path is compiled into a Python function. Every instruction of the
+#compiled trace is guarded, when a guard fails the trace returns and the dispatch
+#loop continues with the guarded instruction. A run writing the execution trace
+#compiles traces recording their iterations, see exectrace.py.
+
+#Instructions leaving the loop body in a way a trace cannot follow
+UNTRACEABLE = {"CALL", "RETURN"}
+
+CONDITIONAL_JUMPS = {"JUMPIFEQ", "JUMPIFNEQ"}
+
+#Inline templates of int arithmetic, {0} and {1} are the source operand values
+ARITHMETIC = {"ADD": "{0} + {1}", "SUB": "{0} - {1}", "MUL": "{0} * {1}", "IDIV": "{0} // {1}"}
+
+#Inline templates of comparisons, the result is stored as a "true"/"false" string
+COMPARISONS = {"LT": "<", "GT": ">", "EQ": "=="}
+
+class TraceEntry:
+    """Single executed instruction of a recorded trace"""
+
+    def __init__(self, instruction, taken, operand_type):
+        self.instruction = instruction
+        self.taken = taken #Branch direction of conditional jumps
+        self.operand_type = operand_type #Observed type of compared operands
+
+class Trace:
+    """Compiled trace of a loop starting at instruction order start"""
+
+    def __init__(self, start, label, entries):
+        self.start = start
+        self.label = label
+        self.entries = entries
+        self.function = None
+        self.source = None
+
+        self.calls = 0
+        self.iterations = 0
+        self.guard_failures = 0
+
+    def run(self, interpreter, limit):
+        """Executes at most limit iterations, returns number of executed instructions"""
+        self.calls += 1
+        iterations, exit_index = self.function(interpreter, limit)
+        self.iterations += iterations
+        if exit_index < 0:
+            return iterations * len(self.entries)
+        self.guard_failures += 1
+        return iterations * len(self.entries) + exit_index
+
+class TraceCompiler:
+    """Generates source of the trace function, with recorder (exectrace.TraceRecorder)
+    given the function records its iterations and the values it writes"""
+
+    def __init__(self, trace, recorder=None):
+        self.trace = trace
+        self.recorder = recorder
+        self.namespace = dict()
+        self.lines = list()
+        self.shift = 0 #Indentation added to the emitted lines
+        self.items = list() #Path items of the emitted entries, see exectrace.item
+
+    def emit(self, line, indent=2):
+        self.lines.append("    " * (indent + self.shift) + line)
+
+    def bind(self, name, value):
+        self.namespace[name] = value
+        return name
+
+    def operand(self, k, i, op):
+        """Emits resolution of operand, returns (variable expression or None, value expression, type)"""
+        if op.v_type == "var":
+            var = "v{0}_{1}".format(k, i)
+            self.emit("{0} = {1}.toVar()".format(var, self.bind("o{0}_{1}".format(k, i), op)))
+            return var, var + ".value", None
+        #Literal values were decoded and checked at load
+        return None, self.bind("c{0}_{1}".format(k, i), op.value), op.v_type
+
+    def recordPrefix(self, k, indent):
+        """Emits recording of the entries before entry k, executed by the left iteration"""
+        if self.recorder is not None and k > 0:
+            self.emit("events_append({0})".format(self.recorder.path(self.items[:k])), indent)
+
+    def guardExit(self, k, order, condition):
+        self.emit("if {0}:".format(condition))
+        self.emit("interpreter.instructionCounter = {0}".format(order), 3)
+        self.recordPrefix(k, 3)
+        self.emit("return n, {0}".format(k), 3)
+
+    def typeGuard(self, k, order, operands, expected):
+        """Guards that all variable operands hold a value of type expected"""
+        checks = list()
+        for var, value, v_type in operands:
+            if var is None:
+                if v_type != expected:
+                    return False #Literal of another type, the trace would always exit here
+            else:
+                checks.append("{0}.var_type != {1!r}".format(var, expected))
+        if checks:
+            self.guardExit(k, order, " or ".join(checks))
+        return True
+
+    def emitGeneric(self, k, instruction):
+        self.emit("interpreter.instructionCounter = {0}".format(instruction.order))
+        self.emit("{0}.execute()".format(self.bind("i{0}".format(k), instruction)))
+
+    def recordEntry(self, k, entry, written):
+        """Emits recording of the value written by entry k, written is its type if the
+        inline code stored it in v{k}_0, adds the path item of the entry"""
+        if self.recorder is None:
+            return
+        import exectrace
+
+        instruction = entry.instruction
+        self.items.append(exectrace.item(instruction, entry.taken, written))
+        if instruction.opcode not in exectrace.WRITING_OPCODES:
+            return
+        if written is not None:
+            self.emit("values_append(v{0}_0.value)".format(k))
+            return
+        self.emit("w = {0}.toVar()".format(self.bind("r{0}".format(k), instruction.ops_list[0])))
+        self.emit("values_append(w.var_type)")
+        self.emit("values_append(w.value)")
+
+    def emitEntry(self, k, entry):
+        """Emits code of entry k, returns type of the written value if the code is inline"""
+        instruction = entry.instruction
+        opcode = instruction.opcode
+        order = instruction.order
+        ops = instruction.ops_list
+
+        #Literals without value follow special rules, leave them to the generic execute
+        if any(op.v_type != "var" and op.value is None for op in ops):
+            self.emitGeneric(k, instruction)
+            return
+
+        if opcode == "JUMP":
+            return
+
+        if opcode in ARITHMETIC and len(ops) == 3:
+            dest = self.operand(k, 0, ops[0])[0]
+            a = self.operand(k, 1, ops[1])
+            b = self.operand(k, 2, ops[2])
+            if not self.typeGuard(k, order, [a, b], "int"):
+                self.guardExit(k, order, "True")
+                return
+            if opcode == "IDIV":
+                self.guardExit(k, order, "{0} == 0".format(b[1]))
+            self.emit("{0}.var_type = 'int'".format(dest))
+            self.emit("{0}.value = {1}".format(dest, ARITHMETIC[opcode].format(a[1], b[1])))
+            return "int"
+
+        elif opcode in COMPARISONS and len(ops) == 3 and entry.operand_type is not None:
+            dest = self.operand(k, 0, ops[0])[0]
+            a = self.operand(k, 1, ops[1])
+            b = self.operand(k, 2, ops[2])
+            if not self.typeGuard(k, order, [a, b], entry.operand_type):
+                self.guardExit(k, order, "True")
+                return
+            self.emit("{0}.var_type = {1!r}".format(dest, entry.operand_type))
+            self.emit("{0}.value = 'true' if {1} {2} {3} else 'false'".format(dest, a[1], COMPARISONS[opcode], b[1]))
+            return entry.operand_type
+
+        elif opcode == "CONCAT" and len(ops) == 3:
+            dest = self.operand(k, 0, ops[0])[0]
+            a = self.operand(k, 1, ops[1])
+            b = self.operand(k, 2, ops[2])
+            if not self.typeGuard(k, order, [a, b], "string"):
+                self.guardExit(k, order, "True")
+                return
+            self.emit("{0}.var_type = 'string'".format(dest))
+            self.emit("{0}.value = {1} + {2}".format(dest, a[1], b[1]))
+            return "string"
+
+        elif opcode == "MOVE" and len(ops) == 2:
+            dest = self.operand(k, 0, ops[0])[0]
+            var, value, v_type = self.operand(k, 1, ops[1])
+            if var is not None:
+                #Uninitialized source or a value defaulted by its type, leave it to the generic execute
+                self.guardExit(k, order, "{0}.var_type is None or {1} is None".format(var, value))
+                self.emit("{0}.var_type = {1}.var_type".format(dest, var))
+            else:
+                self.emit("{0}.var_type = {1!r}".format(dest, v_type))
+            self.emit("{0}.value = {1}".format(dest, value))
+
+        elif opcode in CONDITIONAL_JUMPS and len(ops) == 3 and entry.operand_type is not None:
+            a = self.operand(k, 1, ops[1])
+            b = self.operand(k, 2, ops[2])
+            if not self.typeGuard(k, order, [a, b], entry.operand_type):
+                self.guardExit(k, order, "True")
+                return
+            equal = entry.taken == (opcode == "JUMPIFEQ")
+            #Leave the trace when the branch goes the other way than it was recorded
+            self.guardExit(k, order, "{0} {1} {2}".format(a[1], "!=" if equal else "==", b[1]))
+
+        else:
+            self.emitGeneric(k, instruction)
+
+    def compile(self):
+        trace = self.trace
+        recorder = self.recorder
+        self.emit("def trace(interpreter, limit):", 0)
+        self.emit("n = 0", 1)
+        if recorder is not None:
+            #e is the entry being executed, when it raises the entries before it were executed
+            self.emit("e = 0", 1)
+            self.emit("try:", 1)
+            self.shift = 1
+        self.emit("while n < limit:", 1)
+        for k, entry in enumerate(trace.entries):
+            self.emit("# {0} (order {1})".format(entry.instruction.opcode, entry.instruction.order))
+            if recorder is not None:
+                self.emit("e = {0}".format(k))
+            self.recordEntry(k, entry, self.emitEntry(k, entry))
+        if recorder is not None:
+            self.bind("events_append", recorder.events.append)
+            self.bind("values_append", recorder.values.append)
+            self.bind("prefixes", tuple(recorder.path(self.items[:k]) for k in range(len(self.items))))
+            self.emit("events_append({0})".format(recorder.path(self.items)))
+        self.emit("n += 1")
+        self.emit("interpreter.instructionCounter = {0}".format(trace.start), 1)
+        self.emit("return n, -1", 1)
+        if recorder is not None:
+            self.shift = 0
+            self.emit("except BaseException:", 1)
+            self.emit("if e:")
+            self.emit("events_append(prefixes[e])", 3)
+            self.emit("raise")
+
+        trace.source = "\n".join(self.lines) + "\n"
+        exec(compile(trace.source, "<trace {0}>".format(trace.label), "exec"), self.namespace)
+        trace.function = self.namespace["trace"]
+        return trace
+
+def observedType(instruction):
+    """Type of the compared operands, None if the instruction compares nothing"""
+    if instruction.opcode not in COMPARISONS and instruction.opcode not in CONDITIONAL_JUMPS:
+        return None
+    if len(instruction.ops_list) != 3:
+        return None
+    return instruction.ops_list[1].toVar().var_type
+
+def record(interpreter, program, start, max_length, total, budget):
+    """Executes the loop starting at order start once and records it, total is
+    the order behind the last instruction (Interpreter.totalInstructions)
+
+    Returns (compiled Trace or None, number of executed instructions). None is
+    returned if the loop cannot be traced or if budget instructions were executed
+    before the loop closed, so the next check of the limits is not delayed. The
+    interpreter is left in a consistent state in all cases, the instruction
+    counter points to the next instruction to be executed. The caller counts the
+    executed instructions, only if an instruction raises they are added to the
+    executed instruction count of the interpreter here. A program decoded on
+    access knows only the decoded instructions, so its length can not be used."""
+    label = program[start - 1].ops_list[0].value
+    entries = list()
+
+    recorder = interpreter.execTrace
+    try:
+        while len(entries) < max_length and len(entries) < budget:
+            order = interpreter.instructionCounter
+            if order == total:
+                return None, len(entries) #The program ended
+
+            instruction = program[order]
+            if instruction.opcode == "LABEL":
+                interpreter.instructionCounter = order + 1
+                continue
+            if instruction.opcode in UNTRACEABLE:
+                return None, len(entries)
+
+            instruction.execute()
+            counter = interpreter.instructionCounter + 1
+            interpreter.instructionCounter = counter
+            if recorder is not None:
+                recorder.step(instruction, counter)
+
+            entries.append(TraceEntry(instruction, counter != order + 1, observedType(instruction)))
+            if counter == start and counter <= order:
+                return TraceCompiler(Trace(start, label, entries), recorder).compile(), len(entries)
+    except BaseException:
+        interpreter.executedInstructions += len(entries)
+        raise
+
+    return None, len(entries)
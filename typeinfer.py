@@ -0,0 +1,165 @@
+import cfg
+import instruct as ins
+
+#Opcodes writing a value of a fixed type into their first operand
+RESULT_TYPES = {"ADD": "int", "SUB": "int", "MUL": "int", "IDIV": "int",
+                "STRLEN": "int", "STRI2INT": "int",
+                "CONCAT": "string", "INT2CHAR": "string", "GETCHAR": "string",
+                "TYPE": "string", "SETCHAR": "string",
+                "AND": "bool", "OR": "bool", "NOT": "bool"}
+
+#Opcodes whose result has the type of the compared operands
+COMPARE_OPCODES = {"LT", "GT", "EQ"}
+
+#Instructions which can be replaced by their int-only variant
+INT_VARIANTS = {"ADD": ins.Ins_ADD_Int,
+                "SUB": ins.Ins_SUB_Int,
+                "MUL": ins.Ins_MUL_Int,
+                "IDIV": ins.Ins_IDIV_Int}
+
+#Compare instructions which can drop the check that both operands have the same type
+COMPARE_VARIANTS = {"LT": ins.Ins_LT_Same,
+                    "GT": ins.Ins_GT_Same,
+                    "EQ": ins.Ins_EQ_Same}
+
+class TypeInference:
+    """Forward dataflow analysis inferring variable types before every instruction"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.graph = cfg.ControlFlowGraph(interpreter)
+        self.entries = dict() #Block start -> {variable: type} known when the block is entered
+        self.states = dict() #order -> {variable: type} known before the instruction
+
+    @staticmethod
+    def operandType(operand, state):
+        """Returns the type of the operand if it is known, None otherwise"""
+        if operand.v_type == "var":
+            return state.get(operand.value)
+        elif operand.v_type in {"int", "bool", "string"}:
+            return operand.v_type
+        return None
+
+    @staticmethod
+    def dropFrame(state, prefix):
+        for name in [n for n in state if n.startswith(prefix)]:
+            del state[name]
+
+    def transfer(self, instruction, state):
+        """Returns the state after the instruction is executed"""
+        state = dict(state)
+        opcode = instruction.opcode
+        ops = instruction.ops_list
+
+        if opcode == "CREATEFRAME":
+            self.dropFrame(state, "TF@")
+            return state
+        if opcode in {"PUSHFRAME", "POPFRAME"}:
+            self.dropFrame(state, "TF@")
+            self.dropFrame(state, "LF@")
+            return state
+
+        if not ops or ops[0].v_type != "var":
+            return state
+
+        dest = ops[0].value
+        if opcode in RESULT_TYPES:
+            result = RESULT_TYPES[opcode]
+        elif opcode in COMPARE_OPCODES and len(ops) == 3:
+            #Both operands have the same type if the execution got past the instruction
+            result = self.operandType(ops[1], state) or self.operandType(ops[2], state)
+        elif opcode == "MOVE" and len(ops) == 2:
+            result = self.operandType(ops[1], state)
+        elif opcode == "READ" and len(ops) == 2 and ops[1].v_type == "type":
+            result = ops[1].value if ops[1].value in {"int", "bool", "string"} else None
+        elif opcode in {"DEFVAR", "POPS"}:
+            result = None
+        else:
+            return state
+
+        if result is None:
+            state.pop(dest, None)
+        else:
+            state[dest] = result
+        return state
+
+    @staticmethod
+    def join(old, new):
+        """Keeps only the facts both states agree on"""
+        return {name: t for name, t in old.items() if new.get(name) == t}
+
+    def run(self):
+        graph = self.graph
+        if graph.entry is None:
+            return
+
+        self.entries[graph.entry.start] = dict() #Nothing is known at the program entry
+        worklist = [graph.entry.start]
+        while worklist:
+            block = graph.blocks[worklist.pop()]
+            out = self.entries[block.start]
+            for instruction in block.instructions:
+                out = self.transfer(instruction, out)
+
+            for succ in block.successors:
+                if succ not in self.entries:
+                    self.entries[succ] = out
+                else:
+                    joined = self.join(self.entries[succ], out)
+                    if len(joined) == len(self.entries[succ]):
+                        continue #No change, facts can only be removed by the join
+                    self.entries[succ] = joined
+                worklist.append(succ)
+
+        #Inside a block every instruction has the previous one as its only predecessor
+        for start, state in self.entries.items():
+            for instruction in graph.blocks[start].instructions:
+                self.states[instruction.order] = state
+                state = self.transfer(instruction, state)
+
+    def specializedVariant(self, instruction):
+        """Returns specialized replacement of the instruction or None"""
+        state = self.states.get(instruction.order)
+        ops = instruction.ops_list
+        if state is None or len(ops) != 3:
+            return None #Unreachable or malformed instruction, keep the generic one
+
+        opcode = instruction.opcode
+        type1 = self.operandType(ops[1], state)
+        type2 = self.operandType(ops[2], state)
+        if type1 is None or type1 != type2:
+            return None
+
+        if opcode in INT_VARIANTS and type1 == "int":
+            variant = INT_VARIANTS[opcode](instruction.order)
+        elif opcode in COMPARE_VARIANTS:
+            variant = COMPARE_VARIANTS[opcode](instruction.order, type1)
+        elif opcode == "CONCAT" and type1 == "string":
+            variant = ins.Ins_CONCAT_Str(instruction.order)
+        else:
+            return None
+
+        variant.ops_list = ops
+        return variant
+
+def specialize(interpreter):
+    """Replaces instructions with proven operand types by their specialized variants
+
+    Returns dictionary with number of candidate and specialized sites per opcode"""
+    analysis = TypeInference(interpreter)
+    analysis.run()
+
+    report = dict()
+    for i, instruction in enumerate(interpreter.instruction_list):
+        opcode = instruction.opcode
+        if opcode not in INT_VARIANTS and opcode not in COMPARE_VARIANTS and opcode != "CONCAT":
+            continue
+
+        counts = report.setdefault(opcode, [0, 0]) #[specialized, candidates]
+        counts[1] += 1
+        variant = analysis.specializedVariant(instruction)
+        if variant is not None:
+            interpreter.instruction_list[i] = variant
+            counts[0] += 1
+
+    return report